@@ -0,0 +1,119 @@
+"""
+Check that command handlers awaiting ``services.run_blocking`` overlap and keep the event loop responsive.
+
+A synthetic user list is written to a temporary directory, then a mix of
+!quest, !done, !profile and !leaderboard calls is fired concurrently the
+way bot.py dispatches them. A heartbeat task measures how long the event
+loop is ever prevented from running; calling the same functions inline
+would stall it for the whole run. Exits non-zero if commands did not
+overlap or the loop stalled for longer than --max-stall seconds.
+
+Usage: python benchmarks/concurrent_commands.py [--users N] [--commands N] [--max-stall SECONDS]
+"""
+import argparse
+import asyncio
+import os
+import shutil
+import sys
+import time
+
+from synthetic import REPO_ROOT, make_dataset_dir
+
+sys.path.insert(0, REPO_ROOT)
+
+HEARTBEAT_INTERVAL = 0.005
+
+
+async def heartbeat(stop: asyncio.Event, stalls: list) -> None:
+    """Record how late each wake-up of the event loop is."""
+    while not stop.is_set():
+        start = time.perf_counter()
+        await asyncio.sleep(HEARTBEAT_INTERVAL)
+        stalls.append(time.perf_counter() - start - HEARTBEAT_INTERVAL)
+
+
+def max_in_flight(intervals: list) -> int:
+    """Largest number of commands whose [start, end) intervals overlap."""
+    events = sorted([(start, 1) for start, _ in intervals] + [(end, -1) for _, end in intervals])
+    current = peak = 0
+    for _, step in events:
+        current += step
+        peak = max(peak, current)
+    return peak
+
+
+async def run(args) -> int:
+    from services import run_blocking
+    from quest_generator import generate_quest, complete_user_quest
+    from stats import get_user_stats, get_leaderboard
+    from storage import get_backend
+
+    get_backend().all_users()  # load the dataset before measuring
+
+    intervals = []
+
+    def timed(func, *func_args):
+        start = time.perf_counter()
+        result = func(*func_args)
+        intervals.append((start, time.perf_counter()))
+        return result
+
+    commands = []
+    for i in range(args.commands):
+        username = f"diver{i}"
+        commands += [
+            (generate_quest, username, 1 + i % 3),
+            (complete_user_quest, username),
+            (get_user_stats, username),
+        ]
+        if i % 4 == 0:
+            commands.append((get_leaderboard,))
+
+    stop = asyncio.Event()
+    stalls = []
+    heartbeat_task = asyncio.create_task(heartbeat(stop, stalls))
+
+    start = time.perf_counter()
+    await asyncio.gather(*(run_blocking(timed, *command) for command in commands))
+    elapsed = time.perf_counter() - start
+
+    stop.set()
+    await heartbeat_task
+
+    peak = max_in_flight(intervals)
+    worst_stall = max(stalls) if stalls else 0.0
+    print(f"commands:           {len(commands)} in {elapsed:.3f}s")
+    print(f"max in flight:      {peak}")
+    print(f"heartbeats:         {len(stalls)}")
+    print(f"worst loop stall:   {worst_stall * 1000:.1f} ms")
+
+    if peak < 2:
+        print("FAIL: commands never overlapped")
+        return 1
+    if worst_stall > args.max_stall:
+        print(f"FAIL: event loop stalled for more than {args.max_stall * 1000:.0f} ms")
+        return 1
+    print("OK")
+    return 0
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--users", type=int, default=50_000)
+    parser.add_argument("--commands", type=int, default=40)
+    parser.add_argument("--max-stall", type=float, default=0.5)
+    args = parser.parse_args()
+
+    directory = make_dataset_dir(args.users)
+    try:
+        os.chdir(directory)
+        return asyncio.run(run(args))
+    finally:
+        from storage import get_backend
+        get_backend().flush()
+        os.chdir(REPO_ROOT)
+        shutil.rmtree(directory, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,104 @@
+"""
+Benchmark team-quest DM fan-out against a fake ``discord.User`` stand-in.
+
+Each fake user answers ``send`` after a simulated round-trip. A fraction of
+them have DMs disabled (403), hit a rate limit (429 with Retry-After) on
+their first attempt, or fail once with a transient 503. The old sequential
+loop is timed against ``fanout.send_to_all``, and both delivery reports are
+printed.
+
+Usage: python benchmarks/dm_fanout.py [--squads N] [--squad-size N] [--latency SECONDS] [--concurrency N]
+"""
+import argparse
+import asyncio
+import random
+import sys
+import time
+
+from synthetic import REPO_ROOT
+
+sys.path.insert(0, REPO_ROOT)
+
+from fanout import send_to_all  # noqa: E402
+
+
+class FakeHTTPError(Exception):
+    """Carries an HTTP status like discord.HTTPException."""
+
+    def __init__(self, status: int, retry_after: float = None):
+        super().__init__(f"HTTP {status}")
+        self.status = status
+        self.retry_after = retry_after
+
+
+class FakeUser:
+    """Stand-in for discord.User with a configurable failure mode."""
+
+    def __init__(self, name: str, latency: float, mode: str):
+        self.name = name
+        self.latency = latency
+        self.mode = mode
+        self.attempts = 0
+
+    async def send(self, content: str) -> None:
+        self.attempts += 1
+        await asyncio.sleep(self.latency)
+        if self.mode == "forbidden":
+            raise FakeHTTPError(403)
+        if self.mode == "rate_limited" and self.attempts == 1:
+            raise FakeHTTPError(429, retry_after=0.2)
+        if self.mode == "flaky" and self.attempts == 1:
+            raise FakeHTTPError(503)
+
+
+def make_users(count: int, latency: float, seed: int = 7) -> list:
+    rng = random.Random(seed)
+    modes = ["ok"] * 90 + ["forbidden"] * 4 + ["rate_limited"] * 3 + ["flaky"] * 3
+    return [FakeUser(f"diver{i}", latency, rng.choice(modes)) for i in range(count)]
+
+
+async def send_sequentially(users: list, message: str) -> tuple:
+    """The original send_dm_to_users loop: one DM at a time, no retries."""
+    successful = failed = 0
+    for user in users:
+        try:
+            await user.send(message)
+            successful += 1
+        except FakeHTTPError:
+            failed += 1
+    return successful, failed
+
+
+async def run(args) -> None:
+    count = args.squads * args.squad_size
+    message = "🎯 **TEAM QUEST ALERT**"
+
+    users = make_users(count, args.latency)
+    start = time.perf_counter()
+    successful, failed = await send_sequentially(users, message)
+    sequential = time.perf_counter() - start
+    print(f"sequential:  {sequential:.2f}s  delivered {successful}/{count}, no retries")
+
+    users = make_users(count, args.latency)
+    start = time.perf_counter()
+    report = await send_to_all(users, message, concurrency=args.concurrency)
+    concurrent = time.perf_counter() - start
+    print(f"fan-out:     {concurrent:.2f}s  delivered {len(report.delivered)}/{count}, "
+          f"{sum(u.attempts for u in users) - count} retries")
+    for name, reason in report.failed.items():
+        print(f"  failed {name}: {reason}")
+    print(f"speed-up:    {sequential / concurrent:.1f}x")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--squads", type=int, default=24)
+    parser.add_argument("--squad-size", type=int, default=4)
+    parser.add_argument("--latency", type=float, default=0.15)
+    parser.add_argument("--concurrency", type=int, default=5)
+    args = parser.parse_args()
+    asyncio.run(run(args))
+
+
+if __name__ == "__main__":
+    main()
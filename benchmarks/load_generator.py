@@ -0,0 +1,216 @@
+"""
+Replay command streams against the headless QuestEngine and report throughput.
+
+A stream is JSONL in the format the bot writes when COMMAND_LOG is set:
+one ``{"ts", "guild", "user", "content", "mentions"}`` object per command,
+e.g. ``{"guild": 1, "user": "diver7", "content": "!tquest 2 <@1> <@2>",
+"mentions": ["diver7", "diver9"]}``. Without --stream a synthetic stream is
+generated (and can be saved with --record).
+
+Every simulated user is a coroutine that issues its own commands in order,
+and all users run concurrently through ``services.run_blocking``, as they
+would in the bot, so latencies include waiting for a storage worker.
+Team-quest IDs in a recorded stream mean nothing in a
+fresh dataset, so ``!tdone`` completes the newest team quest this run created
+for that user instead. ``!SOS``, ``!dm`` and ``!metrics`` never reach the
+engine and are counted without doing anything. Guild 1 (and DMs) use the
+pre-generated population; the other guilds start empty.
+
+Usage:
+    python benchmarks/load_generator.py [--stream PATH | --users N --commands N --guilds N]
+                                        [--record PATH] [--population N] [--backend json|binary|sqlite]
+                                        [--workers N]
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import shutil
+import sys
+import time
+from collections import defaultdict
+from typing import Dict, List, Optional, Tuple
+
+from synthetic import REPO_ROOT, make_dataset_dir
+
+# Weighted mix of commands in a synthetic stream.
+COMMAND_MIX = {
+    "quest": 30, "done": 20, "abandon": 5, "profile": 15, "leaderboard": 10,
+    "tquest": 5, "tdone": 5, "tactive": 10,
+}
+
+
+def synthetic_stream(users: int, commands: int, guilds: int, population: int, seed: int) -> List[dict]:
+    """Commands from ``users`` simulated users spread over ``guilds`` guilds."""
+    rng = random.Random(seed)
+    names, weights = zip(*COMMAND_MIX.items())
+    stream = []
+    for i in range(commands):
+        user = f"diver{rng.randrange(min(users, population))}"
+        command = rng.choices(names, weights)[0]
+        mentions = []
+        content = f"!{command}"
+        if command in ("quest", "tquest"):
+            content += f" {rng.randint(1, 3)}"
+        if command == "tquest":
+            mentions = [user] + [f"diver{rng.randrange(population)}" for _ in range(rng.randint(1, 3))]
+            content += " " + " ".join(f"<@{name}>" for name in mentions)
+        if command == "tactive" and rng.random() < 0.5:
+            content += " me"
+        if command in ("leaderboard", "tactive") and rng.random() < 0.3:
+            content += f" {rng.randint(2, 5)}"
+        stream.append({"ts": i, "guild": 1 + rng.randrange(guilds) if guilds else None,
+                       "user": user, "content": content, "mentions": mentions})
+    return stream
+
+
+def load_stream(path: str) -> List[dict]:
+    with open(path, "r") as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+# Commands that never reach the QuestEngine; replaying them is a no-op.
+ENGINELESS_COMMANDS = ("sos", "dm", "metrics")
+
+
+def engine_call(entry: dict, team_quests: Dict[tuple, List[str]]) -> Optional[Tuple[str, list]]:
+    """
+    The QuestEngine method and arguments for one stream entry, or None for
+    ``ENGINELESS_COMMANDS``. ``!tdone`` takes the newest ID in
+    ``team_quests`` for that user; see ``remember``.
+    """
+    parts = entry["content"].split()
+    command, args = parts[0].lstrip("!").lower(), parts[1:]
+    user, guild, mentions = entry["user"], entry.get("guild"), entry.get("mentions", [])
+    difficulty = int(args[0]) if args and args[0].isdigit() else 1
+    page = int(args[-1]) if args and args[-1].isdigit() else 1
+
+    if command in ENGINELESS_COMMANDS:
+        return None
+    if command in ("quest", "tquest"):
+        return command, ([user, difficulty, guild] if command == "quest" else [mentions, difficulty, guild])
+    if command in ("done", "abandon", "profile"):
+        return command, [user, guild]
+    if command == "serverstats":
+        return "server_stats", [guild]
+    if command == "event":
+        mode = args[0].lower() if args and not args[0].isdigit() else "solo"
+        numbers = [int(arg) for arg in args if arg.isdigit()]
+        difficulty = numbers[0] if numbers else 1
+        squad_size = numbers[1] if len(numbers) > 1 else 4
+        return command, [mentions, mode, difficulty, squad_size, guild]
+    if command == "leaderboard":
+        period = next((arg for arg in args if not arg.isdigit()), None)
+        return command, [guild, period, page]
+    if command == "tdone":
+        created = team_quests[(guild, user)]
+        return command, [created.pop() if created else (args[0] if args else "missing"), guild]
+    if command == "tactive":
+        player = mentions[0] if mentions else user if "me" in args else None
+        return command, [player, guild, page]
+    raise ValueError(f"unknown command {command!r}")
+
+
+def remember(entry: dict, method: str, result, team_quests: Dict[tuple, List[str]]) -> None:
+    """Note the ID of a team quest the entry created, for that user's next ``!tdone``."""
+    if method == "tquest" and result[0] is not None:
+        team_quests[(entry.get("guild"), entry["user"])].append(result[0].quest_id)
+
+
+class Replayer:
+    """Turns stream entries into QuestEngine calls and times them."""
+
+    def __init__(self, engine=None):
+        if engine is None:
+            from engine import engine
+        self.engine = engine
+        self.latencies: Dict[str, List[float]] = defaultdict(list)
+        self.errors: Dict[str, int] = defaultdict(int)
+        self.team_quests: Dict[tuple, List[str]] = defaultdict(list)
+
+    def execute(self, entry: dict) -> None:
+        """Run one command synchronously; called on a storage worker thread."""
+        call = engine_call(entry, self.team_quests)
+        if call is None:
+            return
+        method, args = call
+        remember(entry, method, getattr(self.engine, method)(*args), self.team_quests)
+
+    async def run_user(self, entries: List[dict]) -> None:
+        from services import run_blocking
+        for entry in entries:
+            command = entry["content"].split()[0].lstrip("!").lower()
+            start = time.perf_counter()
+            try:
+                await run_blocking(self.execute, entry)
+            except Exception:
+                self.errors[command] += 1
+            self.latencies[command].append((time.perf_counter() - start) * 1000)
+
+    async def replay(self, stream: List[dict]) -> float:
+        """Replay the stream with one coroutine per user; return the wall time in seconds."""
+        by_user: Dict[tuple, List[dict]] = defaultdict(list)
+        for entry in stream:
+            by_user[(entry.get("guild"), entry["user"])].append(entry)
+        start = time.perf_counter()
+        await asyncio.gather(*(self.run_user(entries) for entries in by_user.values()))
+        return time.perf_counter() - start
+
+
+def percentile(samples: List[float], fraction: float) -> float:
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--stream", help="recorded JSONL command stream to replay")
+    parser.add_argument("--record", help="also save the replayed stream to this path")
+    parser.add_argument("--users", type=int, default=500, help="simulated users in a synthetic stream")
+    parser.add_argument("--commands", type=int, default=20000, help="commands in a synthetic stream")
+    parser.add_argument("--guilds", type=int, default=4, help="guilds in a synthetic stream (0 = DMs only)")
+    parser.add_argument("--population", type=int, default=10000, help="users in the pre-generated dataset")
+    parser.add_argument("--backend", choices=("json", "binary", "sqlite"), default="json")
+    parser.add_argument("--workers", type=int, help="storage worker threads (STORAGE_WORKERS)")
+    parser.add_argument("--seed", type=int, default=42)
+    args = parser.parse_args()
+
+    if args.stream:
+        stream = load_stream(args.stream)
+    else:
+        stream = synthetic_stream(args.users, args.commands, args.guilds, args.population, args.seed)
+    if args.record:
+        with open(args.record, "w") as f:
+            f.writelines(json.dumps(entry) + "\n" for entry in stream)
+
+    os.environ["STORAGE_BACKEND"] = args.backend
+    os.environ["LEGACY_GUILD_ID"] = "1"
+    if args.workers:
+        os.environ["STORAGE_WORKERS"] = str(args.workers)
+    directory = make_dataset_dir(args.population, team_quest_count=max(1, args.population // 20))
+    cwd = os.getcwd()
+    os.chdir(directory)
+    sys.path.insert(0, REPO_ROOT)
+    try:
+        start = time.perf_counter()
+        replayer = Replayer()
+        import_ms = (time.perf_counter() - start) * 1000
+        elapsed = asyncio.run(replayer.replay(stream))
+        replayer.engine.flush()
+    finally:
+        os.chdir(cwd)
+        shutil.rmtree(directory, ignore_errors=True)
+
+    users = len({(entry.get("guild"), entry["user"]) for entry in stream})
+    print(f"{len(stream):,} commands from {users:,} simulated users in {elapsed:.2f}s "
+          f"({len(stream) / elapsed:,.0f} commands/s, {args.backend} backend, engine import {import_ms:.0f} ms)")
+    print(f"{'command':<14}{'count':>8}{'errors':>8}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}")
+    for command, samples in sorted(replayer.latencies.items()):
+        print(f"{command:<14}{len(samples):>8}{replayer.errors[command]:>8}{percentile(samples, 0.5):>10.2f}"
+              f"{percentile(samples, 0.95):>10.2f}{percentile(samples, 0.99):>10.2f}")
+    return 1 if any(replayer.errors.values()) else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
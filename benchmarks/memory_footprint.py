@@ -0,0 +1,83 @@
+"""
+Measure resident memory per user for the JSON backend.
+
+A synthetic population (every tenth user on an active quest, one team quest
+per twenty users) is loaded in a fresh process. tracemalloc reports what the
+user store, the team-quest store and the rank index each keep alive once
+loading is done, and /proc/self/status gives the process's resident size
+after loading and its peak.
+
+Usage: python benchmarks/memory_footprint.py [--users N]
+"""
+import argparse
+import gc
+import os
+import resource
+import shutil
+import sys
+import tracemalloc
+
+from synthetic import REPO_ROOT, make_dataset_dir
+
+
+def resident_kb() -> int:
+    """Current VmRSS in KiB (Linux only; 0 elsewhere)."""
+    try:
+        with open("/proc/self/status", "r") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1])
+    except OSError:
+        pass
+    return 0
+
+
+def retained(func) -> int:
+    """Bytes still allocated after running ``func``."""
+    gc.collect()
+    before, _ = tracemalloc.get_traced_memory()
+    func()
+    gc.collect()
+    after, _ = tracemalloc.get_traced_memory()
+    return after - before
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--users", type=int, default=1_000_000)
+    parser.add_argument("--no-tracemalloc", action="store_true",
+                        help="skip the per-structure breakdown, which slows loading and inflates RSS")
+    args = parser.parse_args()
+
+    directory = make_dataset_dir(args.users, team_quest_count=max(1, args.users // 20))
+    cwd = os.getcwd()
+    os.chdir(directory)
+    sys.path.insert(0, REPO_ROOT)
+    try:
+        from leaderboard import get_rank_index
+        from storage import get_backend
+
+        backend = get_backend()
+        if not args.no_tracemalloc:
+            tracemalloc.start()
+        user_bytes = retained(lambda: backend.get_user("diver0"))
+        team_quest_bytes = retained(lambda: backend.get_team_quest("tq000000"))
+        rank_bytes = retained(get_rank_index)
+        tracemalloc.stop()
+
+        print(f"{args.users:,} users, {max(1, args.users // 20):,} team quests")
+        if not args.no_tracemalloc:
+            print(f"user store      {user_bytes / args.users:8.1f} B/user")
+            print(f"team quests     {team_quest_bytes / args.users:8.1f} B/user")
+            print(f"rank index      {rank_bytes / args.users:8.1f} B/user")
+        print(f"resident        {resident_kb() / 1024:8.1f} MiB "
+              f"(peak {resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024:.1f} MiB)")
+        backend.flush()
+    finally:
+        os.chdir(cwd)
+        shutil.rmtree(directory, ignore_errors=True)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,101 @@
+"""
+Measure the read cache on the burst of reads that follows the end of a raid.
+
+Each round awards points to one squad (a write) and then fires --burst
+concurrent !leaderboard, !tactive and !profile reads through
+``services.run_blocking``, the way bot.py dispatches them. The rounds run
+twice: once through the undecorated functions (``inspect.unwrap``) and once
+through ``read_cache``, and the script reports the time per burst and the
+cache's hit, miss and coalesced counts.
+
+Usage: python benchmarks/read_burst.py [--users N] [--team-quests N] [--rounds N] [--burst N]
+                                      [--backend json|binary|sqlite]
+"""
+import argparse
+import asyncio
+import inspect
+import os
+import random
+import shutil
+import sys
+import time
+
+from synthetic import REPO_ROOT, make_dataset_dir
+
+
+def read_mix(burst: int, squad: list, seed: int) -> list:
+    """The reads of one burst: everyone checks the board, the squad checks their profiles."""
+    rng = random.Random(seed)
+    reads = []
+    for i in range(burst):
+        kind = rng.choice(("leaderboard", "tactive", "profile"))
+        reads.append((kind, squad[i % len(squad)]))
+    return reads
+
+
+async def run_rounds(functions: dict, rounds: int, burst: int, users: int) -> float:
+    """Run every round and return the mean seconds per read burst."""
+    from services import run_blocking
+    from utils import award_points_to_players
+
+    total = 0.0
+    for round_number in range(rounds):
+        squad = [f"diver{(round_number * 4 + j) % users}" for j in range(4)]
+        award_points_to_players(squad, 100)
+        calls = []
+        for kind, username in read_mix(burst, squad, round_number):
+            args = (username,) if kind == "profile" else ()
+            calls.append(run_blocking(functions[kind], *args))
+        start = time.perf_counter()
+        await asyncio.gather(*calls)
+        total += time.perf_counter() - start
+    return total / rounds
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--users", type=int, default=100_000)
+    parser.add_argument("--team-quests", type=int, default=20_000)
+    parser.add_argument("--rounds", type=int, default=30)
+    parser.add_argument("--burst", type=int, default=24, help="concurrent reads after each write")
+    parser.add_argument("--backend", choices=("json", "binary", "sqlite"), default="json")
+    args = parser.parse_args()
+
+    os.environ["STORAGE_BACKEND"] = args.backend
+    directory = make_dataset_dir(args.users, args.team_quests)
+    cwd = os.getcwd()
+    os.chdir(directory)
+    sys.path.insert(0, REPO_ROOT)
+    try:
+        from metrics import registry
+        from storage import flush_all
+        from stats import get_leaderboard, get_user_stats
+        from team_quest_generator import get_active_team_quests
+
+        cached = {"leaderboard": get_leaderboard, "tactive": get_active_team_quests, "profile": get_user_stats}
+        # Unwrap every decorator (``@timed`` included) down to the original function.
+        uncached = {kind: inspect.unwrap(function) for kind, function in cached.items()}
+        asyncio.run(run_rounds(cached, 1, args.burst, args.users))  # load state outside the timings
+
+        uncached_seconds = asyncio.run(run_rounds(uncached, args.rounds, args.burst, args.users))
+        before = dict(registry.counters("helldiver_read_cache_requests_total"))
+        cached_seconds = asyncio.run(run_rounds(cached, args.rounds, args.burst, args.users))
+        results = {"hit": 0, "miss": 0, "coalesced": 0}
+        for labels, count in registry.counters("helldiver_read_cache_requests_total").items():
+            results[dict(labels)["result"]] += count - before.get(labels, 0)
+        flush_all()
+    finally:
+        os.chdir(cwd)
+        shutil.rmtree(directory, ignore_errors=True)
+
+    print(f"{args.users:,} users, {args.team_quests:,} team quests, {args.rounds} rounds of {args.burst} reads, "
+          f"{args.backend} backend")
+    print(f"uncached  {uncached_seconds * 1000:8.1f} ms per burst")
+    print(f"cached    {cached_seconds * 1000:8.1f} ms per burst "
+          f"({uncached_seconds / cached_seconds:.1f}x; {results['hit']:g} hits, {results['miss']:g} misses, "
+          f"{results['coalesced']:g} coalesced)")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
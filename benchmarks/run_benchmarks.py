@@ -0,0 +1,207 @@
+"""
+Benchmark suite for the quest, scoring and stats paths.
+
+For every population size a synthetic activity/ dataset is generated and a
+fresh worker process times each operation. The worker reports latency
+percentiles, bytes read and written through /proc/self/io, and the
+process's peak resident memory. Results are written to --output. With
+--baseline, any operation whose median or p95 latency, or any size whose
+peak memory, exceeds the baseline by more than --tolerance fails the run.
+
+Usage:
+    python benchmarks/run_benchmarks.py [--sizes 100,1000,10000,100000] [--backend json|binary|sqlite]
+                                        [--iterations N] [--output PATH]
+                                        [--baseline PATH] [--tolerance 0.5] [--save-baseline PATH]
+"""
+import argparse
+import inspect
+import json
+import os
+import random
+import resource
+import shutil
+import subprocess
+import sys
+import time
+from typing import Callable, Dict, List
+
+from synthetic import REPO_ROOT, make_dataset_dir
+
+RESULTS_DIR = os.path.join(REPO_ROOT, "benchmarks", "results")
+DEFAULT_OUTPUT = os.path.join(RESULTS_DIR, "latest.json")
+
+# Latency differences below this are measurement noise, whatever the ratio.
+MIN_REGRESSION_MS = 0.05
+
+
+def io_counters() -> Dict[str, int]:
+    """Bytes this process has read and written so far (Linux only; zeros elsewhere)."""
+    try:
+        with open("/proc/self/io", "r") as f:
+            fields = dict(line.split(": ") for line in f.read().splitlines())
+        return {"read": int(fields["rchar"]), "written": int(fields["wchar"])}
+    except (OSError, KeyError, ValueError):
+        return {"read": 0, "written": 0}
+
+
+def percentile(samples: List[float], fraction: float) -> float:
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+
+def measure(func: Callable[[int], object], iterations: int) -> Dict[str, float]:
+    """Call ``func(i)`` for every iteration and summarise its latency and I/O."""
+    samples = []
+    before = io_counters()
+    for i in range(iterations):
+        start = time.perf_counter()
+        func(i)
+        samples.append((time.perf_counter() - start) * 1000)
+    after = io_counters()
+    return {
+        "p50_ms": percentile(samples, 0.50),
+        "p95_ms": percentile(samples, 0.95),
+        "p99_ms": percentile(samples, 0.99),
+        "max_ms": max(samples),
+        "mean_ms": sum(samples) / len(samples),
+        "read_bytes_per_op": (after["read"] - before["read"]) / iterations,
+        "written_bytes_per_op": (after["written"] - before["written"]) / iterations,
+    }
+
+
+def run_worker(size: int, iterations: int) -> Dict[str, object]:
+    """Time every operation against the dataset in the current directory."""
+    sys.path.insert(0, REPO_ROOT)
+    from leaderboard import get_rank_index
+    from quest_generator import generate_quest, complete_user_quest
+    from stats import get_leaderboard, get_user_stats
+    from storage import get_backend
+    from team_quest_generator import generate_team_quest, complete_team_quest
+    from utils import award_points_to_players
+
+    rng = random.Random(42)
+    users = [f"diver{rng.randrange(size)}" for _ in range(iterations)]
+    squads = [[f"diver{rng.randrange(size)}" for _ in range(4)] for _ in range(iterations)]
+    results: Dict[str, object] = {}
+
+    start = time.perf_counter()
+    get_backend().get_user("diver0")
+    results["cold_start_ms"] = (time.perf_counter() - start) * 1000
+
+    start = time.perf_counter()
+    get_rank_index()
+    results["rank_index_build_ms"] = (time.perf_counter() - start) * 1000
+
+    team_quest_ids = []
+
+    def create_team_quest(i: int) -> None:
+        team_quest, _ = generate_team_quest(squads[i], 1 + i % 3)
+        team_quest_ids.append(team_quest.quest_id)
+
+    ops = {
+        "generate_quest": lambda i: generate_quest(users[i], 1 + i % 3),
+        "complete_user_quest": lambda i: complete_user_quest(users[i]),
+        "award_points_to_players": lambda i: award_points_to_players(squads[i], 100),
+        "generate_team_quest": create_team_quest,
+        "complete_team_quest": lambda i: complete_team_quest(team_quest_ids[i]),
+        # The read cache would turn these into dictionary lookups; time the queries themselves,
+        # and the cached entry points separately.
+        "get_leaderboard": lambda i: inspect.unwrap(get_leaderboard)(),
+        "get_user_stats": lambda i: inspect.unwrap(get_user_stats)(users[i]),
+        "get_leaderboard_cached": lambda i: get_leaderboard(),
+        "get_user_stats_cached": lambda i: get_user_stats(users[i]),
+    }
+    results["ops"] = {name: measure(func, iterations) for name, func in ops.items()}
+    results["ops"]["flush"] = measure(lambda i: get_backend().flush(), 1)
+    results["peak_rss_kb"] = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return results
+
+
+def run_size(size: int, args) -> Dict[str, object]:
+    """Generate a dataset and benchmark it in a fresh interpreter."""
+    directory = make_dataset_dir(size, team_quest_count=max(1, size // 20))
+    try:
+        env = dict(os.environ, STORAGE_BACKEND=args.backend)
+        output = subprocess.run(
+            [sys.executable, os.path.abspath(__file__), "--worker", str(size), "--iterations", str(args.iterations)],
+            cwd=directory, env=env, check=True, capture_output=True, text=True,
+        ).stdout
+        return json.loads(output.strip().splitlines()[-1])
+    finally:
+        shutil.rmtree(directory, ignore_errors=True)
+
+
+def print_report(results: Dict[str, object]) -> None:
+    for size, result in results["sizes"].items():
+        print(f"\n== {int(size):,} users ({results['backend']}) ==")
+        print(f"cold start {result['cold_start_ms']:.1f} ms, rank index build {result['rank_index_build_ms']:.1f} ms, "
+              f"peak RSS {result['peak_rss_kb'] / 1024:.1f} MiB")
+        print(f"{'operation':<26}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'max ms':>10}{'read B/op':>12}{'write B/op':>12}")
+        for name, op in result["ops"].items():
+            print(f"{name:<26}{op['p50_ms']:>10.3f}{op['p95_ms']:>10.3f}{op['p99_ms']:>10.3f}{op['max_ms']:>10.3f}"
+                  f"{op['read_bytes_per_op']:>12.0f}{op['written_bytes_per_op']:>12.0f}")
+
+
+def find_regressions(results: Dict[str, object], baseline: Dict[str, object], tolerance: float) -> List[str]:
+    """Compare against a stored baseline and describe every regression beyond ``tolerance``."""
+    regressions = []
+    for size, result in results["sizes"].items():
+        base = baseline.get("sizes", {}).get(size)
+        if base is None:
+            continue
+        for name, op in result["ops"].items():
+            base_op = base["ops"].get(name)
+            if base_op is None:
+                continue
+            for metric in ("p50_ms", "p95_ms"):
+                limit = base_op[metric] * (1 + tolerance)
+                if op[metric] > limit and op[metric] - base_op[metric] > MIN_REGRESSION_MS:
+                    regressions.append(f"{size} users, {name} {metric}: {op[metric]:.3f} > {base_op[metric]:.3f} baseline")
+        if result["peak_rss_kb"] > base["peak_rss_kb"] * (1 + tolerance):
+            regressions.append(f"{size} users, peak RSS: {result['peak_rss_kb']} KiB > {base['peak_rss_kb']} KiB baseline")
+    return regressions
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--sizes", default="100,1000,10000,100000",
+                        help="comma-separated population sizes, up to 1000000")
+    parser.add_argument("--backend", choices=("json", "binary", "sqlite"), default="json")
+    parser.add_argument("--iterations", type=int, default=200)
+    parser.add_argument("--output", default=DEFAULT_OUTPUT)
+    parser.add_argument("--baseline", help="fail if results regress against this results file")
+    parser.add_argument("--tolerance", type=float, default=0.5, help="allowed slowdown, 0.5 = 50%%")
+    parser.add_argument("--save-baseline", help="also store the results as a baseline at this path")
+    parser.add_argument("--worker", type=int, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.worker is not None:
+        print(json.dumps(run_worker(args.worker, args.iterations)))
+        return 0
+
+    results = {"backend": args.backend, "iterations": args.iterations, "sizes": {}}
+    for size in (int(s) for s in args.sizes.split(",")):
+        print(f"benchmarking {size:,} users...", file=sys.stderr)
+        results["sizes"][str(size)] = run_size(size, args)
+    print_report(results)
+
+    for path in filter(None, (args.output, args.save_baseline)):
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        with open(path, "w") as f:
+            json.dump(results, f, indent=2)
+
+    if args.baseline:
+        with open(args.baseline, "r") as f:
+            baseline = json.load(f)
+        regressions = find_regressions(results, baseline, args.tolerance)
+        if regressions:
+            print("\nREGRESSIONS:")
+            for regression in regressions:
+                print(f"  {regression}")
+            return 1
+        print("\nNo regressions against the baseline.")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,109 @@
+"""
+Stress the per-user locks: fire thousands of concurrent score updates and check the final totals are exact.
+
+Worker threads mix team awards (award_points_to_players), solo
+!quest/!done cycles and !abandon calls on a small set of hot users, so
+many commands touch the same user at the same time. The expected score
+of every user is computed from the results the commands returned and
+compared with what the storage backend holds afterwards. Exits non-zero
+on any lost or duplicated update.
+
+Usage: python benchmarks/score_stress.py [--operations N] [--threads N] [--hot-users N] [--backend json|binary|sqlite]
+"""
+import argparse
+import os
+import random
+import shutil
+import sys
+import threading
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+
+from synthetic import REPO_ROOT, make_dataset_dir
+
+sys.path.insert(0, REPO_ROOT)
+
+
+def run(args) -> int:
+    from quest_generator import generate_quest, complete_user_quest, abandon_user_quest
+    from storage import get_backend
+    from utils import award_points_to_players
+
+    backend = get_backend()
+    hot_users = [f"diver{i}" for i in range(args.hot_users)]
+    for username in hot_users:
+        abandon_user_quest(username)  # start without quests of unknown difficulty
+    initial = {username: backend.get_user(username).score for username in hot_users}
+    difficulty = {username: 1 + i % 3 for i, username in enumerate(hot_users)}
+
+    expected = Counter()
+    expected_lock = threading.Lock()
+
+    def credit(username: str, points: int) -> None:
+        with expected_lock:
+            expected[username] += points
+
+    def operation(seed: int) -> None:
+        rng = random.Random(seed)
+        kind = rng.random()
+        if kind < 0.4:
+            squad = rng.sample(hot_users, rng.randint(1, 4))
+            points = rng.choice((100, 200, 300))
+            award_points_to_players(squad, points)
+            for username in squad:
+                credit(username, points)
+        elif kind < 0.9:
+            username = rng.choice(hot_users)
+            generate_quest(username, difficulty[username])
+            if complete_user_quest(username).startswith("Quest completed"):
+                credit(username, difficulty[username] * 100)
+        else:
+            abandon_user_quest(rng.choice(hot_users))
+
+    sys.setswitchinterval(1e-6)  # switch threads as often as possible to provoke races
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.threads) as pool:
+        list(pool.map(operation, range(args.operations)))
+    elapsed = time.perf_counter() - start
+
+    mismatches = []
+    for username in hot_users:
+        actual = backend.get_user(username).score
+        want = initial[username] + expected[username]
+        if actual != want:
+            mismatches.append((username, want, actual))
+
+    print(f"operations:  {args.operations} on {args.threads} threads in {elapsed:.2f}s")
+    print(f"points:      {sum(expected.values())} awarded across {len(hot_users)} users")
+    if mismatches:
+        for username, want, actual in mismatches:
+            print(f"MISMATCH {username}: expected {want}, stored {actual}")
+        return 1
+    print("OK: all totals exact")
+    return 0
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--operations", type=int, default=5000)
+    parser.add_argument("--threads", type=int, default=32)
+    parser.add_argument("--hot-users", type=int, default=16)
+    parser.add_argument("--users", type=int, default=1000)
+    parser.add_argument("--backend", choices=("json", "binary", "sqlite"), default="json")
+    args = parser.parse_args()
+
+    os.environ["STORAGE_BACKEND"] = args.backend
+    directory = make_dataset_dir(args.users)
+    try:
+        os.chdir(directory)
+        return run(args)
+    finally:
+        from storage import get_backend
+        get_backend().flush()
+        os.chdir(REPO_ROOT)
+        shutil.rmtree(directory, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
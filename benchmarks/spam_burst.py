@@ -0,0 +1,141 @@
+"""
+Latency of well-behaved users while a few accounts spam !quest/!abandon.
+
+Good users, spread over four guilds, each send a command from the
+synthetic mix every --interval seconds on average. Spammers in guild 1
+fire quest/abandon cycles at --spam-rate commands per second in total,
+without waiting for replies. Every command
+goes through ``throttle.admit`` (as bot.py's global check does) and then
+``services.run_blocking`` into the QuestEngine. The run is repeated with
+admission control switched off, and the script reports the good users'
+latency percentiles and how many spam commands got through.
+
+Usage: python benchmarks/spam_burst.py [--good-users N] [--interval S] [--spammers N] [--spam-rate N]
+                                       [--seconds N] [--population N] [--backend json|binary|sqlite]
+"""
+import argparse
+import asyncio
+import os
+import random
+import shutil
+import sys
+import time
+from collections import defaultdict
+from typing import Dict, List
+
+from load_generator import engine_call, percentile, remember, synthetic_stream
+from synthetic import REPO_ROOT, make_dataset_dir
+
+GUILD = 1
+GUILDS = 4
+
+
+class SpamRun:
+    """One timed run; ``throttle`` None lets every command through."""
+
+    def __init__(self, engine, throttle, seconds: float):
+        self.engine = engine
+        self.throttle = throttle
+        self.seconds = seconds
+        self.team_quests: Dict[tuple, List[str]] = defaultdict(list)
+        self.good_latencies: List[float] = []
+        self.counts: Dict[str, int] = defaultdict(int)
+        self.max_pending = 0
+
+    def execute(self, entry: dict) -> None:
+        call = engine_call(entry, self.team_quests)
+        if call is None:
+            return
+        method, args = call
+        remember(entry, method, getattr(self.engine, method)(*args), self.team_quests)
+
+    async def command(self, kind: str, entry: dict) -> None:
+        from services import pending_jobs, run_blocking
+        start = time.perf_counter()
+        pending = pending_jobs()
+        self.max_pending = max(self.max_pending, pending)
+        if self.throttle is not None:
+            command = entry["content"].split()[0].lstrip("!")
+            if self.throttle.admit(entry["user"], entry["guild"], command, pending) is not None:
+                self.counts[f"{kind} refused"] += 1
+                return
+        await run_blocking(self.execute, entry)
+        self.counts[f"{kind} ran"] += 1
+        if kind == "good":
+            self.good_latencies.append((time.perf_counter() - start) * 1000)
+
+    async def good_user(self, entries: List[dict], interval: float, rng: random.Random) -> None:
+        deadline = time.monotonic() + self.seconds
+        for entry in entries:
+            await asyncio.sleep(rng.expovariate(1 / interval))
+            if time.monotonic() >= deadline:
+                return
+            await self.command("good", entry)
+
+    async def spam(self, spammers: int, rate: float) -> None:
+        tasks = set()
+        deadline = time.monotonic() + self.seconds
+        cycle = 0
+        while time.monotonic() < deadline:
+            for _ in range(max(1, int(rate / 100))):
+                user = f"spammer{cycle % spammers}"
+                content = "!quest 1" if (cycle // spammers) % 2 == 0 else "!abandon"
+                task = asyncio.ensure_future(self.command("spam", {"guild": GUILD, "user": user,
+                                                                   "content": content, "mentions": []}))
+                tasks.add(task)
+                task.add_done_callback(tasks.discard)
+                cycle += 1
+            await asyncio.sleep(0.01)
+        await asyncio.gather(*tasks)
+
+    async def run(self, good_streams: List[List[dict]], interval: float, spammers: int, rate: float) -> None:
+        rng = random.Random(7)
+        await asyncio.gather(self.spam(spammers, rate),
+                             *(self.good_user(entries, interval, rng) for entries in good_streams))
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--good-users", type=int, default=400)
+    parser.add_argument("--interval", type=float, default=4.0, help="mean seconds between a good user's commands")
+    parser.add_argument("--spammers", type=int, default=10)
+    parser.add_argument("--spam-rate", type=float, default=3000, help="spam commands per second, all spammers")
+    parser.add_argument("--seconds", type=float, default=10)
+    parser.add_argument("--population", type=int, default=10000, help="users in the pre-generated dataset")
+    parser.add_argument("--backend", choices=("json", "binary", "sqlite"), default="json")
+    args = parser.parse_args()
+
+    stream = synthetic_stream(args.good_users, args.good_users * 50, 0, args.population, seed=42)
+    good_streams: Dict[str, List[dict]] = defaultdict(list)
+    for entry in stream:
+        good_streams[entry["user"]].append(dict(entry, guild=GUILD + int(entry["user"][5:]) % GUILDS))
+
+    os.environ["STORAGE_BACKEND"] = args.backend
+    os.environ["LEGACY_GUILD_ID"] = str(GUILD)
+    directory = make_dataset_dir(args.population, team_quest_count=max(1, args.population // 20))
+    cwd = os.getcwd()
+    os.chdir(directory)
+    sys.path.insert(0, REPO_ROOT)
+    try:
+        from engine import engine
+        from throttle import Throttle
+
+        print(f"{args.good_users} good users every {args.interval:g}s, {args.spammers} spammers at "
+              f"{args.spam_rate:,.0f} commands/s, {args.seconds:g}s, {args.backend} backend")
+        print(f"{'run':<12}{'good p50 ms':>12}{'good p99 ms':>12}{'good ran':>10}{'good refused':>14}"
+              f"{'spam ran':>10}{'max queue':>11}")
+        for label, throttle in (("unthrottled", None), ("throttled", Throttle())):
+            run = SpamRun(engine, throttle, args.seconds)
+            asyncio.run(run.run(list(good_streams.values()), args.interval, args.spammers, args.spam_rate))
+            print(f"{label:<12}{percentile(run.good_latencies, 0.5):>12.2f}{percentile(run.good_latencies, 0.99):>12.2f}"
+                  f"{run.counts['good ran']:>10}{run.counts['good refused']:>14}{run.counts['spam ran']:>10}"
+                  f"{run.max_pending:>11}")
+        engine.flush()
+    finally:
+        os.chdir(cwd)
+        shutil.rmtree(directory, ignore_errors=True)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,177 @@
+"""
+Throughput of the state server with several bot processes on one machine.
+
+For every mode and client count a fresh dataset and state_server.py process
+are started, and each client process replays its own synthetic command
+stream (see load_generator.py) through a ``RemoteEngine``:
+
+- sequential: one command at a time, waiting for each reply;
+- pipelined: up to --depth commands in flight on the connection;
+- batched: --depth commands per batch, one round trip each.
+
+The in-process baseline replays the same streams straight into the engine
+from one process, one command at a time. The script reports commands per
+second over all clients (timed by the slowest client) and the p50/p99
+latency of a command (of a whole batch in batched mode).
+
+Usage: python benchmarks/state_throughput.py [--clients 1,2,4,8] [--commands N] [--depth N]
+                                             [--population N] [--backend json|binary|sqlite]
+"""
+import argparse
+import multiprocessing
+import os
+import shutil
+import subprocess
+import sys
+import time
+from collections import defaultdict, deque
+from typing import List, Tuple
+
+from load_generator import engine_call, percentile, remember, synthetic_stream
+from synthetic import REPO_ROOT, make_dataset_dir
+
+MODES = ("sequential", "pipelined", "batched")
+SERVER_START_TIMEOUT = 60
+
+
+def client_stream(index: int, commands: int, population: int) -> List[dict]:
+    """Client ``index``'s commands; clients draw different users from the same population."""
+    return synthetic_stream(500, commands, 4, population, seed=1000 + index)
+
+
+def run_client(socket_path: str, mode: str, stream: List[dict], depth: int) -> Tuple[float, List[float]]:
+    """Replay ``stream`` through a RemoteEngine; return the elapsed seconds and latencies in ms."""
+    sys.path.insert(0, REPO_ROOT)
+    from state_server import RemoteEngine
+
+    engine = RemoteEngine(socket_path)
+    team_quests = defaultdict(list)
+    latencies = []
+    start = time.perf_counter()
+    if mode == "sequential":
+        for entry in stream:
+            call = engine_call(entry, team_quests)
+            if call is None:
+                continue
+            method, args = call
+            sent = time.perf_counter()
+            remember(entry, method, engine.call(method, *args), team_quests)
+            latencies.append((time.perf_counter() - sent) * 1000)
+    elif mode == "pipelined":
+        in_flight = deque()
+        for entry in stream + [None] * depth:
+            call = engine_call(entry, team_quests) if entry is not None else None
+            if call is not None:
+                method, args = call
+                in_flight.append((entry, method, time.perf_counter(), engine.submit(method, *args)))
+            if len(in_flight) >= depth or (entry is None and in_flight):
+                done, method, sent, future = in_flight.popleft()
+                remember(done, method, future.result(), team_quests)
+                latencies.append((time.perf_counter() - sent) * 1000)
+    else:
+        for first in range(0, len(stream), depth):
+            entries, calls = [], []
+            for entry in stream[first:first + depth]:
+                call = engine_call(entry, team_quests)
+                if call is not None:
+                    entries.append(entry)
+                    calls.append(call)
+            if not calls:
+                continue
+            sent = time.perf_counter()
+            results = engine.batch(calls)
+            latencies.append((time.perf_counter() - sent) * 1000)
+            for entry, (method, _), result in zip(entries, calls, results):
+                if not isinstance(result, Exception):
+                    remember(entry, method, result, team_quests)
+    elapsed = time.perf_counter() - start
+    engine.close()
+    return elapsed, latencies
+
+
+def run_in_process(directory: str, streams: List[List[dict]]) -> Tuple[float, List[float]]:
+    """Baseline: every stream straight into the engine, one command at a time, in one process."""
+    os.chdir(directory)
+    sys.path.insert(0, REPO_ROOT)
+    from engine import engine
+
+    team_quests = defaultdict(list)
+    latencies = []
+    start = time.perf_counter()
+    for entries in zip(*streams):
+        for entry in entries:
+            call = engine_call(entry, team_quests)
+            if call is None:
+                continue
+            method, args = call
+            sent = time.perf_counter()
+            remember(entry, method, getattr(engine, method)(*args), team_quests)
+            latencies.append((time.perf_counter() - sent) * 1000)
+    elapsed = time.perf_counter() - start
+    engine.flush()
+    return elapsed, latencies
+
+
+def start_server(directory: str, backend: str) -> Tuple[subprocess.Popen, str]:
+    socket_path = os.path.join(directory, "state.sock")
+    env = dict(os.environ, STORAGE_BACKEND=backend, LEGACY_GUILD_ID="1")
+    server = subprocess.Popen([sys.executable, os.path.join(REPO_ROOT, "state_server.py"), "--socket", socket_path],
+                              cwd=directory, env=env, stderr=subprocess.DEVNULL)
+    deadline = time.monotonic() + SERVER_START_TIMEOUT
+    while not os.path.exists(socket_path):
+        if server.poll() is not None or time.monotonic() > deadline:
+            raise RuntimeError("state server did not start")
+        time.sleep(0.05)
+    return server, socket_path
+
+
+def report(label: str, commands: int, elapsed: float, latencies: List[float]) -> None:
+    print(f"{label:<24}{commands / elapsed:>12,.0f}{percentile(latencies, 0.5):>10.2f}"
+          f"{percentile(latencies, 0.99):>10.2f}")
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--clients", default="1,2,4,8", help="comma-separated client process counts")
+    parser.add_argument("--commands", type=int, default=5000, help="commands per client")
+    parser.add_argument("--depth", type=int, default=16, help="commands in flight (pipelined) or per batch")
+    parser.add_argument("--population", type=int, default=10000, help="users in the pre-generated dataset")
+    parser.add_argument("--backend", choices=("json", "binary", "sqlite"), default="json")
+    args = parser.parse_args()
+    client_counts = [int(count) for count in args.clients.split(",")]
+
+    print(f"{args.commands:,} commands per client, depth {args.depth}, {args.population:,} users, "
+          f"{args.backend} backend")
+    print(f"{'run':<24}{'commands/s':>12}{'p50 ms':>10}{'p99 ms':>10}")
+    context = multiprocessing.get_context("spawn")
+    os.environ["STORAGE_BACKEND"] = args.backend
+    os.environ["LEGACY_GUILD_ID"] = "1"
+
+    for clients in client_counts:
+        streams = [client_stream(index, args.commands, args.population) for index in range(clients)]
+        directory = make_dataset_dir(args.population, team_quest_count=max(1, args.population // 20))
+        try:
+            with context.Pool(1) as pool:
+                elapsed, latencies = pool.apply(run_in_process, (directory, streams))
+            report(f"in-process x{clients}", clients * args.commands, elapsed, latencies)
+        finally:
+            shutil.rmtree(directory, ignore_errors=True)
+
+        for mode in MODES:
+            directory = make_dataset_dir(args.population, team_quest_count=max(1, args.population // 20))
+            server, socket_path = start_server(directory, args.backend)
+            try:
+                with context.Pool(clients) as pool:
+                    results = pool.starmap(run_client, [(socket_path, mode, stream, args.depth) for stream in streams])
+            finally:
+                server.terminate()
+                server.wait()
+                shutil.rmtree(directory, ignore_errors=True)
+            elapsed = max(client_elapsed for client_elapsed, _ in results)
+            latencies = [latency for _, client_latencies in results for latency in client_latencies]
+            report(f"{mode} x{clients}", clients * args.commands, elapsed, latencies)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,50 @@
+"""Synthetic activity/ datasets for the benchmark scripts."""
+import json
+import os
+import shutil
+import tempfile
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def synthetic_users(user_count: int) -> list:
+    """User entries in the user_list.json layout, every tenth one on an active quest."""
+    users = []
+    for i in range(user_count):
+        active_quest = None
+        if i % 10 == 0:
+            active_quest = {"title": "Eliminate Bugs", "difficulty": 1, "description": "Clear out bugs."}
+        users.append({"username": f"diver{i}", "active_quest": active_quest, "score": (i * 7919) % 5000})
+    return users
+
+
+def synthetic_team_quests(team_quest_count: int, user_count: int) -> list:
+    """Team quest entries in the active_team_quest.json layout, four players each."""
+    team_quests = []
+    for i in range(team_quest_count):
+        players = [f"diver{(i * 4 + j) % max(user_count, 1)}" for j in range(4)]
+        team_quests.append({
+            "quest_id": f"tq{i:06d}",
+            "quest": {"difficulty": 1 + i % 3, "title": "Jetpack Joyride", "description": "The floor is lava!"},
+            "players": players,
+            "status": "in progress",
+        })
+    return team_quests
+
+
+def write_dataset(directory: str, user_count: int, team_quest_count: int = 0) -> None:
+    """Create activity/ and questLists/ under ``directory`` with a synthetic population."""
+    os.makedirs(os.path.join(directory, "activity"))
+    shutil.copytree(os.path.join(REPO_ROOT, "questLists"), os.path.join(directory, "questLists"))
+
+    with open(os.path.join(directory, "activity", "user_list.json"), "w") as f:
+        json.dump({"users": synthetic_users(user_count)}, f, indent=2)
+    with open(os.path.join(directory, "activity", "active_team_quest.json"), "w") as f:
+        json.dump({"team_quests": synthetic_team_quests(team_quest_count, user_count)}, f, indent=2)
+
+
+def make_dataset_dir(user_count: int, team_quest_count: int = 0) -> str:
+    """Write a dataset to a fresh temporary directory and return its path."""
+    directory = tempfile.mkdtemp(prefix="helldiver-bench-")
+    write_dataset(directory, user_count, team_quest_count)
+    return directory
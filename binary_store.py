@@ -0,0 +1,382 @@
+"""
+Binary snapshot format for user and team-quest state.
+
+A user snapshot is a header followed by column sections, each padded to
+8 bytes:
+
+- ``scores``: one int64 per row
+- ``quests``: one int32 per row, an index into the ref table or -1
+- ``name offsets``: row count + 1 uint64 offsets into the string table
+- ``name index``: uint32 row numbers sorted by UTF-8 username
+- ``refs``: the quest reference table as a JSON array of ``[id, difficulty]``
+- ``strings``: every username, UTF-8, back to back in row order
+
+The file is memory-mapped on startup. The score and quest columns are
+copied out with a single memcpy each; usernames stay in the mapping and are
+resolved by binary search over the name index, so a lookup never parses
+the whole population. A team-quest snapshot is a header, an offset column
+and one compact JSON record per quest.
+
+Columns are written in the host's byte order, recorded in the header. The
+JSON files remain the portable form: ``python binary_store.py export`` and
+``import`` convert between the two.
+"""
+import argparse
+import json
+import mmap
+import os
+import struct
+import sys
+from array import array
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+from metrics import record_io
+from schema import QuestRef
+from storage import JsonBackend
+from store import (
+    ACTIVE_TEAM_QUEST_PATH, FLUSH_INTERVAL, QUEST_BAGS_PATH, SCORE_DAYS_PATH, STATS_PATH, TEAM_QUEST_HISTORY_PATH,
+    USER_LIST_PATH, BagStore, HistoryLog, ScoreDayStore, StatsStore, TeamQuestStore, UserStore,
+)
+from journal import write_atomic
+
+
+USER_MAGIC = b"HDQU"
+TEAM_QUEST_MAGIC = b"HDQT"
+FORMAT_VERSION = 1
+BIG_ENDIAN = 1
+
+# magic, version, flags, seq, row count, then the offsets of the scores, quests,
+# name offsets, name index, refs and strings sections.
+USER_HEADER = struct.Struct("<4sHHQQ6Q")
+# magic, version, flags, seq, team quest count, offset of the records section.
+TEAM_QUEST_HEADER = struct.Struct("<4sHHQQQ")
+
+USER_BIN_PATH = os.path.splitext(USER_LIST_PATH)[0] + ".bin"
+TEAM_QUEST_BIN_PATH = os.path.splitext(ACTIVE_TEAM_QUEST_PATH)[0] + ".bin"
+
+
+def _flags() -> int:
+    return BIG_ENDIAN if sys.byteorder == "big" else 0
+
+
+def _check_header(path: str, magic: bytes, version: int, flags: int, expected_magic: bytes) -> None:
+    if magic != expected_magic:
+        raise ValueError(f"{path} is not a snapshot of this kind")
+    if version != FORMAT_VERSION:
+        raise ValueError(f"{path} has unsupported snapshot version {version}")
+    if flags & BIG_ENDIAN != _flags() & BIG_ENDIAN:
+        raise ValueError(f"{path} was written on a machine with a different byte order; "
+                         "export it to JSON there and import it here")
+
+
+def _padding(length: int) -> bytes:
+    return b"\0" * (-length % 8)
+
+
+def _write_file(path: str, header: bytes, sections: Sequence[Sequence[Any]]) -> None:
+    """Write a header and padded sections (each a list of byte buffers) to a temporary file, then rename it over ``path``."""
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(header)
+        f.write(_padding(len(header)))
+        for parts in sections:
+            length = 0
+            for part in parts:
+                f.write(part)
+                length += memoryview(part).nbytes
+            f.write(_padding(length))
+        f.flush()
+        os.fsync(f.fileno())
+        record_io("write", "snapshot", f.tell())
+    os.replace(tmp_path, path)
+
+
+def _section_offsets(header_size: int, lengths: Sequence[int]) -> List[int]:
+    offsets = []
+    position = header_size + (-header_size % 8)
+    for length in lengths:
+        offsets.append(position)
+        position += length + (-length % 8)
+    return offsets
+
+
+class UserSnapshot:
+    """Read-only view of a memory-mapped user snapshot."""
+
+    def __init__(self, path: str):
+        self.path = path
+        with open(path, "rb") as f:
+            self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        (magic, version, flags, self.seq, self.count,
+         scores_at, quests_at, offsets_at, index_at, refs_at, strings_at) = USER_HEADER.unpack_from(self._mmap)
+        _check_header(path, magic, version, flags, USER_MAGIC)
+
+        view = memoryview(self._mmap)
+        self.scores = view[scores_at:scores_at + 8 * self.count]
+        self.quests = view[quests_at:quests_at + 4 * self.count]
+        self.name_offsets = view[offsets_at:offsets_at + 8 * (self.count + 1)].cast("Q")
+        self.index = view[index_at:index_at + 4 * self.count].cast("I")
+        self.refs = [QuestRef(quest_id, difficulty)
+                     for quest_id, difficulty in json.loads(bytes(view[refs_at:strings_at]).rstrip(b"\0"))]
+        self.strings = view[strings_at:strings_at + self.name_offsets[self.count]]
+
+    def name_bytes(self, row: int) -> bytes:
+        return self.strings[self.name_offsets[row]:self.name_offsets[row + 1]].tobytes()
+
+    def name(self, row: int) -> str:
+        return self.name_bytes(row).decode()
+
+    def names(self) -> List[str]:
+        """Decode every username, in row order."""
+        strings = self.strings.tobytes()
+        offsets = self.name_offsets.tolist()
+        return [strings[start:end].decode() for start, end in zip(offsets, offsets[1:])]
+
+    def lower_bound(self, key: bytes) -> int:
+        """Position in the name index of the first username not less than ``key``."""
+        low, high = 0, self.count
+        while low < high:
+            middle = (low + high) // 2
+            if self.name_bytes(self.index[middle]) < key:
+                low = middle + 1
+            else:
+                high = middle
+        return low
+
+    def find(self, username: str) -> Optional[int]:
+        """Row number of a user, or None if the snapshot does not contain them."""
+        key = username.encode()
+        position = self.lower_bound(key)
+        if position < self.count and self.name_bytes(self.index[position]) == key:
+            return self.index[position]
+        return None
+
+
+def write_user_snapshot(path: str, seq: int, scores: array, quests: array, refs: List[QuestRef],
+                        names: List[str], base: Optional[UserSnapshot] = None) -> None:
+    """
+    Write a user snapshot.
+
+    Rows below ``base.count`` take their names from ``base``, whose string
+    table and sorted index are copied as-is; ``names`` are the usernames of
+    the rows after them, merged into the index by binary search.
+    """
+    base_count = base.count if base is not None else 0
+    encoded = [name.encode() for name in names]
+
+    offsets = array("Q")
+    if base is not None:
+        offsets.frombytes(base.name_offsets.cast("B"))
+    else:
+        offsets.append(0)
+    position = offsets[-1]
+    for name in encoded:
+        position += len(name)
+        offsets.append(position)
+
+    index = array("I")
+    if base is None:
+        index.extend(sorted(range(len(encoded)), key=encoded.__getitem__))
+    else:
+        previous = 0
+        for position, name, row in sorted((base.lower_bound(name), name, base_count + i)
+                                          for i, name in enumerate(encoded)):
+            index.frombytes(base.index[previous:position].cast("B"))
+            index.append(row)
+            previous = position
+        index.frombytes(base.index[previous:].cast("B"))
+
+    refs_json = json.dumps([[ref.quest_id, ref.difficulty] for ref in refs], separators=(",", ":")).encode()
+    strings = ([base.strings] if base is not None else []) + [b"".join(encoded)]
+    sections = [[scores], [quests], [offsets], [index], [refs_json], strings]
+    lengths = [sum(memoryview(part).nbytes for part in parts) for parts in sections]
+    header = USER_HEADER.pack(USER_MAGIC, FORMAT_VERSION, _flags(), seq, len(scores),
+                              *_section_offsets(USER_HEADER.size, lengths))
+    _write_file(path, header, sections)
+
+
+def write_team_quest_snapshot(path: str, seq: int, team_quests: List[Dict[str, Any]]) -> None:
+    """Write a team-quest snapshot from team quests in their JSON form."""
+    records = [json.dumps(team_quest, separators=(",", ":")).encode() for team_quest in team_quests]
+    offsets = array("Q", [0])
+    for record in records:
+        offsets.append(offsets[-1] + len(record))
+    records_at = _section_offsets(TEAM_QUEST_HEADER.size, [len(offsets) * 8])[0] + len(offsets) * 8
+    header = TEAM_QUEST_HEADER.pack(TEAM_QUEST_MAGIC, FORMAT_VERSION, _flags(), seq, len(records), records_at)
+    _write_file(path, header, [[offsets], records])
+
+
+def read_team_quest_snapshot(path: str) -> Tuple[int, List[Dict[str, Any]]]:
+    """Return the sequence number and the team quests, in their JSON form, of a team-quest snapshot."""
+    with open(path, "rb") as f:
+        data = f.read()
+    record_io("read", "snapshot", len(data))
+    magic, version, flags, seq, count, records_at = TEAM_QUEST_HEADER.unpack_from(data)
+    _check_header(path, magic, version, flags, TEAM_QUEST_MAGIC)
+    offsets_at = _section_offsets(TEAM_QUEST_HEADER.size, [0])[0]
+    offsets = memoryview(data)[offsets_at:offsets_at + 8 * (count + 1)].cast("Q")
+    return seq, [json.loads(data[records_at + offsets[i]:records_at + offsets[i + 1]]) for i in range(count)]
+
+
+class BinaryUserStore(UserStore):
+    """
+    ``UserStore`` whose snapshot is a memory-mapped binary file.
+
+    Rows up to the snapshot's row count keep their names in the mapping and
+    are looked up through its name index; rows added since live in
+    ``_names``. Each flush writes a new snapshot from the old one and maps it.
+    """
+
+    def __init__(self, path: str = USER_BIN_PATH, flush_interval: float = FLUSH_INTERVAL):
+        super().__init__(path, flush_interval)
+        self._base: Optional[UserSnapshot] = None
+
+    def _load_snapshot(self) -> int:
+        base = UserSnapshot(self.path)
+        record_io("read", "snapshot", len(base.scores) + len(base.quests))
+        self._base = base
+        self._rows = {}
+        self._names = []
+        self._scores = array("q")
+        self._scores.frombytes(base.scores)
+        self._quests = array("i")
+        self._quests.frombytes(base.quests)
+        self._refs = list(base.refs)
+        self._ref_ids = {ref: ref_id for ref_id, ref in enumerate(self._refs)}
+        return base.seq
+
+    def _base_count(self) -> int:
+        return self._base.count if self._base is not None else 0
+
+    def _find(self, username: str) -> Optional[int]:
+        row = self._rows.get(username)
+        if row is None and self._base is not None:
+            row = self._base.find(username)
+            if row is not None:
+                self._rows[username] = row
+        return row
+
+    def _name(self, row: int) -> str:
+        base_count = self._base_count()
+        return self._base.name(row) if row < base_count else self._names[row - base_count]
+
+    def _all_names(self) -> List[str]:
+        return (self._base.names() if self._base is not None else []) + self._names
+
+    def _snapshot(self) -> Any:
+        return self._base, list(self._names), self._scores[:], self._quests[:], list(self._refs), self._seq
+
+    def _write_snapshot(self, snapshot: Any) -> None:
+        base, names, scores, quests, refs, seq = snapshot
+        write_user_snapshot(self.path, seq, scores, quests, refs, names, base)
+        with self._lock:
+            self._base = UserSnapshot(self.path)
+            del self._names[:len(names)]
+
+    def to_json(self) -> Dict[str, Any]:
+        """Return the current state in the ``user_list.json`` layout."""
+        with self._lock:
+            self._ensure_loaded()
+            data = UserStore._snapshot(self)
+        data["seq"] = 0
+        return data
+
+
+class BinaryTeamQuestStore(TeamQuestStore):
+    """``TeamQuestStore`` whose snapshot is a binary team-quest file."""
+
+    def __init__(self, path: str = TEAM_QUEST_BIN_PATH, flush_interval: float = FLUSH_INTERVAL):
+        super().__init__(path, flush_interval)
+
+    def _load_snapshot(self) -> int:
+        seq, team_quests = read_team_quest_snapshot(self.path)
+        self._restore({"team_quests": team_quests})
+        return seq
+
+    def _write_snapshot(self, snapshot: Any) -> None:
+        write_team_quest_snapshot(self.path, snapshot["seq"], snapshot["team_quests"])
+
+    def to_json(self) -> Dict[str, Any]:
+        """Return the current state in the ``active_team_quest.json`` layout."""
+        with self._lock:
+            self._ensure_loaded()
+            data = self._snapshot()
+        data["seq"] = 0
+        return data
+
+
+def _paths(directory: str) -> Tuple[str, str, str, str]:
+    """JSON user, JSON team-quest, binary user and binary team-quest paths in ``directory``."""
+    return (
+        os.path.join(directory, os.path.basename(USER_LIST_PATH)),
+        os.path.join(directory, os.path.basename(ACTIVE_TEAM_QUEST_PATH)),
+        os.path.join(directory, os.path.basename(USER_BIN_PATH)),
+        os.path.join(directory, os.path.basename(TEAM_QUEST_BIN_PATH)),
+    )
+
+
+def import_json(directory: str) -> None:
+    """Write binary snapshots of a directory's JSON state (snapshot plus journal), replacing any binary state there."""
+    user_path, team_quest_path, user_bin_path, team_quest_bin_path = _paths(directory)
+    source = JsonBackend(user_path, team_quest_path)
+    source.users.flush_interval = source.team_quests.flush_interval = 0
+
+    users = source.users
+    with users._lock:
+        users._ensure_loaded()
+        write_user_snapshot(user_bin_path, 0, users._scores, users._quests, users._refs, users._all_names())
+    write_team_quest_snapshot(team_quest_bin_path, 0, [q.to_dict() for q in source.all_team_quests()])
+
+    for path in (user_bin_path, team_quest_bin_path):
+        if os.path.exists(path + ".journal"):
+            os.remove(path + ".journal")
+
+
+def export_json(directory: str, output: Optional[str] = None) -> None:
+    """Write a directory's binary state (snapshot plus journal) as JSON files in ``output``."""
+    output = output or directory
+    user_path, team_quest_path, _, _ = _paths(output)
+    for path in (user_path, team_quest_path):
+        if os.path.exists(path + ".journal"):
+            raise ValueError(f"{path}.journal would be replayed over the export; "
+                             "export to another directory or remove it first")
+
+    backend = BinaryBackend(directory)
+    write_atomic(user_path, backend.users.to_json())
+    write_atomic(team_quest_path, backend.team_quests.to_json())
+    backend.flush()
+
+
+class BinaryBackend(JsonBackend):
+    """``JsonBackend`` with binary snapshots, imported from the JSON files on first use."""
+
+    def __init__(self, directory: str = os.path.dirname(USER_LIST_PATH)):
+        _, _, user_bin_path, team_quest_bin_path = _paths(directory)
+        if not os.path.exists(user_bin_path) and not os.path.exists(team_quest_bin_path):
+            import_json(directory)
+        self.users = BinaryUserStore(user_bin_path)
+        self.team_quests = BinaryTeamQuestStore(team_quest_bin_path)
+        self.bags = BagStore(os.path.join(directory, os.path.basename(QUEST_BAGS_PATH)))
+        self.history = HistoryLog(os.path.join(directory, os.path.basename(TEAM_QUEST_HISTORY_PATH)))
+        self.score_days = ScoreDayStore(os.path.join(directory, os.path.basename(SCORE_DAYS_PATH)))
+        self.stats = StatsStore(os.path.join(directory, os.path.basename(STATS_PATH)))
+        self._watch_payouts()
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="Convert state between the JSON files and binary snapshots.")
+    parser.add_argument("action", choices=("import", "export"),
+                        help="import: JSON -> binary; export: binary -> JSON")
+    parser.add_argument("directory", nargs="?", default=os.path.dirname(USER_LIST_PATH),
+                        help="state directory, e.g. activity/ or activity/guilds/<id>/")
+    parser.add_argument("--output", help="export: directory for the JSON files (default: the state directory)")
+    args = parser.parse_args()
+
+    if args.action == "import":
+        import_json(args.directory)
+    else:
+        export_json(args.directory, args.output)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
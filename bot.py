@@ -1,67 +1,220 @@
+import asyncio
+import atexit
 import discord
 from discord.ext import commands
+import json
+import logging
+import logging.handlers
+import queue
 import random
 import os
+import time
 from dotenv import load_dotenv
-from quest_generator import generate_quest, complete_user_quest, abandon_user_quest
-from team_quest_generator import generate_team_quest_message, generate_team_quest, complete_team_quest as complete_tq, get_active_team_quests
-from stats import get_user_stats, get_leaderboard
-from utils import send_dm_to_users
+from fanout import send_to_all
+from services import pending_jobs, run_blocking
+from throttle import throttle
+from metrics import observe_command, format_summary, start_exporter
+# Pure formatting, called on the event loop: these never touch storage, so they stay local with STATE_SERVER too.
+from team_quest_generator import generate_team_quest_message, generate_team_quest_expired_message
 
 load_dotenv()
 TOKEN = os.getenv("DISCORD_TOKEN")
+# Socket of a state server (state_server.py) to keep quest and score state in; unset keeps it in this process.
+STATE_SERVER = os.getenv("STATE_SERVER")
+# When set, every command is appended here as JSONL for benchmarks/load_generator.py to replay.
+COMMAND_LOG = os.getenv("COMMAND_LOG")
+
+# COMMAND_LOG lines are queued on the event loop and written by a listener thread, so the loop never waits on disk.
+command_log = logging.getLogger("helldiver.command_log")
+command_log.propagate = False
+if COMMAND_LOG:
+    command_log_queue = queue.SimpleQueue()
+    command_log_file = logging.FileHandler(COMMAND_LOG, encoding="utf-8", delay=True)
+    command_log_file.setFormatter(logging.Formatter("%(message)s"))
+    command_log.addHandler(logging.handlers.QueueHandler(command_log_queue))
+    command_log.setLevel(logging.INFO)
+    command_log_listener = logging.handlers.QueueListener(command_log_queue, command_log_file)
+    command_log_listener.start()
+    atexit.register(command_log_listener.stop)
+
+if STATE_SERVER:
+    from state_server import RemoteEngine
+    engine = RemoteEngine(STATE_SERVER)
+else:
+    from engine import engine
 
 intents = discord.Intents.default()
 intents.message_content = True  # needed for reading message text
+# Role members are only cached with the privileged members intent; !event with a role needs MEMBERS_INTENT=1.
+intents.members = os.getenv("MEMBERS_INTENT") == "1"
+
+# AUTO_SHARD=1 lets discord.py split guilds across gateway shards for large deployments.
+bot_class = commands.AutoShardedBot if os.getenv("AUTO_SHARD") == "1" else commands.Bot
+bot = bot_class(command_prefix="!", intents=intents)
+
+
+def guild_id_of(ctx):
+    """Guild whose state a command uses; None for DMs."""
+    return ctx.guild.id if ctx.guild else None
+
+
+# Seconds the page buttons under a listing keep working.
+PAGE_BUTTON_TIMEOUT = 300
+
+class PageButtons(discord.ui.View):
+    """Previous/next buttons under a paged listing; each click renders just the requested page."""
+
+    def __init__(self, fetch, page):
+        super().__init__(timeout=PAGE_BUTTON_TIMEOUT)
+        self.fetch = fetch
+        self.page = page
+        self.message = None
+        self.update_buttons()
+
+    def update_buttons(self):
+        self.previous_page.disabled = self.page.number <= 1
+        self.next_page.disabled = self.page.number >= self.page.count
+
+    async def show(self, interaction, number):
+        refusal = throttle.admit(interaction.user.id, interaction.guild_id, "page", pending_jobs())
+        if refusal is not None:
+            if refusal.reply:
+                await interaction.response.send_message(refusal.reply, ephemeral=True)
+            else:
+                await interaction.response.defer()
+            return
+        self.page = await run_blocking(self.fetch, number)
+        self.update_buttons()
+        await interaction.response.edit_message(content=self.page.text, view=self)
+
+    @discord.ui.button(label="◀", style=discord.ButtonStyle.secondary)
+    async def previous_page(self, interaction, button):
+        await self.show(interaction, self.page.number - 1)
 
-bot = commands.Bot(command_prefix="!", intents=intents)
+    @discord.ui.button(label="▶", style=discord.ButtonStyle.secondary)
+    async def next_page(self, interaction, button):
+        await self.show(interaction, self.page.number + 1)
+
+    async def on_timeout(self):
+        if self.message is not None:
+            await self.message.edit(view=None)
+
+async def send_paged(ctx, fetch, page=1):
+    """Send one page of a listing, with buttons to move through the rest when there is more than one."""
+    first = await run_blocking(fetch, page)
+    if first.count == 1:
+        await ctx.send(first.text)
+        return
+    buttons = PageButtons(fetch, first)
+    buttons.message = await ctx.send(first.text, view=buttons)
+
+# Set once on_ready has settled which guild owns the pre-partition state; commands wait for it.
+storage_ready = asyncio.Event()
 
 @bot.event
 async def on_ready():
     print(f"Logged in as {bot.user} (ID: {bot.user.id})")
+    if not getattr(bot, "expiry_started", False):
+        bot.expiry_started = True
+        try:
+            await run_blocking(engine.on_team_quest_expired, announce_expired_team_quest, [g.id for g in bot.guilds])
+        finally:
+            storage_ready.set()
+
+def announce_expired_team_quest(guild_id, team_quest):
+    """Called on the expiry scheduler's thread; hands the notice to the bot's event loop."""
+    asyncio.run_coroutine_threadsafe(notify_expired_team_quest(team_quest), bot.loop)
+
+async def notify_expired_team_quest(team_quest):
+    """Post the expiry notice where the team quest was created and DM the squad members found there."""
+    channel = bot.get_channel(team_quest.channel_id) if team_quest.channel_id else None
+    if channel is None:
+        return
+    message = generate_team_quest_expired_message(team_quest)
+    await channel.send(message)
+    guild = getattr(channel, "guild", None)
+    members = [guild.get_member_named(name) for name in team_quest.players] if guild else []
+    await send_to_all([member for member in members if member is not None], message)
+
+class CommandRefused(commands.CheckFailure):
+    """Raised by the throttle check; the user has already been told why, if at all."""
+
+@bot.check
+async def admit_command(ctx):
+    """Turn commands away when their user or guild is over its rate limit or the bot is saturated."""
+    await storage_ready.wait()
+    refusal = throttle.admit(ctx.author.id, guild_id_of(ctx), ctx.command.name, pending_jobs())
+    if refusal is None:
+        return True
+    if refusal.reply:
+        await ctx.send(refusal.reply)
+    raise CommandRefused(refusal.reason)
+
+@bot.event
+async def on_command_error(ctx, error):
+    if isinstance(error, CommandRefused):
+        return
+    await bot_class.on_command_error(bot, ctx, error)
+
+@bot.before_invoke
+async def start_command_timer(ctx):
+    ctx.command_started = time.perf_counter()
+
+@bot.after_invoke
+async def record_command_metrics(ctx):
+    elapsed = time.perf_counter() - ctx.command_started
+    observe_command(ctx.command.name, elapsed, ctx.command_failed)
+    if COMMAND_LOG:
+        record_command(ctx)
+
+def record_command(ctx):
+    """Append a command to COMMAND_LOG in the load generator's stream format."""
+    entry = {
+        "ts": time.time(),
+        "guild": guild_id_of(ctx),
+        "user": ctx.author.name,
+        "content": ctx.message.content,
+        "mentions": [user.name for user in ctx.message.mentions],
+    }
+    command_log.info(json.dumps(entry))
 
 @bot.command()
 async def quest(ctx, difficulty: int = 1):
     """Start a new quest. Usage: !quest [difficulty 1-3]"""
-    if difficulty < 1 or difficulty > 3:
-        await ctx.send("Difficulty must be between 1 and 3.")
-        return
-    
-    username = ctx.author.name
-    quest, response_text = generate_quest(username, difficulty)
-    
-    if quest is None:
-        await ctx.send(response_text)
-        return
-    
+    response_text = await run_blocking(engine.quest, ctx.author.name, difficulty, guild_id_of(ctx))
     await ctx.send(response_text)
 
 @bot.command()
 async def done(ctx):
     """Complete your active quest."""
-    username = ctx.author.name
-    response_text = complete_user_quest(username)
+    response_text = await run_blocking(engine.done, ctx.author.name, guild_id_of(ctx))
     await ctx.send(response_text)
 
 @bot.command()
 async def abandon(ctx):
     """Abandon your active quest."""
-    username = ctx.author.name
-    response_text = abandon_user_quest(username)
+    response_text = await run_blocking(engine.abandon, ctx.author.name, guild_id_of(ctx))
     await ctx.send(response_text)
 
 @bot.command()
 async def profile(ctx):
     """View your personal stats and score."""
-    username = ctx.author.name
-    stats_text = get_user_stats(username)
+    stats_text = await run_blocking(engine.profile, ctx.author.name, guild_id_of(ctx))
+    await ctx.send(stats_text)
+
+@bot.command()
+async def serverstats(ctx):
+    """View this server's quest statistics."""
+    stats_text = await run_blocking(engine.server_stats, guild_id_of(ctx))
     await ctx.send(stats_text)
 
 @bot.command()
-async def leaderboard(ctx):
-    """View the global leaderboard."""
-    leaderboard_text = get_leaderboard()
-    await ctx.send(leaderboard_text)
+async def leaderboard(ctx, *args: str):
+    """View the leaderboard. Usage: !leaderboard [week | month | season] [page]"""
+    period = next((arg.lower() for arg in args if not arg.isdigit()), None)
+    page = next((int(arg) for arg in args if arg.isdigit()), 1)
+    guild_id = guild_id_of(ctx)
+    await send_paged(ctx, lambda number: engine.leaderboard(guild_id, period, number), page)
 
 @bot.command()
 async def SOS(ctx):
@@ -75,16 +228,25 @@ async def SOS(ctx):
 **!done** - Complete your active quest
 **!abandon** - Abandon your active quest
 **!profile** - View your stats
-**!leaderboard** - View leaderboard
+**!serverstats** - View this server's quest statistics
+**!leaderboard [week | month | season] [page]** - View this server's leaderboard, all-time or for a period
 **!tquest [difficulty] @user1 @user2** - Create team quest
 **!tdone [quest_id]** - Complete team quest
-**!tactive** - View active team quests
+**!tactive [me | @user] [page]** - View active team quests
+**!event [solo | squads] [difficulty] [squad size] [@role | #voice]** - Quests for a whole channel or role (event organisers)
+**!metrics** - Command latency and storage I/O (admins)
 **!SOS** - Show this message
 
 ════════════════════════════════════════
 """
     await ctx.send(help_text)
 
+@bot.command()
+@commands.has_permissions(administrator=True)
+async def metrics(ctx):
+    """Show command latency and storage I/O counters (server admins only)."""
+    await ctx.send(f"```\n{format_summary()}\n```")
+
 @bot.command()
 async def tquest(ctx, difficulty: int = 1, *, args: str = ""):
     """Create a team quest. Usage: !tquest [difficulty] @user1 @user2"""
@@ -94,30 +256,57 @@ async def tquest(ctx, difficulty: int = 1, *, args: str = ""):
         await ctx.send("Please mention at least one user. Usage: `!tquest [difficulty] @user1 @user2`")
         return
     
-    if difficulty < 1 or difficulty > 3:
-        await ctx.send("Difficulty must be between 1 and 3.")
-        return
-    
     player_names = [user.name for user in mentions]
-    team_quest, response_text = generate_team_quest(player_names, difficulty)
+    team_quest, response_text = await run_blocking(engine.tquest, player_names, difficulty, guild_id_of(ctx),
+                                                   ctx.channel.id)
+    await ctx.send(response_text)
     
     if team_quest is None:
-        await ctx.send(response_text)
         return
     
-    await ctx.send(response_text)
+    report = await send_to_all(mentions, lambda user: generate_team_quest_message(user.name, team_quest))
+    await ctx.send(str(report))
 
 @bot.command()
 async def tdone(ctx, quest_id: str):
     """Complete a team quest by ID."""
-    response_text = complete_tq(quest_id)
+    response_text = await run_blocking(engine.tdone, quest_id, guild_id_of(ctx))
     await ctx.send(response_text)
 
 @bot.command()
-async def tactive(ctx):
-    """Display all active team quests."""
-    quests_text = get_active_team_quests()
-    await ctx.send(quests_text)
+async def tactive(ctx, *, args: str = ""):
+    """Display active team quests. Usage: !tactive [me | @user] [page]"""
+    words = args.split()
+    player = None
+    if ctx.message.mentions:
+        player = ctx.message.mentions[0].name
+    elif "me" in (word.lower() for word in words):
+        player = ctx.author.name
+    page = next((int(word) for word in words if word.isdigit()), 1)
+    
+    guild_id = guild_id_of(ctx)
+    await send_paged(ctx, lambda number: engine.tactive(player, guild_id, number), page)
+
+@bot.command()
+@commands.has_permissions(manage_events=True)
+async def event(ctx, mode: str = "solo", difficulty: int = 1, squad_size: int = 4):
+    """Event night quests for a voice channel or role. Usage: !event [solo|squads] [difficulty] [squad size] [@role | #voice]"""
+    if ctx.message.role_mentions:
+        members = ctx.message.role_mentions[0].members
+    elif ctx.message.channel_mentions and isinstance(ctx.message.channel_mentions[0], discord.VoiceChannel):
+        members = ctx.message.channel_mentions[0].members
+    elif ctx.author.voice and ctx.author.voice.channel:
+        members = ctx.author.voice.channel.members
+    else:
+        await ctx.send("Join a voice channel or mention a role or voice channel. "
+                       "Usage: `!event [solo|squads] [difficulty] [squad size] [@role | #voice]`")
+        return
+    
+    players = [member.name for member in members if not member.bot]
+    pages = await run_blocking(engine.event, players, mode.lower(), difficulty, squad_size, guild_id_of(ctx),
+                               ctx.channel.id)
+    for page in pages:
+        await ctx.send(page)
 
 @bot.command()
 async def dm(ctx, *, args: str = ""):
@@ -146,4 +335,5 @@ async def dm(ctx, *, args: str = ""):
         await ctx.send(f"Could not send DM to {user.name} (DMs disabled).")
 
 
+start_exporter()
 bot.run(TOKEN)
\ No newline at end of file
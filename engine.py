@@ -0,0 +1,184 @@
+import os
+from typing import Callable, Iterable, List, Optional, Tuple
+from expiry import expiry_scheduler
+from leaderboard import LEADERBOARD_WINDOWS
+from quest_generator import generate_quest, generate_quests, complete_user_quest, abandon_user_quest
+from schema import TeamQuest
+from stats import get_user_stats, get_leaderboard, get_server_stats
+from storage import adopt_legacy_guild, flush_all, get_backend
+from team_quest_generator import (
+    generate_team_quest, generate_team_quests, generate_team_quest_message, generate_team_quest_expired_message,
+    complete_team_quest, get_active_team_quests, split_into_squads,
+)
+from utils import Page, paginate
+
+
+MIN_DIFFICULTY = 1
+MAX_DIFFICULTY = 3
+EVENT_MODES = ("solo", "squads")
+DEFAULT_SQUAD_SIZE = 4
+MAX_SQUAD_SIZE = 4
+# Most players one !tquest can mention.
+MAX_TEAM_QUEST_PLAYERS = int(os.getenv("MAX_TEAM_QUEST_PLAYERS", "8"))
+
+
+class QuestEngine:
+    """
+    The game's commands as plain method calls, with no dependency on discord.
+
+    Each method returns the reply text for a command; listings that can
+    run long return one ``utils.Page`` of it instead. Methods block on
+    storage, so the bot runs them through ``services.run_blocking``, while
+    benchmarks and tools can call them directly. ``guild_id`` picks whose
+    state a command uses; None is the DM partition. With STATE_SERVER set,
+    the bot uses ``state_server.RemoteEngine`` instead, which runs these
+    methods in a separate state-server process.
+    """
+
+    @staticmethod
+    def _check_difficulty(difficulty: int) -> Optional[str]:
+        if difficulty < MIN_DIFFICULTY or difficulty > MAX_DIFFICULTY:
+            return f"Difficulty must be between {MIN_DIFFICULTY} and {MAX_DIFFICULTY}."
+        return None
+
+    def quest(self, username: str, difficulty: int = 1, guild_id: Optional[int] = None) -> str:
+        """Start a new solo quest."""
+        problem = self._check_difficulty(difficulty)
+        if problem:
+            return problem
+        _, response_text = generate_quest(username, difficulty, guild_id)
+        return response_text
+
+    def done(self, username: str, guild_id: Optional[int] = None) -> str:
+        """Complete the user's active quest."""
+        return complete_user_quest(username, guild_id)
+
+    def abandon(self, username: str, guild_id: Optional[int] = None) -> str:
+        """Abandon the user's active quest."""
+        return abandon_user_quest(username, guild_id)
+
+    def tquest(self, players: List[str], difficulty: int = 1, guild_id: Optional[int] = None,
+               channel_id: Optional[int] = None) -> Tuple[Optional[TeamQuest], str]:
+        """
+        Create a team quest; returns the quest (None on failure) and the reply text.
+
+        ``channel_id`` is remembered so an expiry notice can be posted there.
+        """
+        if not players:
+            return None, "A team quest needs at least one player."
+        if len(players) > MAX_TEAM_QUEST_PLAYERS:
+            return None, f"A team quest can have at most {MAX_TEAM_QUEST_PLAYERS} players."
+        problem = self._check_difficulty(difficulty)
+        if problem:
+            return None, problem
+        return generate_team_quest(players, difficulty, guild_id, channel_id)
+
+    def team_quest_message(self, username: str, team_quest: TeamQuest) -> str:
+        """DM text telling a squad member about a new team quest."""
+        return generate_team_quest_message(username, team_quest)
+
+    def team_quest_expired_message(self, team_quest: TeamQuest) -> str:
+        """Notice telling a squad its team quest ran out of time."""
+        return generate_team_quest_expired_message(team_quest)
+
+    def on_team_quest_expired(self, listener: Callable[[Optional[int], TeamQuest], None],
+                              guild_ids: Iterable[Optional[int]] = ()) -> None:
+        """
+        Start failing team quests past their deadline and call
+        ``listener(guild_id, team_quest)`` for each, from a background thread.
+        ``guild_id`` is the partition key, so None for DMs and LEGACY_GUILD_ID.
+
+        A guild's quests are scheduled when its state is first opened; the
+        guilds in ``guild_ids`` (and DMs) are opened now so that quests left
+        over from before a restart expire even if nobody uses the bot there.
+        Before that, ``storage.adopt_legacy_guild`` gets to hand the state
+        from before per-guild partitions to the bot's only guild.
+        """
+        guild_ids = list(guild_ids)
+        if guild_ids:
+            adopt_legacy_guild(guild_ids)
+        expiry_scheduler.add_listener(listener)
+        for guild_id in [None, *guild_ids]:
+            get_backend(guild_id)
+        expiry_scheduler.start()
+
+    def event(self, players: List[str], mode: str = "solo", difficulty: int = 1,
+              squad_size: int = DEFAULT_SQUAD_SIZE, guild_id: Optional[int] = None,
+              channel_id: Optional[int] = None) -> List[str]:
+        """
+        Event night: give every player a solo quest, or split them into random
+        squads with a team quest each, in one storage write. Returns the
+        consolidated announcement as message-sized pages.
+        """
+        if mode not in EVENT_MODES:
+            return [f"Event mode must be one of: {', '.join(EVENT_MODES)}."]
+        if not players:
+            return ["No helldivers to assign."]
+        problem = self._check_difficulty(difficulty)
+        if problem:
+            return [problem]
+        if squad_size < 1 or squad_size > MAX_SQUAD_SIZE:
+            return [f"Squad size must be between 1 and {MAX_SQUAD_SIZE}."]
+
+        if mode == "solo":
+            assigned, skipped = generate_quests(players, difficulty, guild_id)
+            if not assigned and not skipped:
+                return ["No quests available for that difficulty."]
+            lines = [f"**{username}** — {quest.title} {'⭐' * quest.difficulty}\n" for username, quest in assigned]
+            lines += [f"~~{username}~~ already on **{title}**\n" for username, title in skipped]
+            summary = f"{len(assigned)} helldivers deployed"
+            if skipped:
+                summary += f", {len(skipped)} already on a mission"
+            title = "EVENT NIGHT: SOLO QUESTS"
+        else:
+            team_quests = generate_team_quests(split_into_squads(players, squad_size), difficulty, guild_id,
+                                               channel_id)
+            if not team_quests:
+                return [f"No team quests available for difficulty {difficulty}."]
+            lines = [
+                f"**Squad {number}** · `{team_quest.quest_id}` · {team_quest.quest.title} "
+                f"{'⭐' * team_quest.quest.difficulty}\n{', '.join(team_quest.players)}\n\n"
+                for number, team_quest in enumerate(team_quests, 1)
+            ]
+            summary = f"{len(team_quests)} squads, {sum(len(q.players) for q in team_quests)} helldivers deployed"
+            title = "EVENT NIGHT: SQUAD QUESTS"
+
+        header = f"""
+════════════════════════════════════════
+{title:^40}
+════════════════════════════════════════
+
+"""
+        footer = f"""
+{summary}. Good luck, helldivers!
+════════════════════════════════════════"""
+        return paginate(lines, header, footer)
+
+    def tdone(self, quest_id: str, guild_id: Optional[int] = None) -> str:
+        """Complete a team quest and pay out its squad."""
+        return complete_team_quest(quest_id, guild_id)
+
+    def tactive(self, player: Optional[str] = None, guild_id: Optional[int] = None, page: int = 1) -> Page:
+        """List one page of the active team quests, or only those ``player`` is part of."""
+        return get_active_team_quests(player, guild_id, page)
+
+    def profile(self, username: str, guild_id: Optional[int] = None) -> str:
+        """Show a user's score, rank and neighbours."""
+        return get_user_stats(username, guild_id)
+
+    def server_stats(self, guild_id: Optional[int] = None) -> str:
+        """Show a guild's quest counters and its most completed, abandoned and failed quests."""
+        return get_server_stats(guild_id)
+
+    def leaderboard(self, guild_id: Optional[int] = None, window: Optional[str] = None, page: int = 1) -> Page:
+        """Show one page of a guild's lifetime leaderboard, or of one of ``LEADERBOARD_WINDOWS``."""
+        if window is not None and window not in LEADERBOARD_WINDOWS:
+            return Page(f"Leaderboard period must be one of: {', '.join(LEADERBOARD_WINDOWS)}.", 1, 1)
+        return get_leaderboard(guild_id, window, page)
+
+    def flush(self) -> None:
+        """Write every open guild's state to disk."""
+        flush_all()
+
+
+engine = QuestEngine()
@@ -0,0 +1,145 @@
+import heapq
+import itertools
+import logging
+import os
+import threading
+import time
+from typing import Callable, List, Optional, Tuple
+from locks import team_quest_locks
+from metrics import registry
+from schema import QuestStatus, StatEvent, TeamQuest
+from storage import StorageBackend, get_backend, on_backend_open, partition_key
+from utils import record_quest_outcome
+
+
+# Hours a team quest stays active before it fails; 0 disables expiry.
+TEAM_QUEST_TTL = float(os.getenv("TEAM_QUEST_TTL_HOURS", "72")) * 3600
+
+registry.describe("helldiver_team_quests_expired_total", "Team quests failed by the expiry scheduler.")
+
+log = logging.getLogger(__name__)
+
+ExpiryListener = Callable[[Optional[int], TeamQuest], None]
+
+
+def team_quest_deadline(created_at: float) -> Optional[float]:
+    """Expiry time for a team quest created at ``created_at``, or None when expiry is disabled."""
+    return created_at + TEAM_QUEST_TTL if TEAM_QUEST_TTL > 0 else None
+
+
+class ExpiryScheduler:
+    """
+    Fails team quests that outlive their deadline.
+
+    Deadlines wait in a min-heap of ``(expires_at, seq, partition, quest_id)``,
+    where ``seq`` breaks ties between equal deadlines so partitions (None for
+    DMs and the legacy guild) are never compared. Scheduling a quest is one
+    push and expiring it one pop, O(log n) each; a single daemon thread
+    sleeps until the earliest deadline instead of scanning the active quests. Quests completed in time are not removed
+    from the heap: their entry is dropped when it comes due and the quest is
+    no longer active. Each expired quest is ended as ``QuestStatus.FAILED``
+    (which moves it to the history) and passed to the listeners.
+    """
+
+    def __init__(self):
+        self._heap: List[Tuple[float, int, Optional[int], str]] = []
+        self._seq = itertools.count()
+        self._condition = threading.Condition()
+        self._listeners: List[ExpiryListener] = []
+        self._thread: Optional[threading.Thread] = None
+
+    def schedule(self, team_quest: TeamQuest, guild_id: Optional[int] = None) -> None:
+        """Expire ``team_quest`` at its ``expires_at``; quests without one never expire."""
+        if team_quest.expires_at is None:
+            return
+        with self._condition:
+            entry = (team_quest.expires_at, next(self._seq), partition_key(guild_id), team_quest.quest_id)
+            heapq.heappush(self._heap, entry)
+            if self._heap[0] is entry:
+                self._condition.notify()
+
+    def watch(self, partition: Optional[int], backend: StorageBackend) -> None:
+        """
+        Schedule a newly opened partition's active team quests.
+
+        Quests saved before expiry existed get a deadline counted from now,
+        which is written back so it survives restarts.
+        """
+        if TEAM_QUEST_TTL <= 0:
+            return
+        for team_quest in backend.all_team_quests():
+            if team_quest.expires_at is None:
+                backend.set_team_quest_expiry(team_quest.quest_id, team_quest_deadline(time.time()))
+                team_quest = backend.get_team_quest(team_quest.quest_id)
+            self.schedule(team_quest, partition)
+
+    def add_listener(self, listener: ExpiryListener) -> None:
+        """Call ``listener(partition, team_quest)`` for each quest that expires, from the scheduler thread."""
+        self._listeners.append(listener)
+
+    def pending(self) -> int:
+        """Number of scheduled deadlines, including those of quests already completed."""
+        with self._condition:
+            return len(self._heap)
+
+    def _pop_due(self, now: float) -> List[Tuple[float, int, Optional[int], str]]:
+        due = []
+        while self._heap and self._heap[0][0] <= now:
+            due.append(heapq.heappop(self._heap))
+        return due
+
+    def _expire(self, expires_at: float, guild_id: Optional[int], quest_id: str) -> Optional[TeamQuest]:
+        backend = get_backend(guild_id)
+        with team_quest_locks.hold(quest_id):
+            team_quest = backend.get_team_quest(quest_id)
+            if team_quest is None or team_quest.expires_at is None or team_quest.expires_at > expires_at:
+                # Completed in time, or rescheduled to a later deadline that has its own entry.
+                return None
+            team_quest = backend.remove_team_quest(quest_id, QuestStatus.FAILED)
+        if team_quest is not None:
+            record_quest_outcome(StatEvent.TEAM_FAILED, team_quest.players, team_quest.quest.ref(), guild_id)
+        return team_quest
+
+    def expire_due(self, now: Optional[float] = None) -> List[TeamQuest]:
+        """Expire every quest whose deadline has passed and return them."""
+        with self._condition:
+            due = self._pop_due(time.time() if now is None else now)
+        return self._process(due)
+
+    def _process(self, due: List[Tuple[float, int, Optional[int], str]]) -> List[TeamQuest]:
+        expired = []
+        for expires_at, _, guild_id, quest_id in due:
+            try:
+                team_quest = self._expire(expires_at, guild_id, quest_id)
+                if team_quest is None:
+                    continue
+                registry.inc("helldiver_team_quests_expired_total")
+                expired.append(team_quest)
+                for listener in self._listeners:
+                    listener(guild_id, team_quest)
+            except Exception:
+                log.exception("Expiring team quest %s failed", quest_id)
+        return expired
+
+    def _run(self) -> None:
+        while True:
+            with self._condition:
+                while True:
+                    now = time.time()
+                    if self._heap and self._heap[0][0] <= now:
+                        break
+                    self._condition.wait(self._heap[0][0] - now if self._heap else None)
+                due = self._pop_due(now)
+            self._process(due)
+
+    def start(self) -> None:
+        """Start the scheduler thread; calling it again does nothing."""
+        with self._condition:
+            if self._thread is not None:
+                return
+            self._thread = threading.Thread(target=self._run, name="team-quest-expiry", daemon=True)
+            self._thread.start()
+
+
+expiry_scheduler = ExpiryScheduler()
+on_backend_open(expiry_scheduler.watch)
@@ -0,0 +1,126 @@
+import asyncio
+import random
+import time
+from typing import Any, Callable, Dict, Iterable, List, Optional, Union
+
+
+DM_CONCURRENCY = 5
+DM_RETRIES = 3
+RETRY_BASE_DELAY = 0.5
+DEFAULT_RETRY_AFTER = 1.0
+
+TRANSIENT_STATUSES = {500, 502, 503, 504}
+
+
+class DeliveryReport:
+    """Per-recipient outcome of a DM fan-out."""
+
+    def __init__(self):
+        self.delivered: List[str] = []
+        self.failed: Dict[str, str] = {}
+
+    def __str__(self):
+        total = len(self.delivered) + len(self.failed)
+        text = f"📨 Notified {len(self.delivered)}/{total} squad members."
+        if self.failed:
+            reasons = ", ".join(f"{name} ({reason})" for name, reason in self.failed.items())
+            text += f"\nCould not reach: {reasons}"
+        return text
+
+
+class _RateLimitGate:
+    """Shared pause that every sender waits out after an HTTP 429."""
+
+    def __init__(self):
+        self._resume_at = 0.0
+
+    def pause(self, seconds: float) -> None:
+        self._resume_at = max(self._resume_at, time.monotonic() + seconds)
+
+    async def wait(self) -> None:
+        delay = self._resume_at - time.monotonic()
+        while delay > 0:
+            await asyncio.sleep(delay)
+            delay = self._resume_at - time.monotonic()
+
+
+def _retry_after(exc: Exception) -> float:
+    """Seconds to wait after a rate-limit error, from the exception or its response headers."""
+    retry_after = getattr(exc, "retry_after", None)
+    if retry_after is None:
+        headers = getattr(getattr(exc, "response", None), "headers", None) or {}
+        retry_after = headers.get("Retry-After")
+    try:
+        return float(retry_after)
+    except (TypeError, ValueError):
+        return DEFAULT_RETRY_AFTER
+
+
+def _is_transient(exc: Exception) -> bool:
+    return getattr(exc, "status", None) in TRANSIENT_STATUSES or isinstance(exc, (OSError, asyncio.TimeoutError))
+
+
+def _failure_reason(exc: Exception) -> str:
+    if getattr(exc, "status", None) == 403:
+        return "DMs disabled"
+    return str(exc) or type(exc).__name__
+
+
+async def send_to_all(
+    users: Iterable[Any],
+    message: Union[str, Callable[[Any], str]],
+    concurrency: int = DM_CONCURRENCY,
+    retries: int = DM_RETRIES,
+) -> DeliveryReport:
+    """
+    Send a DM to every user with bounded concurrency.
+
+    Works with anything that has an async ``send`` and a ``name`` (such as
+    ``discord.User``). Errors are classified by their HTTP ``status`` rather
+    than by discord.py exception type: a 429 pauses every sender for the
+    advertised Retry-After, 5xx and connection errors are retried with
+    exponential backoff and jitter, and anything else (such as 403 for
+    disabled DMs) fails that recipient immediately.
+
+    Args:
+        users: Recipients
+        message: Message text, or a function building the text for a recipient
+        concurrency: Maximum number of DMs in flight at once
+        retries: Extra attempts per recipient after a rate limit or transient error
+
+    Returns:
+        DeliveryReport listing who was reached and why the others were not
+    """
+    users = list(users)
+    semaphore = asyncio.Semaphore(concurrency)
+    gate = _RateLimitGate()
+    outcomes: List[Optional[str]] = [None] * len(users)
+
+    async def deliver(index: int, user: Any) -> None:
+        text = message(user) if callable(message) else message
+        async with semaphore:
+            for attempt in range(retries + 1):
+                await gate.wait()
+                try:
+                    await user.send(text)
+                    return
+                except Exception as exc:
+                    if getattr(exc, "status", None) == 429:
+                        gate.pause(_retry_after(exc))
+                    elif _is_transient(exc):
+                        await asyncio.sleep(RETRY_BASE_DELAY * 2 ** attempt * random.uniform(0.5, 1.5))
+                    else:
+                        outcomes[index] = _failure_reason(exc)
+                        return
+            outcomes[index] = f"gave up after {retries + 1} attempts"
+
+    await asyncio.gather(*(deliver(i, user) for i, user in enumerate(users)))
+
+    report = DeliveryReport()
+    for user, failure in zip(users, outcomes):
+        name = getattr(user, "name", str(user))
+        if failure is None:
+            report.delivered.append(name)
+        else:
+            report.failed[name] = failure
+    return report
@@ -0,0 +1,103 @@
+import json
+import os
+from typing import Any, Dict, Iterator, Optional, TextIO
+from metrics import record_io
+
+
+class Journal:
+    """
+    Append-only log of mutation records, one JSON object per line.
+
+    During compaction the live journal is rotated aside (``rotate``) so new
+    records keep appending to a fresh file while the snapshot is written, and
+    the rotated file is removed once the snapshot is safely on disk
+    (``discard_rotated``). Replay reads the rotated file first, then the live one.
+    """
+
+    def __init__(self, path: str, fsync: bool = False):
+        self.path = path
+        self.rotated_path = path + ".compacting"
+        self.fsync = fsync
+        self._file: Optional[TextIO] = None
+
+    def append(self, record: Dict[str, Any]) -> None:
+        """Append a single record to the end of the journal."""
+        if self._file is None:
+            self._file = open(self.path, "a")
+        line = json.dumps(record, separators=(",", ":")) + "\n"
+        self._file.write(line)
+        self._file.flush()
+        record_io("write", "journal", len(line.encode()))
+        if self.fsync:
+            os.fsync(self._file.fileno())
+
+    def replay(self) -> Iterator[Dict[str, Any]]:
+        """Yield every record on disk, oldest first."""
+        for path in (self.rotated_path, self.path):
+            if not os.path.exists(path):
+                continue
+            record_io("read", "journal", os.path.getsize(path))
+            with open(path, "r") as f:
+                for line in f:
+                    try:
+                        yield json.loads(line)
+                    except json.JSONDecodeError:
+                        # A torn write from a crash can only be the final line.
+                        break
+
+    def exists(self) -> bool:
+        """Check whether there are journal records on disk."""
+        return os.path.exists(self.path) or os.path.exists(self.rotated_path)
+
+    def rotate(self) -> None:
+        """Move the live journal aside so a snapshot can be taken of it."""
+        self.close()
+        if not os.path.exists(self.path):
+            return
+        if os.path.exists(self.rotated_path):
+            # A previous compaction did not finish; keep both sets of records.
+            # A crash may have torn the rotated file's last line, and replay
+            # stops at the first bad line, so cut it back to its last complete
+            # record first or everything appended after it would be lost.
+            self._truncate_torn_tail(self.rotated_path)
+            with open(self.path, "r") as src, open(self.rotated_path, "a") as dst:
+                dst.write(src.read())
+            os.remove(self.path)
+        else:
+            os.replace(self.path, self.rotated_path)
+
+    @staticmethod
+    def _truncate_torn_tail(path: str) -> None:
+        """Drop anything after the last newline in ``path``, and a final line that is not valid JSON."""
+        with open(path, "rb+") as f:
+            data = f.read()
+            end = data.rfind(b"\n") + 1
+            last_start = data.rfind(b"\n", 0, max(end - 1, 0)) + 1
+            if end:
+                try:
+                    json.loads(data[last_start:end])
+                except ValueError:
+                    end = last_start
+            if end != len(data):
+                f.truncate(end)
+
+    def discard_rotated(self) -> None:
+        """Delete the rotated journal once its records are in a snapshot."""
+        if os.path.exists(self.rotated_path):
+            os.remove(self.rotated_path)
+
+    def close(self) -> None:
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+
+def write_atomic(path: str, data: Dict[str, Any], indent: Optional[int] = 2) -> None:
+    """Write JSON to a temporary file and rename it over ``path``; ``indent`` None writes it compactly."""
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(data, f, indent=indent, separators=None if indent is not None else (",", ":"))
+        f.flush()
+        os.fsync(f.fileno())
+        record_io("write", "snapshot", f.tell())
+    os.replace(tmp_path, path)
@@ -0,0 +1,338 @@
+import heapq
+import os
+import threading
+import time
+from bisect import bisect_left, insort
+from datetime import date
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+from storage import get_backend, partition_key
+
+
+SECONDS_PER_DAY = 86400
+# Seasons are consecutive SEASON_LENGTH_DAYS-day periods, the first starting on SEASON_START.
+SEASON_START = date.fromisoformat(os.getenv("SEASON_START", "2025-01-01")).toordinal() - date(1970, 1, 1).toordinal()
+SEASON_LENGTH_DAYS = int(os.getenv("SEASON_LENGTH_DAYS", "90"))
+# Days of per-day scores to keep even when no leaderboard window needs them.
+SCORE_RETENTION_DAYS = int(os.getenv("SCORE_RETENTION_DAYS", "0"))
+
+
+def current_day() -> int:
+    """Today as days since the Unix epoch, UTC."""
+    return int(time.time() // SECONDS_PER_DAY)
+
+
+def season_number(day: int) -> int:
+    """1-based number of the season ``day`` falls in."""
+    return (day - SEASON_START) // SEASON_LENGTH_DAYS + 1
+
+
+def season_start(day: int) -> int:
+    """First day of the season ``day`` falls in."""
+    return SEASON_START + (season_number(day) - 1) * SEASON_LENGTH_DAYS
+
+
+# First day each leaderboard window covers, given today.
+LEADERBOARD_WINDOWS: Dict[str, Callable[[int], int]] = {
+    "week": lambda today: today - 6,
+    "month": lambda today: today - 29,
+    "season": season_start,
+}
+
+
+class RankIndex:
+    """
+    Users ordered by score, maintained incrementally as scores change.
+
+    Entries are ``(-score, order, username)`` keys, where ``order`` is the
+    order a user was first seen in, so ties rank like ``StorageBackend.top_users``.
+    Keys live in a list of sorted sublists of about ``LOAD`` entries with a
+    Fenwick tree over the sublist lengths: updates, "rank of X" and
+    "entry at rank N" are all O(log n) bisects and tree walks, so nothing is
+    ever re-sorted after the index is built.
+    """
+
+    LOAD = 512
+
+    def __init__(self, scores: Iterable[Tuple[str, int]] = ()):
+        self._lock = threading.Lock()
+        self._keys: Dict[str, tuple] = {}
+        self._lists: List[List[tuple]] = []
+        self._maxes: List[tuple] = []
+        self._tree: List[int] = []
+        self._next_order = 0
+
+        for username, score in scores:
+            self._keys[username] = (-score, self._next_order, username)
+            self._next_order += 1
+        ordered = sorted(self._keys.values())
+        self._lists = [ordered[i:i + self.LOAD] for i in range(0, len(ordered), self.LOAD)]
+        self._maxes = [sublist[-1] for sublist in self._lists]
+        self._build_tree()
+
+    def __len__(self) -> int:
+        return len(self._keys)
+
+    def _build_tree(self) -> None:
+        tree = [len(sublist) for sublist in self._lists]
+        for i in range(len(tree)):
+            parent = i | (i + 1)
+            if parent < len(tree):
+                tree[parent] += tree[i]
+        self._tree = tree
+
+    def _tree_add(self, index: int, delta: int) -> None:
+        while index < len(self._tree):
+            self._tree[index] += delta
+            index |= index + 1
+
+    def _count_before(self, index: int) -> int:
+        """Number of keys in the sublists before ``index``."""
+        total = 0
+        while index > 0:
+            total += self._tree[index - 1]
+            index &= index - 1
+        return total
+
+    def _locate(self, position: int) -> Tuple[int, int]:
+        """Return (sublist index, offset) of the key at 0-based ``position``."""
+        index = 0
+        step = 1 << (len(self._tree).bit_length() - 1) if self._tree else 0
+        while step:
+            candidate = index + step
+            if candidate <= len(self._tree) and self._tree[candidate - 1] <= position:
+                position -= self._tree[candidate - 1]
+                index = candidate
+            step >>= 1
+        return index, position
+
+    def _insert(self, key: tuple) -> None:
+        if not self._lists:
+            self._lists.append([key])
+            self._maxes.append(key)
+            self._build_tree()
+            return
+
+        index = bisect_left(self._maxes, key)
+        if index == len(self._maxes):
+            index -= 1
+            self._lists[index].append(key)
+            self._maxes[index] = key
+        else:
+            insort(self._lists[index], key)
+        self._tree_add(index, 1)
+
+        sublist = self._lists[index]
+        if len(sublist) > 2 * self.LOAD:
+            self._lists.insert(index + 1, sublist[self.LOAD:])
+            del sublist[self.LOAD:]
+            self._maxes[index] = sublist[-1]
+            self._maxes.insert(index + 1, self._lists[index + 1][-1])
+            self._build_tree()
+
+    def _remove(self, key: tuple) -> None:
+        index = bisect_left(self._maxes, key)
+        sublist = self._lists[index]
+        del sublist[bisect_left(sublist, key)]
+
+        if sublist:
+            self._maxes[index] = sublist[-1]
+            self._tree_add(index, -1)
+        else:
+            del self._lists[index]
+            del self._maxes[index]
+            self._build_tree()
+
+    def _position(self, key: tuple) -> int:
+        index = bisect_left(self._maxes, key)
+        return self._count_before(index) + bisect_left(self._lists[index], key)
+
+    def _slice(self, start: int, count: int) -> List[Tuple[int, str, int]]:
+        """Return (rank, username, score) for up to ``count`` entries from 0-based ``start``."""
+        entries = []
+        if start >= len(self._keys) or count <= 0:
+            return entries
+        index, offset = self._locate(start)
+        rank = start + 1
+        while index < len(self._lists) and len(entries) < count:
+            for neg_score, _, username in self._lists[index][offset:offset + count - len(entries)]:
+                entries.append((rank, username, -neg_score))
+                rank += 1
+            index += 1
+            offset = 0
+        return entries
+
+    def update(self, username: str, score: int) -> None:
+        """Record a user's new total score."""
+        with self._lock:
+            old_key = self._keys.get(username)
+            if old_key is not None:
+                if old_key[0] == -score:
+                    return
+                self._remove(old_key)
+                order = old_key[1]
+            else:
+                order = self._next_order
+                self._next_order += 1
+
+            key = (-score, order, username)
+            self._keys[username] = key
+            self._insert(key)
+
+    def rank(self, username: str) -> Optional[int]:
+        """Return the 1-based rank of a user, or None if unknown."""
+        with self._lock:
+            key = self._keys.get(username)
+            return self._position(key) + 1 if key is not None else None
+
+    def top(self, count: int, start: int = 0) -> List[Tuple[int, str, int]]:
+        """Return (rank, username, score) for ``count`` users from 0-based ``start``."""
+        with self._lock:
+            return self._slice(start, count)
+
+    def around(self, username: str, radius: int) -> List[Tuple[int, str, int]]:
+        """Return (rank, username, score) for the users within ``radius`` ranks of ``username``."""
+        with self._lock:
+            key = self._keys.get(username)
+            if key is None:
+                return []
+            position = self._position(key)
+            start = max(0, position - radius)
+            return self._slice(start, position - start + radius + 1)
+
+
+class WindowedScores:
+    """
+    Points each user earned within windows of whole days, such as the last week.
+
+    Points sit in per-day buckets, and every window keeps running totals for
+    the users who scored inside it. Adding points touches one bucket and the
+    totals of each window; when the day changes, only the buckets leaving a
+    window are subtracted from it, and buckets no window (nor
+    ``retention_days``) covers any more are dropped. Queries therefore never
+    revisit individual awards and only rank users active in the window.
+    """
+
+    def __init__(self, windows: Dict[str, Callable[[int], int]], days: Dict[int, Dict[str, int]],
+                 today: int, retention_days: int = 0):
+        self._lock = threading.Lock()
+        self._windows = windows
+        self._retention_days = retention_days
+        self._today = today
+        self._starts = {name: first_day(today) for name, first_day in windows.items()}
+        self._totals: Dict[str, Dict[str, int]] = {name: {} for name in windows}
+        self._days: Dict[int, Dict[str, int]] = {}
+        for day in sorted(days):
+            if self.oldest_day() <= day <= today:
+                self._add(day, days[day])
+
+    def oldest_day(self) -> int:
+        """First day whose bucket is still kept."""
+        return min(min(self._starts.values(), default=self._today), self._today - self._retention_days + 1)
+
+    def _add(self, day: int, deltas: Dict[str, int]) -> None:
+        bucket = self._days.setdefault(day, {})
+        for username, delta in deltas.items():
+            bucket[username] = bucket.get(username, 0) + delta
+        for name, start in self._starts.items():
+            if day >= start:
+                totals = self._totals[name]
+                for username, delta in deltas.items():
+                    totals[username] = totals.get(username, 0) + delta
+
+    def _advance(self, today: int) -> bool:
+        if today <= self._today:
+            return False
+        self._today = today
+        for name, first_day in self._windows.items():
+            start, old_start = first_day(today), self._starts[name]
+            self._starts[name] = start
+            totals = self._totals[name]
+            for day in [day for day in self._days if old_start <= day < start]:
+                for username, points in self._days[day].items():
+                    remaining = totals[username] - points
+                    if remaining:
+                        totals[username] = remaining
+                    else:
+                        del totals[username]
+        oldest = self.oldest_day()
+        expired = [day for day in self._days if day < oldest]
+        for day in expired:
+            del self._days[day]
+        return bool(expired)
+
+    def advance(self, today: int) -> bool:
+        """Move every window forward to ``today``; returns True if any bucket was dropped."""
+        with self._lock:
+            return self._advance(today)
+
+    def add(self, day: int, deltas: Dict[str, int]) -> None:
+        """Record points earned on ``day``."""
+        with self._lock:
+            self._advance(day)
+            if day >= self.oldest_day():
+                self._add(day, deltas)
+
+    def top(self, window: str, count: int, start: int = 0) -> List[Tuple[int, str, int]]:
+        """Return (rank, username, points) in ``window`` for ``count`` users from 0-based rank ``start``."""
+        with self._lock:
+            best = heapq.nlargest(start + count, self._totals[window].items(), key=lambda entry: entry[1])
+        return [(rank, username, points) for rank, (username, points) in enumerate(best[start:], start + 1)]
+
+    def active(self, window: str) -> int:
+        """Number of users who earned points in ``window``."""
+        with self._lock:
+            return len(self._totals[window])
+
+
+_rank_indexes: Dict[Optional[int], RankIndex] = {}
+_rank_index_lock = threading.Lock()
+
+
+def get_rank_index(guild_id: Optional[int] = None) -> RankIndex:
+    """Return a guild's rank index, building it from its storage backend on first use."""
+    guild_id = partition_key(guild_id)
+    rank_index = _rank_indexes.get(guild_id)
+    if rank_index is None:
+        with _rank_index_lock:
+            rank_index = _rank_indexes.get(guild_id)
+            if rank_index is None:
+                rank_index = _rank_indexes[guild_id] = RankIndex(get_backend(guild_id).user_scores())
+    return rank_index
+
+
+_window_scores: Dict[Optional[int], WindowedScores] = {}
+_window_scores_lock = threading.Lock()
+
+
+def get_window_scores(guild_id: Optional[int] = None) -> WindowedScores:
+    """
+    Return a guild's windowed scores, rolled forward to today.
+
+    Built from the backend's per-day scores on first use. Days that fall out
+    of every window are evicted from the backend as well.
+    """
+    guild_id = partition_key(guild_id)
+    backend = get_backend(guild_id)
+    today = current_day()
+    window_scores = _window_scores.get(guild_id)
+    if window_scores is None:
+        with _window_scores_lock:
+            window_scores = _window_scores.get(guild_id)
+            if window_scores is None:
+                oldest = min(min(first_day(today) for first_day in LEADERBOARD_WINDOWS.values()),
+                             today - SCORE_RETENTION_DAYS + 1)
+                window_scores = WindowedScores(LEADERBOARD_WINDOWS, backend.day_scores(oldest), today,
+                                               SCORE_RETENTION_DAYS)
+                backend.evict_day_scores(window_scores.oldest_day())
+                _window_scores[guild_id] = window_scores
+    if window_scores.advance(today):
+        backend.evict_day_scores(window_scores.oldest_day())
+    return window_scores
+
+
+def record_points(deltas: Dict[str, int], guild_id: Optional[int] = None) -> None:
+    """Add awarded points to today's bucket, in the backend and the windowed scores."""
+    window_scores = get_window_scores(guild_id)
+    day = current_day()
+    get_backend(guild_id).add_day_scores(day, deltas)
+    window_scores.add(day, deltas)
@@ -0,0 +1,66 @@
+import functools
+import threading
+from contextlib import contextmanager
+from typing import Callable, Dict, Iterator, List, TypeVar
+
+
+T = TypeVar("T")
+
+
+class KeyedLock:
+    """
+    One re-entrant lock per key, created on demand.
+
+    ``hold`` takes the locks for several keys in sorted order, so two callers
+    locking overlapping sets of users cannot deadlock. A key's lock is dropped
+    as soon as no thread holds or waits for it, so memory stays proportional
+    to the number of in-flight commands rather than the number of users.
+    """
+
+    def __init__(self):
+        self._guard = threading.Lock()
+        self._locks: Dict[str, List] = {}
+
+    @contextmanager
+    def hold(self, *keys: str) -> Iterator[None]:
+        """Hold the locks for all ``keys`` for the duration of the block."""
+        ordered = sorted(set(keys))
+
+        with self._guard:
+            entries = []
+            for key in ordered:
+                entry = self._locks.get(key)
+                if entry is None:
+                    entry = self._locks[key] = [threading.RLock(), 0]
+                entry[1] += 1
+                entries.append(entry)
+
+        acquired = []
+        try:
+            for entry in entries:
+                entry[0].acquire()
+                acquired.append(entry)
+            yield
+        finally:
+            for entry in reversed(acquired):
+                entry[0].release()
+            with self._guard:
+                for key, entry in zip(ordered, entries):
+                    entry[1] -= 1
+                    if entry[1] == 0:
+                        del self._locks[key]
+
+
+def locked(keyed_lock: KeyedLock) -> Callable[[Callable[..., T]], Callable[..., T]]:
+    """Decorator that holds ``keyed_lock`` for the function's first argument while it runs."""
+    def decorator(func: Callable[..., T]) -> Callable[..., T]:
+        @functools.wraps(func)
+        def wrapper(key: str, *args, **kwargs) -> T:
+            with keyed_lock.hold(key):
+                return func(key, *args, **kwargs)
+        return wrapper
+    return decorator
+
+
+user_locks = KeyedLock()
+team_quest_locks = KeyedLock()
@@ -0,0 +1,224 @@
+import functools
+import os
+import threading
+import time
+from typing import Callable, Dict, List, Optional, Tuple, TypeVar
+
+
+T = TypeVar("T")
+
+METRICS_FILE = os.getenv("METRICS_FILE", "activity/metrics.prom")
+METRICS_INTERVAL = float(os.getenv("METRICS_INTERVAL", "15"))
+
+# Upper bounds in seconds, Prometheus-style; the implicit last bucket is +Inf.
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+
+Labels = Tuple[Tuple[str, str], ...]
+
+
+class Histogram:
+    """Latency histogram with fixed buckets."""
+
+    def __init__(self, buckets: Tuple[float, ...] = LATENCY_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, seconds: float) -> None:
+        index = 0
+        while index < len(self.buckets) and seconds > self.buckets[index]:
+            index += 1
+        self.counts[index] += 1
+        self.count += 1
+        self.sum += seconds
+
+    def quantile(self, fraction: float) -> float:
+        """Upper bound of the bucket containing the given quantile (inf if beyond the last)."""
+        target = fraction * self.count
+        cumulative = 0
+        for bound, count in zip(self.buckets + (float("inf"),), self.counts):
+            cumulative += count
+            if cumulative >= target:
+                return bound
+        return float("inf")
+
+
+class MetricsRegistry:
+    """Thread-safe counters and histograms, rendered in Prometheus text format."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._counters: Dict[str, Dict[Labels, float]] = {}
+        self._histograms: Dict[str, Dict[Labels, Histogram]] = {}
+        self._help: Dict[str, str] = {}
+
+    def describe(self, name: str, help_text: str) -> None:
+        self._help[name] = help_text
+
+    def inc(self, name: str, amount: float = 1, **labels: str) -> None:
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            series = self._counters.setdefault(name, {})
+            series[key] = series.get(key, 0) + amount
+
+    def observe(self, name: str, seconds: float, **labels: str) -> None:
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            series = self._histograms.setdefault(name, {})
+            histogram = series.get(key)
+            if histogram is None:
+                histogram = series[key] = Histogram()
+            histogram.observe(seconds)
+
+    def counter(self, name: str, **labels: str) -> float:
+        with self._lock:
+            return self._counters.get(name, {}).get(tuple(sorted(labels.items())), 0)
+
+    def histograms(self, name: str) -> Dict[Labels, Histogram]:
+        with self._lock:
+            return dict(self._histograms.get(name, {}))
+
+    def counters(self, name: str) -> Dict[Labels, float]:
+        with self._lock:
+            return dict(self._counters.get(name, {}))
+
+    @staticmethod
+    def _format_labels(labels: Labels, extra: Optional[Tuple[str, str]] = None) -> str:
+        pairs = list(labels) + ([extra] if extra else [])
+        if not pairs:
+            return ""
+        return "{" + ",".join(f'{key}="{value}"' for key, value in pairs) + "}"
+
+    def render(self) -> str:
+        """Render every metric in the Prometheus text exposition format."""
+        lines: List[str] = []
+        with self._lock:
+            for name, series in sorted(self._counters.items()):
+                if name in self._help:
+                    lines.append(f"# HELP {name} {self._help[name]}")
+                lines.append(f"# TYPE {name} counter")
+                for labels, value in sorted(series.items()):
+                    lines.append(f"{name}{self._format_labels(labels)} {value:g}")
+
+            for name, series in sorted(self._histograms.items()):
+                if name in self._help:
+                    lines.append(f"# HELP {name} {self._help[name]}")
+                lines.append(f"# TYPE {name} histogram")
+                for labels, histogram in sorted(series.items()):
+                    cumulative = 0
+                    for bound, count in zip(histogram.buckets + (float("inf"),), histogram.counts):
+                        cumulative += count
+                        le = "+Inf" if bound == float("inf") else f"{bound:g}"
+                        lines.append(f"{name}_bucket{self._format_labels(labels, ('le', le))} {cumulative}")
+                    lines.append(f"{name}_sum{self._format_labels(labels)} {histogram.sum:.6f}")
+                    lines.append(f"{name}_count{self._format_labels(labels)} {histogram.count}")
+        return "\n".join(lines) + "\n"
+
+
+registry = MetricsRegistry()
+registry.describe("helldiver_command_duration_seconds", "Latency of bot commands.")
+registry.describe("helldiver_command_errors_total", "Bot commands that raised an error.")
+registry.describe("helldiver_function_duration_seconds", "Latency of quest, team-quest and storage helpers.")
+registry.describe("helldiver_function_errors_total", "Quest, team-quest and storage helpers that raised.")
+registry.describe("helldiver_file_operations_total", "File reads and writes by state file kind.")
+registry.describe("helldiver_file_bytes_total", "Bytes read and written by state file kind.")
+
+
+def observe_command(command: str, seconds: float, failed: bool) -> None:
+    """Record one bot command invocation."""
+    registry.observe("helldiver_command_duration_seconds", seconds, command=command)
+    if failed:
+        registry.inc("helldiver_command_errors_total", command=command)
+
+
+def record_io(direction: str, kind: str, nbytes: int) -> None:
+    """Record a file read or write of ``nbytes`` bytes; ``direction`` is "read" or "write"."""
+    registry.inc("helldiver_file_operations_total", direction=direction, kind=kind)
+    registry.inc("helldiver_file_bytes_total", nbytes, direction=direction, kind=kind)
+
+
+def timed(func: Callable[..., T]) -> Callable[..., T]:
+    """Decorator recording a helper's latency, call count and errors under its name."""
+    name = func.__name__
+
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs) -> T:
+        start = time.perf_counter()
+        try:
+            return func(*args, **kwargs)
+        except Exception:
+            registry.inc("helldiver_function_errors_total", function=name)
+            raise
+        finally:
+            registry.observe("helldiver_function_duration_seconds", time.perf_counter() - start, function=name)
+    return wrapper
+
+
+def format_summary() -> str:
+    """Short human-readable summary for the !metrics command."""
+    lines = ["command          calls   errors   p50      p95"]
+    commands = registry.histograms("helldiver_command_duration_seconds")
+    for labels, histogram in sorted(commands.items()):
+        command = dict(labels)["command"]
+        errors = registry.counter("helldiver_command_errors_total", command=command)
+        lines.append(
+            f"{command:<16} {histogram.count:>5} {errors:>8g}   "
+            f"{_format_seconds(histogram.quantile(0.5)):<8} {_format_seconds(histogram.quantile(0.95))}"
+        )
+
+    lines.append("")
+    lines.append("file I/O         ops      bytes")
+    operations = registry.counters("helldiver_file_operations_total")
+    for labels, count in sorted(operations.items()):
+        label_map = dict(labels)
+        nbytes = registry.counter("helldiver_file_bytes_total", **label_map)
+        lines.append(f"{label_map['kind'] + ' ' + label_map['direction']:<16} {count:>5g} {nbytes:>10g}")
+
+    reads: Dict[str, Dict[str, float]] = {}
+    for labels, count in registry.counters("helldiver_read_cache_requests_total").items():
+        label_map = dict(labels)
+        reads.setdefault(label_map["function"], {})[label_map["result"]] = count
+    if reads:
+        lines.append("")
+        lines.append("read cache       hits   misses  coalesced")
+        for function, results in sorted(reads.items()):
+            lines.append(f"{function[:16]:<16} {results.get('hit', 0):>5g} {results.get('miss', 0):>8g} "
+                         f"{results.get('coalesced', 0):>10g}")
+
+    refused = registry.counters("helldiver_commands_refused_total")
+    if refused:
+        lines.append("")
+        lines.append("refused          commands")
+        for labels, count in sorted(refused.items()):
+            lines.append(f"{dict(labels)['reason']:<16} {count:>8g}")
+    return "\n".join(lines)
+
+
+def _format_seconds(seconds: float) -> str:
+    if seconds == float("inf"):
+        return f">{LATENCY_BUCKETS[-1]:g}s"
+    return f"≤{seconds * 1000:g}ms"
+
+
+def write_metrics_file(path: str = METRICS_FILE) -> None:
+    """Write the Prometheus text file atomically so a scraper never reads half of it."""
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "w") as f:
+        f.write(registry.render())
+    os.replace(tmp_path, path)
+
+
+def start_exporter(path: str = METRICS_FILE, interval: float = METRICS_INTERVAL) -> threading.Thread:
+    """Rewrite the metrics file every ``interval`` seconds from a daemon thread."""
+    def run() -> None:
+        while True:
+            time.sleep(interval)
+            try:
+                write_metrics_file(path)
+            except OSError as exc:
+                print(f"Could not write metrics to {path}: {exc}")
+
+    thread = threading.Thread(target=run, name="metrics-exporter", daemon=True)
+    thread.start()
+    return thread
@@ -0,0 +1,114 @@
+import json
+import logging
+import os
+import random
+import threading
+import zlib
+from typing import Dict, List, Optional, Tuple
+from metrics import record_io
+from schema import Quest
+
+
+QUEST_LIST_PATH = "questLists/quest_list.json"
+TEAM_QUEST_LIST_PATH = "questLists/team_quest_list.json"
+
+log = logging.getLogger(__name__)
+
+
+class QuestCatalog:
+    """
+    A quest list file loaded into memory and bucketed by difficulty.
+
+    The file is parsed once; every later call only checks its modification
+    time and re-reads it when it changed, so catalogs can be edited while the
+    bot runs. Each bucket has a version, a checksum of its quest IDs in
+    order, that shuffle bags use to notice edits. Entries that do not describe a valid ``schema.Quest`` are
+    skipped with a warning instead of failing a command later.
+    """
+
+    def __init__(self, path: str, key: str):
+        self.path = path
+        self.key = key
+        self._mtime: Optional[int] = None
+        self._buckets: Dict[int, Tuple[int, List[Quest]]] = {}
+        self._by_id: Dict[str, Quest] = {}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _validate(entry: dict) -> Optional[str]:
+        """Return why ``entry`` is not a valid quest, or None if it is."""
+        if not isinstance(entry, dict):
+            return "not an object"
+        difficulty = entry.get("difficulty")
+        if not isinstance(difficulty, int) or isinstance(difficulty, bool) or difficulty < 1:
+            return f"invalid difficulty {difficulty!r}"
+        for field in ("title", "description"):
+            if not isinstance(entry.get(field), str) or not entry[field].strip():
+                return f"missing {field}"
+        return None
+
+    def _refresh(self) -> None:
+        """Reload the file if its modification time changed."""
+        mtime = os.stat(self.path).st_mtime_ns
+        if mtime == self._mtime:
+            return
+
+        with self._lock:
+            if mtime == self._mtime:
+                return
+            with open(self.path, "r") as f:
+                data = json.load(f)
+            record_io("read", "catalog", os.path.getsize(self.path))
+
+            buckets: Dict[int, List[Quest]] = {}
+            by_id: Dict[str, Quest] = {}
+            for index, entry in enumerate(data[self.key]):
+                problem = self._validate(entry)
+                if problem:
+                    log.warning("Skipping quest #%d in %s: %s", index, self.path, problem)
+                    continue
+                quest = Quest.from_dict(entry)
+                if quest.quest_id in by_id:
+                    log.warning("Skipping quest #%d in %s: duplicate id %r", index, self.path, quest.quest_id)
+                    continue
+                buckets.setdefault(quest.difficulty, []).append(quest)
+                by_id[quest.quest_id] = quest
+
+            self._buckets = {
+                difficulty: (zlib.crc32("\n".join(q.quest_id for q in bucket).encode()), bucket)
+                for difficulty, bucket in buckets.items()
+            }
+            self._by_id = by_id
+            self._mtime = mtime
+
+    def quests(self, difficulty: int) -> List[Quest]:
+        """Return every quest of the given difficulty."""
+        self._refresh()
+        return self._buckets.get(difficulty, (0, []))[1]
+
+    def get(self, quest_id: str) -> Optional[Quest]:
+        """Look up a quest by ID, or None if the catalog no longer has it."""
+        self._refresh()
+        return self._by_id.get(quest_id)
+
+    def choose(self, difficulty: int) -> Optional[Quest]:
+        """Pick a random quest of the given difficulty, or None if there is none."""
+        bucket = self.quests(difficulty)
+        return random.choice(bucket) if bucket else None
+
+    def draw(self, owner: str, difficulty: int, bags) -> Optional[Quest]:
+        """
+        Pick ``owner``'s next quest of the given difficulty from their shuffle bag.
+
+        ``bags`` is the ``StorageBackend`` holding the bags. No quest repeats
+        for an owner until every quest in the bucket has been drawn.
+        """
+        self._refresh()
+        version, bucket = self._buckets.get(difficulty, (0, []))
+        if not bucket:
+            return None
+        return bucket[bags.draw_from_bag(f"{self.key}:{owner}", difficulty, version, len(bucket))]
+
+
+quest_catalog = QuestCatalog(QUEST_LIST_PATH, "quests")
+team_quest_catalog = QuestCatalog(TEAM_QUEST_LIST_PATH, "team_quests")
@@ -1,55 +1,24 @@
-import json
-import random
-from typing import Optional, Tuple
-from schema import Quest, User
-from utils import get_or_create_user, save_user, award_points_to_players
+from typing import List, Optional, Tuple
+from leaderboard import get_rank_index
+from locks import locked, user_locks
+from metrics import timed
+from quest_catalog import quest_catalog
+from schema import Quest, QuestRef, StatEvent
+from storage import get_backend
+from utils import get_user, get_or_create_user, save_user, award_points_to_players, record_quest_outcome
 
 
-def load_user_list() -> dict:
-    """Load user quests from JSON file."""
-    with open("activity/user_list.json", "r") as f:
-        return json.load(f)
+def quest_title(ref: QuestRef) -> str:
+    """Title of a referenced quest, falling back to its ID if it left the catalog."""
+    quest = quest_catalog.get(ref.quest_id)
+    return quest.title if quest else ref.quest_id
 
 
-def save_user_list(users: list) -> None:
-    """Save user quests to JSON file."""
-    with open("activity/user_list.json", "w") as f:
-        json.dump({"users": [u.to_dict() for u in users]}, f, indent=2)
-
-
-def get_user(username: str) -> Optional[User]:
-    """Get User object by username, returns None if not found."""
-    data = load_user_list()
-    for user_data in data["users"]:
-        if user_data["username"] == username:
-            return User.from_dict(user_data)
-    return None
-
-
-def get_or_create_user(username: str) -> User:
-    """Get existing user or create a new one."""
-    user = get_user(username)
-    if user:
-        return user
-    return User(username)
-
-
-def save_user(user: User) -> None:
-    """Save or update a single user in the JSON file."""
-    data = load_user_list()
-    user_entry = next((u for u in data["users"] if u["username"] == user.username), None)
-    
-    if user_entry:
-        user_entry.update(user.to_dict())
-    else:
-        data["users"].append(user.to_dict())
-    
-    save_user_list([User.from_dict(u) for u in data["users"]])
-
-
-def generate_quest(username: str, difficulty: int) -> Tuple[Optional[Quest], str]:
+@timed
+@locked(user_locks)
+def generate_quest(username: str, difficulty: int, guild_id: Optional[int] = None) -> Tuple[Optional[Quest], str]:
     """Generate a quest for the given user at the specified difficulty."""
-    user = get_or_create_user(username)
+    user = get_or_create_user(username, guild_id)
     
     if user.active_quest:
         response_text = f"""
@@ -60,25 +29,19 @@ def generate_quest(username: str, difficulty: int) -> Tuple[Optional[Quest], str
 **helldiver:** {username}
 
 You already have an active quest:
-**{user.active_quest['title']}**
+**{quest_title(user.active_quest)}**
 
 Complete or abandon it before requesting a new one!
 """
         return None, response_text
     
-    with open("questLists/quest_list.json", "r") as f:
-        data = json.load(f)
+    quest = quest_catalog.draw(username, difficulty, get_backend(guild_id))
 
-    matching_quests = [q for q in data["quests"] if q["difficulty"] == difficulty]
-
-    if not matching_quests:
+    if quest is None:
         return None, "No quests available for that difficulty."
-
-    quest_data = random.choice(matching_quests)
-    quest = Quest(quest_data["difficulty"], quest_data["title"], quest_data["description"])
     
-    user.active_quest = {"title": quest.title, "difficulty": quest.difficulty, "description": quest.description}
-    save_user(user)
+    user.active_quest = quest.ref()
+    save_user(user, guild_id)
     
     response_text = f"""
 ════════════════════════════════════════
@@ -100,36 +63,74 @@ Good luck, helldiver!
     return quest, response_text
 
 
-def complete_user_quest(username: str) -> str:
+@timed
+def generate_quests(usernames: List[str], difficulty: int,
+                    guild_id: Optional[int] = None) -> Tuple[List[Tuple[str, Quest]], List[Tuple[str, str]]]:
+    """
+    Assign a quest to each of several users in a single storage write.
+    
+    Users who already have an active quest are skipped. Returns
+    (username, quest) for every assignment and (username, active quest
+    title) for every skipped user.
+    """
+    usernames = list(dict.fromkeys(usernames))
+    assigned: List[Tuple[str, Quest]] = []
+    skipped: List[Tuple[str, str]] = []
+    new_users: List[str] = []
+    
+    with user_locks.hold(*usernames):
+        for username in usernames:
+            user = get_user(username, guild_id)
+            if user and user.active_quest:
+                skipped.append((username, quest_title(user.active_quest)))
+                continue
+            quest = quest_catalog.draw(username, difficulty, get_backend(guild_id))
+            if quest is None:
+                return [], []
+            assigned.append((username, quest))
+            if user is None:
+                new_users.append(username)
+        
+        if assigned:
+            get_backend(guild_id).assign_quests({username: quest.ref() for username, quest in assigned})
+        rank_index = get_rank_index(guild_id)
+        for username in new_users:
+            rank_index.update(username, 0)
+        get_backend(guild_id).bump_version()
+    
+    return assigned, skipped
+
+
+@timed
+@locked(user_locks)
+def complete_user_quest(username: str, guild_id: Optional[int] = None) -> str:
     """Clear active quest for a user and award points based on difficulty."""
-    user = get_or_create_user(username)
+    user = get_or_create_user(username, guild_id)
     
     if not user.active_quest:
         return f"No active quest to complete for {username}."
     
-    difficulty = user.active_quest["difficulty"]
-    points_earned = difficulty * 100
-    user.active_quest = None
-    save_user(user)
+    ref = user.active_quest
+    points_earned = ref.difficulty * 100
     
-    reward_text = award_points_to_players([username], points_earned)
+    reward_text = award_points_to_players([username], points_earned, clear_active_quest=True, guild_id=guild_id)
+    record_quest_outcome(StatEvent.SOLO_COMPLETED, [username], ref, guild_id)
     return f"Quest completed for {username}.\n{reward_text}"
 
 
-def abandon_user_quest(username: str) -> str:
+@timed
+@locked(user_locks)
+def abandon_user_quest(username: str, guild_id: Optional[int] = None) -> str:
     """Abandon active quest for a user without awarding points."""
-    user = get_or_create_user(username)
+    user = get_or_create_user(username, guild_id)
     
     if not user.active_quest:
         return f"No active quest to abandon for {username}."
     
-    quest_title = user.active_quest["title"]
+    ref = user.active_quest
+    title = quest_title(ref)
     user.active_quest = None
-    save_user(user)
+    save_user(user, guild_id)
+    record_quest_outcome(StatEvent.ABANDONED, [username], ref, guild_id)
     
-    return f"Quest '{quest_title}' abandoned, {username}. Better luck next time, helldiver!"
-
-
-def generate_team_quest_message(username: str) -> str:
-    """Generate a custom team quest message for a user. TODO: Implement full logic."""
-    return f"🎯 **TEAM QUEST ALERT**\n\nSoldier {username}, you have been selected for a team mission!\n\nStand by for further orders, soldier!"
\ No newline at end of file
+    return f"Quest '{title}' abandoned, {username}. Better luck next time, helldiver!"
\ No newline at end of file
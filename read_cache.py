@@ -0,0 +1,121 @@
+import functools
+import inspect
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Hashable, Optional, Tuple, TypeVar
+from metrics import registry
+from storage import get_backend, partition_key
+
+
+T = TypeVar("T")
+
+# Seconds a cached result is reused for at most, for output that also depends on the clock.
+READ_CACHE_TTL = float(os.getenv("READ_CACHE_TTL", "30"))
+READ_CACHE_SIZE = int(os.getenv("READ_CACHE_SIZE", "2048"))
+
+registry.describe("helldiver_read_cache_requests_total",
+                  "Cached reads by result: hit, miss, or coalesced onto a computation already running.")
+
+
+class _Flight:
+    """A computation in progress that identical requests wait on."""
+
+    __slots__ = ("version", "done", "value", "error")
+
+    def __init__(self, version: int):
+        self.version = version
+        self.done = threading.Event()
+        self.value: Any = None
+        self.error: Optional[BaseException] = None
+
+
+class ReadCache:
+    """
+    Results of read-only commands, shared between concurrent callers and reused until state changes.
+
+    Every entry records the state version it was computed at and is only
+    served while that version is still current and the entry is younger
+    than ``ttl`` seconds. A request that misses while an identical one is
+    being computed waits for that result instead of computing its own
+    (single flight). Results computed while a write landed are returned but
+    not stored. At most ``size`` entries are kept, least recently used
+    first out.
+    """
+
+    def __init__(self, ttl: float = READ_CACHE_TTL, size: int = READ_CACHE_SIZE):
+        self.ttl = ttl
+        self.size = size
+        self._lock = threading.Lock()
+        self._entries: "OrderedDict[Hashable, Tuple[int, float, Any]]" = OrderedDict()
+        self._flights: Dict[Hashable, _Flight] = {}
+
+    def get(self, key: Hashable, version: Callable[[], int], compute: Callable[[], T], name: str = "") -> T:
+        """Return the cached result for ``key`` at the current ``version()``, computing it at most once."""
+        with self._lock:
+            current = version()
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] == current and entry[1] > time.monotonic():
+                self._entries.move_to_end(key)
+                registry.inc("helldiver_read_cache_requests_total", function=name, result="hit")
+                return entry[2]
+
+            flight = self._flights.get(key)
+            leader = flight is None or flight.version != current
+            if leader:
+                flight = self._flights[key] = _Flight(current)
+            registry.inc("helldiver_read_cache_requests_total", function=name,
+                         result="miss" if leader else "coalesced")
+
+        if not leader:
+            flight.done.wait()
+            if flight.error is not None:
+                raise flight.error
+            return flight.value
+
+        try:
+            flight.value = compute()
+        except BaseException as error:
+            flight.error = error
+            raise
+        finally:
+            with self._lock:
+                if self._flights.get(key) is flight:
+                    del self._flights[key]
+                if flight.error is None and version() == current:
+                    self._entries[key] = (current, time.monotonic() + self.ttl, flight.value)
+                    self._entries.move_to_end(key)
+                    while len(self._entries) > self.size:
+                        self._entries.popitem(last=False)
+            flight.done.set()
+        return flight.value
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+
+
+read_cache = ReadCache()
+
+
+def cached_read(func: Callable[..., T]) -> Callable[..., T]:
+    """
+    Serve ``func`` through ``read_cache``, keyed by its arguments.
+
+    ``func`` must take a ``guild_id`` argument; the version of that guild's
+    storage backend decides when cached results go stale.
+    """
+    signature = inspect.signature(func)
+    name = func.__name__
+
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs) -> T:
+        bound = signature.bind(*args, **kwargs)
+        bound.apply_defaults()
+        arguments = dict(bound.arguments)
+        arguments["guild_id"] = partition_key(arguments["guild_id"])
+        backend = get_backend(arguments["guild_id"])
+        key = (name, *arguments.items())
+        return read_cache.get(key, lambda: backend.version, lambda: func(*args, **kwargs), name)
+    return wrapper
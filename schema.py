@@ -1,20 +1,69 @@
+import re
 from enum import Enum
+from typing import List, NamedTuple, Optional
 
 class QuestStatus(Enum):
     IN_PROGRESS = "in progress"
     COMPLETED = "completed"
     FAILED = "failed"
 
+class StatEvent(Enum):
+    SOLO_COMPLETED = "solo_completed"
+    TEAM_COMPLETED = "team_completed"
+    ABANDONED = "abandoned"
+    TEAM_FAILED = "team_failed"
+
+# Difficulties run from 1 to DIFFICULTY_LEVELS.
+DIFFICULTY_LEVELS = 3
+
+def quest_slug(title: str) -> str:
+    """Stable quest ID derived from a title, used when a catalog entry has no explicit "id"."""
+    return re.sub(r"[^a-z0-9]+", "-", title.lower()).strip("-")
+
+class QuestRef(NamedTuple):
+    """Reference to a catalog quest; difficulty is kept so scoring works even if the quest is later removed."""
+    quest_id: str
+    difficulty: int
+
+    def to_dict(self):
+        return {"id": self.quest_id, "difficulty": self.difficulty}
+
+    @staticmethod
+    def from_dict(data):
+        # Older saves hold a full copy of the quest instead of a reference.
+        quest_id = data.get("id") or quest_slug(data["title"])
+        return QuestRef(quest_id, data["difficulty"])
+
 class Quest:
-    def __init__(self, difficulty: int, title: str, description: str):
+    __slots__ = ("difficulty", "title", "description", "quest_id")
+
+    def __init__(self, difficulty: int, title: str, description: str, quest_id: Optional[str] = None):
         self.difficulty = difficulty
         self.title = title
         self.description = description
+        self.quest_id = quest_id or quest_slug(title)
+    
+    def ref(self) -> QuestRef:
+        return QuestRef(self.quest_id, self.difficulty)
+    
+    def to_dict(self):
+        return {
+            "id": self.quest_id,
+            "difficulty": self.difficulty,
+            "title": self.title,
+            "description": self.description
+        }
+    
+    @staticmethod
+    def from_dict(data):
+        return Quest(data["difficulty"], data["title"], data["description"], data.get("id"))
     
     def __str__(self):
         return f"**{self.title}** (Difficulty: {self.difficulty})\n{self.description}"
 
 class GeneratedQuest:
+    __slots__ = ("user", "quest", "status")
+
     def __init__(self, user: str, quest: Quest, status: QuestStatus = QuestStatus.IN_PROGRESS):
         self.user = user
         self.quest = quest
@@ -26,7 +75,9 @@ class GeneratedQuest:
 
 
 class User:
-    def __init__(self, username: str, active_quest: dict = None, score: int = 0):
+    __slots__ = ("username", "active_quest", "score")
+
+    def __init__(self, username: str, active_quest: Optional[QuestRef] = None, score: int = 0):
         self.username = username
         self.active_quest = active_quest
         self.score = score
@@ -34,38 +85,133 @@ class User:
     def to_dict(self):
         return {
             "username": self.username,
-            "active_quest": self.active_quest,
+            "active_quest": self.active_quest.to_dict() if self.active_quest else None,
             "score": self.score
         }
     
     @staticmethod
     def from_dict(data):
-        return User(data["username"], data.get("active_quest"), data.get("score", 0))
+        active_quest = data.get("active_quest")
+        return User(data["username"], QuestRef.from_dict(active_quest) if active_quest else None, data.get("score", 0))
+
+class UserStats:
+    """
+    Running quest counters for one player (or a whole server), updated as quests end.
+
+    Completions are counted per difficulty, solo and team separately. The
+    streak counts consecutive UTC days (days since the epoch) with at least
+    one completion. Stored as a flat list, see ``to_list``.
+    """
+    __slots__ = ("solo_completed", "team_completed", "abandoned", "team_failed", "streak", "best_streak", "last_day")
+
+    def __init__(self, solo_completed: Optional[List[int]] = None, team_completed: Optional[List[int]] = None,
+                 abandoned: int = 0, team_failed: int = 0, streak: int = 0, best_streak: int = 0, last_day: int = -1):
+        self.solo_completed = solo_completed or [0] * DIFFICULTY_LEVELS
+        self.team_completed = team_completed or [0] * DIFFICULTY_LEVELS
+        self.abandoned = abandoned
+        self.team_failed = team_failed
+        self.streak = streak
+        self.best_streak = best_streak
+        self.last_day = last_day
+    
+    def record(self, event: StatEvent, difficulty: int, day: int) -> None:
+        """Count one event for a quest of ``difficulty`` that ended on ``day``."""
+        if event is StatEvent.SOLO_COMPLETED:
+            self.solo_completed[difficulty - 1] += 1
+        elif event is StatEvent.TEAM_COMPLETED:
+            self.team_completed[difficulty - 1] += 1
+        elif event is StatEvent.ABANDONED:
+            self.abandoned += 1
+        elif event is StatEvent.TEAM_FAILED:
+            self.team_failed += 1
+        
+        if event in (StatEvent.SOLO_COMPLETED, StatEvent.TEAM_COMPLETED) and day > self.last_day:
+            self.streak = self.streak + 1 if day == self.last_day + 1 else 1
+            self.best_streak = max(self.best_streak, self.streak)
+            self.last_day = day
+    
+    def completed(self) -> int:
+        return sum(self.solo_completed) + sum(self.team_completed)
+    
+    def current_streak(self, today: int) -> int:
+        """The streak as of ``today``: still alive if the last completion was today or yesterday."""
+        return self.streak if self.last_day >= today - 1 else 0
+    
+    def to_list(self) -> List[int]:
+        return [*self.solo_completed, *self.team_completed, self.abandoned, self.team_failed,
+                self.streak, self.best_streak, self.last_day]
+    
+    @staticmethod
+    def from_list(data: List[int]):
+        n = DIFFICULTY_LEVELS
+        return UserStats(list(data[:n]), list(data[n:2 * n]), *data[2 * n:])
+
+class QuestStats:
+    """How often one catalog quest was completed, abandoned or failed, server-wide."""
+    __slots__ = ("completed", "abandoned", "failed")
+
+    def __init__(self, completed: int = 0, abandoned: int = 0, failed: int = 0):
+        self.completed = completed
+        self.abandoned = abandoned
+        self.failed = failed
+    
+    def record(self, event: StatEvent) -> None:
+        if event in (StatEvent.SOLO_COMPLETED, StatEvent.TEAM_COMPLETED):
+            self.completed += 1
+        elif event is StatEvent.ABANDONED:
+            self.abandoned += 1
+        elif event is StatEvent.TEAM_FAILED:
+            self.failed += 1
+    
+    def to_list(self) -> List[int]:
+        return [self.completed, self.abandoned, self.failed]
+    
+    @staticmethod
+    def from_list(data: List[int]):
+        return QuestStats(*data)
 
 class TeamQuest:
-    def __init__(self, quest: Quest, players: list[str], quest_id: str = None, status: QuestStatus = QuestStatus.IN_PROGRESS):
+    __slots__ = ("quest_id", "quest", "players", "status", "created_at", "expires_at", "channel_id")
+
+    def __init__(self, quest: Quest, players: list[str], quest_id: str = None, status: QuestStatus = QuestStatus.IN_PROGRESS,
+                 created_at: Optional[float] = None, expires_at: Optional[float] = None, channel_id: Optional[int] = None):
         self.quest_id = quest_id
         self.quest = quest
         self.players = players
         self.status = status
+        self.created_at = created_at
+        self.expires_at = expires_at
+        self.channel_id = channel_id
     
     def to_dict(self):
         return {
             "quest_id": self.quest_id,
-            "quest": {
-                "difficulty": self.quest.difficulty,
-                "title": self.quest.title,
-                "description": self.quest.description
-            },
+            "quest": self.quest.to_dict(),
+            "players": self.players,
+            "status": self.status.value,
+            "created_at": self.created_at,
+            "expires_at": self.expires_at,
+            "channel_id": self.channel_id
+        }
+    
+    def to_history(self, ended_at: float):
+        """Compact record of a finished team quest: the catalog quest is kept by reference."""
+        return {
+            "quest_id": self.quest_id,
+            "quest": self.quest.quest_id,
+            "difficulty": self.quest.difficulty,
             "players": self.players,
-            "status": self.status.value
+            "status": self.status.value,
+            "created_at": self.created_at,
+            "ended_at": ended_at
         }
     
     @staticmethod
     def from_dict(data):
-        quest = Quest(data["quest"]["difficulty"], data["quest"]["title"], data["quest"]["description"])
+        quest = Quest.from_dict(data["quest"])
         status = QuestStatus(data.get("status", "in progress"))
-        return TeamQuest(data["quest_id"], quest, data["players"], status)
+        return TeamQuest(quest, data["players"], data["quest_id"], status,
+                         data.get("created_at"), data.get("expires_at"), data.get("channel_id"))
     
     def __str__(self):
         players_str = ", ".join(self.players)
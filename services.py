@@ -0,0 +1,35 @@
+import asyncio
+import functools
+import os
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, TypeVar
+
+
+T = TypeVar("T")
+
+STORAGE_WORKERS = int(os.getenv("STORAGE_WORKERS", "4"))
+
+_executor = ThreadPoolExecutor(max_workers=STORAGE_WORKERS, thread_name_prefix="storage")
+_pending = 0
+
+
+async def run_blocking(func: Callable[..., T], *args: Any, **kwargs: Any) -> T:
+    """
+    Run a synchronous quest, team-quest or stats function on the storage thread pool.
+
+    Every command handler awaits its game logic through this so that file and
+    database I/O never runs on the discord.py event loop. The pool is bounded
+    by STORAGE_WORKERS (default 4).
+    """
+    global _pending
+    loop = asyncio.get_running_loop()
+    _pending += 1
+    try:
+        return await loop.run_in_executor(_executor, functools.partial(func, *args, **kwargs))
+    finally:
+        _pending -= 1
+
+
+def pending_jobs() -> int:
+    """Jobs handed to ``run_blocking`` that are waiting for a worker or running."""
+    return _pending
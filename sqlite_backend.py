@@ -0,0 +1,434 @@
+import json
+import sqlite3
+import threading
+import time
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+from schema import Quest, QuestRef, QuestStats, QuestStatus, StatEvent, TeamQuest, User, UserStats
+from storage import StorageBackend
+from store import bag_order, bag_seed
+
+
+DEFAULT_DB_PATH = "activity/helldivers.db"
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS users (
+    username TEXT PRIMARY KEY,
+    score INTEGER NOT NULL DEFAULT 0,
+    active_quest TEXT
+);
+CREATE INDEX IF NOT EXISTS idx_users_score ON users (score DESC);
+
+CREATE TABLE IF NOT EXISTS team_quests (
+    quest_id TEXT PRIMARY KEY,
+    difficulty INTEGER NOT NULL,
+    title TEXT NOT NULL,
+    description TEXT NOT NULL,
+    status TEXT NOT NULL,
+    created_at REAL,
+    expires_at REAL,
+    channel_id INTEGER,
+    catalog_id TEXT
+);
+
+CREATE TABLE IF NOT EXISTS team_quest_players (
+    quest_id TEXT NOT NULL REFERENCES team_quests (quest_id) ON DELETE CASCADE,
+    position INTEGER NOT NULL,
+    player TEXT NOT NULL,
+    PRIMARY KEY (quest_id, position)
+);
+CREATE INDEX IF NOT EXISTS idx_team_quest_players_player ON team_quest_players (player);
+
+CREATE TABLE IF NOT EXISTS team_quest_history (
+    quest_id TEXT NOT NULL,
+    quest TEXT NOT NULL,
+    difficulty INTEGER NOT NULL,
+    players TEXT NOT NULL,
+    status TEXT NOT NULL,
+    created_at REAL,
+    ended_at REAL NOT NULL
+);
+
+-- Bags used to be stored as explicit permutations; those simply start over.
+DROP TABLE IF EXISTS quest_bags;
+CREATE TABLE IF NOT EXISTS shuffle_bags (
+    owner TEXT NOT NULL,
+    difficulty INTEGER NOT NULL,
+    version INTEGER NOT NULL,
+    size INTEGER NOT NULL,
+    seed INTEGER NOT NULL,
+    drawn INTEGER NOT NULL,
+    last INTEGER NOT NULL,
+    PRIMARY KEY (owner, difficulty)
+);
+
+CREATE TABLE IF NOT EXISTS score_days (
+    day INTEGER NOT NULL,
+    username TEXT NOT NULL,
+    points INTEGER NOT NULL,
+    PRIMARY KEY (day, username)
+);
+
+CREATE TABLE IF NOT EXISTS user_stats (
+    username TEXT PRIMARY KEY,
+    counters TEXT NOT NULL
+);
+
+CREATE TABLE IF NOT EXISTS quest_stats (
+    quest_id TEXT PRIMARY KEY,
+    completed INTEGER NOT NULL DEFAULT 0,
+    abandoned INTEGER NOT NULL DEFAULT 0,
+    failed INTEGER NOT NULL DEFAULT 0
+);
+
+CREATE TABLE IF NOT EXISTS meta (
+    key TEXT PRIMARY KEY,
+    value TEXT NOT NULL
+);
+"""
+
+# Columns added to tables after their first release, added to older databases on open.
+ADDED_COLUMNS = {
+    "team_quests": (("created_at", "REAL"), ("expires_at", "REAL"), ("channel_id", "INTEGER"),
+                    ("catalog_id", "TEXT")),
+}
+
+
+class SqliteBackend(StorageBackend):
+    """
+    Storage in a single SQLite database.
+
+    Users are indexed by username (primary key) and score, team quests by
+    quest_id, and team membership by player, so lookups and leaderboard
+    queries do not scan the whole population.
+    """
+
+    def __init__(self, path: str = DEFAULT_DB_PATH):
+        self.path = path
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute("PRAGMA foreign_keys=ON")
+        self._conn.executescript(SCHEMA)
+        for table, columns in ADDED_COLUMNS.items():
+            existing = {row[1] for row in self._conn.execute(f"PRAGMA table_info({table})")}
+            for name, column_type in columns:
+                if name not in existing:
+                    self._conn.execute(f"ALTER TABLE {table} ADD COLUMN {name} {column_type}")
+        self._lock = threading.RLock()
+
+    @staticmethod
+    def _row_to_user(row) -> User:
+        username, active_quest, score = row
+        return User(username, QuestRef.from_dict(json.loads(active_quest)) if active_quest else None, score)
+
+    def get_user(self, username: str) -> Optional[User]:
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT username, active_quest, score FROM users WHERE username = ?", (username,)
+            ).fetchone()
+        return self._row_to_user(row) if row else None
+
+    def save_user(self, user: User) -> None:
+        with self._lock:
+            self._conn.execute(
+                "INSERT INTO users (username, active_quest, score) VALUES (?, ?, ?) "
+                "ON CONFLICT (username) DO UPDATE SET active_quest = excluded.active_quest, score = excluded.score",
+                (user.username, json.dumps(user.active_quest.to_dict()) if user.active_quest else None, user.score),
+            )
+
+    def _add_scores(self, deltas: Dict[str, int], clear_quests: Iterable[str] = ()) -> Dict[str, int]:
+        self._conn.executemany(
+            "INSERT INTO users (username, score) VALUES (?, ?) "
+            "ON CONFLICT (username) DO UPDATE SET score = score + excluded.score",
+            list(deltas.items()),
+        )
+        self._conn.executemany(
+            "UPDATE users SET active_quest = NULL WHERE username = ?",
+            [(username,) for username in clear_quests],
+        )
+        return {
+            username: self._conn.execute("SELECT score FROM users WHERE username = ?", (username,)).fetchone()[0]
+            for username in deltas
+        }
+
+    def add_scores(self, deltas: Dict[str, int], clear_quests: Iterable[str] = ()) -> Dict[str, int]:
+        with self._lock, self._conn:
+            self._conn.execute("BEGIN")
+            return self._add_scores(deltas, clear_quests)
+
+    def assign_quests(self, assignments: Dict[str, QuestRef]) -> None:
+        with self._lock, self._conn:
+            self._conn.execute("BEGIN")
+            self._conn.executemany(
+                "INSERT INTO users (username, active_quest) VALUES (?, ?) "
+                "ON CONFLICT (username) DO UPDATE SET active_quest = excluded.active_quest",
+                [(username, json.dumps(ref.to_dict())) for username, ref in assignments.items()],
+            )
+
+    def all_users(self) -> List[User]:
+        with self._lock:
+            rows = self._conn.execute("SELECT username, active_quest, score FROM users ORDER BY rowid").fetchall()
+        return [self._row_to_user(row) for row in rows]
+
+    def top_users(self, limit: Optional[int] = None) -> List[User]:
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT username, active_quest, score FROM users ORDER BY score DESC, rowid LIMIT ?",
+                (-1 if limit is None else limit,),
+            ).fetchall()
+        return [self._row_to_user(row) for row in rows]
+
+    def user_scores(self) -> List[Tuple[str, int]]:
+        with self._lock:
+            return self._conn.execute("SELECT username, score FROM users ORDER BY rowid").fetchall()
+
+    def _players_by_quest(self, quest_ids: List[str]) -> Dict[str, List[str]]:
+        players: Dict[str, List[str]] = {quest_id: [] for quest_id in quest_ids}
+        if not quest_ids:
+            return players
+        placeholders = ", ".join("?" * len(quest_ids))
+        rows = self._conn.execute(
+            f"SELECT quest_id, player FROM team_quest_players WHERE quest_id IN ({placeholders}) "
+            "ORDER BY quest_id, position",
+            quest_ids,
+        ).fetchall()
+        for quest_id, player in rows:
+            players[quest_id].append(player)
+        return players
+
+    def _team_quests_where(self, where: str = "", params: tuple = ()) -> List[TeamQuest]:
+        rows = self._conn.execute(
+            "SELECT quest_id, difficulty, title, description, status, created_at, expires_at, channel_id, "
+            f"catalog_id FROM team_quests {where} ORDER BY rowid",
+            params,
+        ).fetchall()
+        players = self._players_by_quest([row[0] for row in rows])
+        return [
+            TeamQuest(Quest(difficulty, title, description, catalog_id), players[quest_id], quest_id,
+                      QuestStatus(status), created_at, expires_at, channel_id)
+            for quest_id, difficulty, title, description, status, created_at, expires_at, channel_id, catalog_id
+            in rows
+        ]
+
+    def get_team_quest(self, quest_id: str) -> Optional[TeamQuest]:
+        with self._lock:
+            quests = self._team_quests_where("WHERE quest_id = ?", (quest_id,))
+        return quests[0] if quests else None
+
+    def _insert_team_quest(self, team_quest: TeamQuest) -> None:
+        data = team_quest.to_dict()
+        self._conn.execute(
+            "INSERT INTO team_quests (quest_id, difficulty, title, description, status, created_at, expires_at, "
+            "channel_id, catalog_id) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+            (data["quest_id"], data["quest"]["difficulty"], data["quest"]["title"], data["quest"]["description"],
+             data["status"], data["created_at"], data["expires_at"], data["channel_id"], data["quest"]["id"]),
+        )
+        self._conn.executemany(
+            "INSERT INTO team_quest_players (quest_id, position, player) VALUES (?, ?, ?)",
+            [(data["quest_id"], position, player) for position, player in enumerate(data["players"])],
+        )
+
+    def add_team_quest(self, team_quest: TeamQuest) -> None:
+        with self._lock, self._conn:
+            self._conn.execute("BEGIN")
+            self._insert_team_quest(team_quest)
+
+    def add_team_quests(self, team_quests: List[TeamQuest]) -> None:
+        with self._lock, self._conn:
+            self._conn.execute("BEGIN")
+            for team_quest in team_quests:
+                self._insert_team_quest(team_quest)
+
+    def _remove_team_quest(self, quest_id: str, status: QuestStatus) -> Optional[TeamQuest]:
+        quests = self._team_quests_where("WHERE quest_id = ?", (quest_id,))
+        if not quests:
+            return None
+        team_quest = quests[0]
+        team_quest.status = status
+        entry = team_quest.to_history(time.time())
+        self._conn.execute("DELETE FROM team_quests WHERE quest_id = ?", (quest_id,))
+        self._conn.execute(
+            "INSERT INTO team_quest_history (quest_id, quest, difficulty, players, status, created_at, ended_at) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?)",
+            (entry["quest_id"], entry["quest"], entry["difficulty"], json.dumps(entry["players"]),
+             entry["status"], entry["created_at"], entry["ended_at"]),
+        )
+        return team_quest
+
+    def remove_team_quest(self, quest_id: str, status: QuestStatus = QuestStatus.COMPLETED) -> Optional[TeamQuest]:
+        with self._lock, self._conn:
+            self._conn.execute("BEGIN")
+            return self._remove_team_quest(quest_id, status)
+
+    def complete_team_quest(self, quest_id: str, points: int, day: int) -> Optional[Tuple[TeamQuest, Dict[str, int]]]:
+        with self._lock, self._conn:
+            self._conn.execute("BEGIN")
+            team_quest = self._remove_team_quest(quest_id, QuestStatus.COMPLETED)
+            if team_quest is None:
+                return None
+            deltas = {player: points for player in team_quest.players}
+            totals = self._add_scores(deltas)
+            self._add_day_scores(day, deltas)
+            self._record_stat_event(StatEvent.TEAM_COMPLETED, team_quest.players, team_quest.quest.ref(), day)
+            return team_quest, totals
+
+    def set_team_quest_expiry(self, quest_id: str, expires_at: Optional[float]) -> None:
+        with self._lock:
+            self._conn.execute("UPDATE team_quests SET expires_at = ? WHERE quest_id = ?", (expires_at, quest_id))
+
+    def team_quest_history(self, limit: Optional[int] = None) -> List[Dict[str, Any]]:
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT quest_id, quest, difficulty, players, status, created_at, ended_at FROM team_quest_history "
+                "ORDER BY rowid DESC LIMIT ?",
+                (-1 if limit is None else limit,),
+            ).fetchall()
+        return [
+            {"quest_id": quest_id, "quest": quest, "difficulty": difficulty, "players": json.loads(players),
+             "status": status, "created_at": created_at, "ended_at": ended_at}
+            for quest_id, quest, difficulty, players, status, created_at, ended_at in reversed(rows)
+        ]
+
+    def all_team_quests(self) -> List[TeamQuest]:
+        with self._lock:
+            return self._team_quests_where()
+
+    def team_quests_for_player(self, player: str) -> List[TeamQuest]:
+        with self._lock:
+            return self._team_quests_where(
+                "WHERE quest_id IN (SELECT quest_id FROM team_quest_players WHERE player = ?)", (player,)
+            )
+
+    def draw_from_bag(self, owner: str, difficulty: int, version: int, size: int) -> int:
+        with self._lock, self._conn:
+            self._conn.execute("BEGIN")
+            row = self._conn.execute(
+                "SELECT version, size, seed, drawn, last FROM shuffle_bags WHERE owner = ? AND difficulty = ?",
+                (owner, difficulty),
+            ).fetchone()
+            if row is None or row[0] != version or row[1] != size or row[3] >= size:
+                seed, drawn = bag_seed(size, row[4] if row is not None and row[0] == version else -1), 0
+            else:
+                seed, drawn = row[2], row[3]
+            last = bag_order(seed, size)[drawn]
+            self._conn.execute(
+                "INSERT INTO shuffle_bags (owner, difficulty, version, size, seed, drawn, last) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?) "
+                "ON CONFLICT (owner, difficulty) DO UPDATE SET version = excluded.version, size = excluded.size, "
+                "seed = excluded.seed, drawn = excluded.drawn, last = excluded.last",
+                (owner, difficulty, version, size, seed, drawn + 1, last),
+            )
+            return last
+
+    def _add_day_scores(self, day: int, deltas: Dict[str, int]) -> None:
+        self._conn.executemany(
+            "INSERT INTO score_days (day, username, points) VALUES (?, ?, ?) "
+            "ON CONFLICT (day, username) DO UPDATE SET points = points + excluded.points",
+            [(day, username, delta) for username, delta in deltas.items()],
+        )
+
+    def add_day_scores(self, day: int, deltas: Dict[str, int]) -> None:
+        with self._lock, self._conn:
+            self._conn.execute("BEGIN")
+            self._add_day_scores(day, deltas)
+
+    def day_scores(self, first_day: int) -> Dict[int, Dict[str, int]]:
+        days: Dict[int, Dict[str, int]] = {}
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT day, username, points FROM score_days WHERE day >= ? ORDER BY day, rowid", (first_day,)
+            ).fetchall()
+        for day, username, points in rows:
+            days.setdefault(day, {})[username] = points
+        return days
+
+    def evict_day_scores(self, before: int) -> None:
+        with self._lock:
+            self._conn.execute("DELETE FROM score_days WHERE day < ?", (before,))
+
+    def _load_stats(self, table_key: str, query: str) -> Optional[UserStats]:
+        row = self._conn.execute(query, (table_key,)).fetchone()
+        return UserStats.from_list(json.loads(row[0])) if row else None
+
+    def _record_stat_event(self, event: StatEvent, usernames: List[str], quest: QuestRef, day: int) -> None:
+        for username in usernames:
+            stats = self._load_stats(username, "SELECT counters FROM user_stats WHERE username = ?") or UserStats()
+            stats.record(event, quest.difficulty, day)
+            self._conn.execute(
+                "INSERT OR REPLACE INTO user_stats (username, counters) VALUES (?, ?)",
+                (username, json.dumps(stats.to_list())),
+            )
+        server = self._load_stats("server_stats", "SELECT value FROM meta WHERE key = ?") or UserStats()
+        server.record(event, quest.difficulty, day)
+        self._conn.execute(
+            "INSERT OR REPLACE INTO meta (key, value) VALUES ('server_stats', ?)", (json.dumps(server.to_list()),)
+        )
+        quest_stats = QuestStats()
+        quest_stats.record(event)
+        self._conn.execute(
+            "INSERT INTO quest_stats (quest_id, completed, abandoned, failed) VALUES (?, ?, ?, ?) "
+            "ON CONFLICT (quest_id) DO UPDATE SET completed = completed + excluded.completed, "
+            "abandoned = abandoned + excluded.abandoned, failed = failed + excluded.failed",
+            (quest.quest_id, *quest_stats.to_list()),
+        )
+
+    def record_stat_event(self, event: StatEvent, usernames: List[str], quest: QuestRef, day: int) -> None:
+        with self._lock, self._conn:
+            self._conn.execute("BEGIN")
+            self._record_stat_event(event, usernames, quest, day)
+
+    def user_stats(self, username: str) -> Optional[UserStats]:
+        with self._lock:
+            return self._load_stats(username, "SELECT counters FROM user_stats WHERE username = ?")
+
+    def server_stats(self) -> Tuple[UserStats, Dict[str, QuestStats]]:
+        with self._lock:
+            server = self._load_stats("server_stats", "SELECT value FROM meta WHERE key = ?") or UserStats()
+            rows = self._conn.execute("SELECT quest_id, completed, abandoned, failed FROM quest_stats").fetchall()
+        return server, {quest_id: QuestStats(*counters) for quest_id, *counters in rows}
+
+    def stats_backfilled(self) -> bool:
+        with self._lock:
+            return self._conn.execute("SELECT 1 FROM meta WHERE key = 'stats_backfilled'").fetchone() is not None
+
+    def mark_stats_backfilled(self) -> None:
+        with self._lock:
+            self._conn.execute("INSERT OR REPLACE INTO meta (key, value) VALUES ('stats_backfilled', '1')")
+
+    def migrate_from_json(self, source: StorageBackend) -> bool:
+        """
+        Copy users, active team quests and the team-quest history from ``source``
+        the first time the database is opened.
+
+        Returns True if data was imported, False if the migration already ran.
+        """
+        with self._lock, self._conn:
+            self._conn.execute("BEGIN")
+            if self._conn.execute("SELECT 1 FROM meta WHERE key = 'json_migrated'").fetchone():
+                return False
+
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO users (username, active_quest, score) VALUES (?, ?, ?)",
+                [
+                    (u.username, json.dumps(u.active_quest.to_dict()) if u.active_quest else None, u.score)
+                    for u in source.all_users()
+                ],
+            )
+            for team_quest in source.all_team_quests():
+                self._conn.execute("DELETE FROM team_quests WHERE quest_id = ?", (team_quest.quest_id,))
+                self._insert_team_quest(team_quest)
+            self._conn.executemany(
+                "INSERT INTO team_quest_history (quest_id, quest, difficulty, players, status, created_at, ended_at) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                [
+                    (entry["quest_id"], entry["quest"], entry["difficulty"], json.dumps(entry["players"]),
+                     entry["status"], entry["created_at"], entry["ended_at"])
+                    for entry in source.team_quest_history()
+                ],
+            )
+            self._conn.execute("INSERT INTO meta (key, value) VALUES ('json_migrated', '1')")
+        return True
+
+    def flush(self) -> None:
+        with self._lock:
+            self._conn.execute("PRAGMA wal_checkpoint(PASSIVE)")
@@ -0,0 +1,410 @@
+"""
+State server: one process owns the quest, team-quest and score state, and
+any number of bot processes (shards, a hot standby) share it as clients.
+
+The server runs the ``QuestEngine`` commands on its storage thread pool and
+answers over a Unix socket. Bot processes set STATE_SERVER to the socket
+path and use ``RemoteEngine``, which has the same methods as the engine, so
+they keep no state of their own.
+
+Protocol: newline-delimited JSON in both directions.
+
+- A request is ``{"id": 7, "method": "quest", "args": ["diver1", 2, 1]}``.
+  Clients may pipeline: many requests can be in flight on one connection,
+  and each is answered by ``{"id": 7, "result": ...}`` or
+  ``{"id": 7, "error": "..."}``. Requests that arrive together run in
+  order on one worker and are answered in one write; separate arrivals run
+  concurrently, so their replies can come back out of order.
+- A batch is a JSON list of requests. Its calls run one after another, in
+  order, on a single worker, and the replies come back as one list.
+- ``subscribe`` (args: guild IDs) makes the server push
+  ``{"event": "team_quest_expired", "guild_id": ..., "team_quest": {...}}``
+  on that connection for every team quest that expires, in any guild. Bots
+  only post notices in channels they can see, so each shard announces its
+  own guilds' quests.
+- A line that is not JSON, or not an object (a batch element that is not
+  an object), is answered by ``{"id": null, "error": "..."}`` and the
+  connection stays open.
+
+Team quests and pages travel as ``{"team_quest": {...}}`` and
+``{"page": [text, number, count]}``; see ``encode`` and ``decode``.
+
+Usage: python state_server.py [--socket PATH]
+"""
+import argparse
+import asyncio
+import functools
+import itertools
+import json
+import logging
+import os
+import signal
+import socket
+import sys
+import threading
+from concurrent.futures import Future
+from typing import Any, Callable, Dict, Iterable, List, Optional, Sequence, Tuple
+from schema import TeamQuest
+from utils import Page
+
+
+STATE_SOCKET = os.getenv("STATE_SERVER", "activity/state.sock")
+# Longest request or batch line the server accepts, in bytes; longer ones close the connection.
+MAX_LINE = 16 * 1024 * 1024
+READ_CHUNK = 256 * 1024
+
+# Engine methods clients may call; everything else is refused.
+REMOTE_METHODS = (
+    "quest", "done", "abandon", "tquest", "team_quest_message", "team_quest_expired_message",
+    "event", "tdone", "tactive", "profile", "server_stats", "leaderboard", "flush",
+)
+
+# Reply to a request, or batch element, that is valid JSON but not an object.
+NOT_AN_OBJECT = {"id": None, "error": "ValueError: request is not a JSON object"}
+
+log = logging.getLogger(__name__)
+
+ExpiryListener = Callable[[Optional[int], TeamQuest], None]
+
+
+def encode(value: Any) -> Any:
+    """Turn an engine argument or result into JSON-compatible data."""
+    if isinstance(value, TeamQuest):
+        return {"team_quest": value.to_dict()}
+    if isinstance(value, Page):
+        return {"page": list(value)}
+    if isinstance(value, (list, tuple)):
+        return [encode(item) for item in value]
+    return value
+
+
+def decode(value: Any) -> Any:
+    """Inverse of ``encode``; tuples come back as lists."""
+    if isinstance(value, dict):
+        if "team_quest" in value:
+            return TeamQuest.from_dict(value["team_quest"])
+        if "page" in value:
+            return Page(*value["page"])
+    if isinstance(value, list):
+        return [decode(item) for item in value]
+    return value
+
+
+def dumps(message: Any) -> bytes:
+    return json.dumps(message, separators=(",", ":")).encode() + b"\n"
+
+
+class StateServer:
+    """Serves one ``QuestEngine`` to every client connected to ``path``."""
+
+    def __init__(self, path: str = STATE_SOCKET):
+        from engine import engine
+        self.path = path
+        self.engine = engine
+        self._subscribers: List[asyncio.StreamWriter] = []
+        self._connections: Dict[asyncio.StreamWriter, asyncio.Task] = {}
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+
+    def _call(self, request: dict) -> dict:
+        """Run one request on a worker thread and build its reply."""
+        if not isinstance(request, dict):
+            return NOT_AN_OBJECT
+        reply = {"id": request.get("id")}
+        method = request.get("method")
+        try:
+            if method not in REMOTE_METHODS:
+                raise ValueError(f"unknown method {method!r}")
+            args = decode(request.get("args", []))
+            reply["result"] = encode(getattr(self.engine, method)(*args))
+        except Exception as error:
+            log.exception("State request %s failed", method)
+            reply["error"] = f"{type(error).__name__}: {error}"
+        return reply
+
+    def _open_guilds(self, guild_ids: Iterable[Optional[int]]) -> None:
+        """
+        Open the subscriber's guilds so that their leftover team quests get scheduled to expire.
+
+        One bot's guild list says nothing about the other bots', so the
+        server never adopts a legacy guild on its own; it only warns when
+        ``activity/`` has unowned players and LEGACY_GUILD_ID is unset.
+        """
+        from storage import adopt_legacy_guild, get_backend
+        adopt_legacy_guild(())
+        for guild_id in guild_ids:
+            get_backend(guild_id)
+
+    def _broadcast_expired(self, guild_id: Optional[int], team_quest: TeamQuest) -> None:
+        """Expiry listener; runs on the scheduler thread and hands the event to the event loop."""
+        line = dumps({"event": "team_quest_expired", "guild_id": guild_id, "team_quest": team_quest.to_dict()})
+        self._loop.call_soon_threadsafe(self._push, line)
+
+    def _push(self, line: bytes) -> None:
+        for writer in list(self._subscribers):
+            if writer.is_closing():
+                self._subscribers.remove(writer)
+            else:
+                writer.write(line)
+
+    async def _reply(self, writer: asyncio.StreamWriter, job: Callable[[], bytes]) -> None:
+        from services import run_blocking
+        data = await run_blocking(job)
+        if not writer.is_closing():
+            writer.write(data)
+            await writer.drain()
+
+    def _run_requests(self, requests: List[dict]) -> bytes:
+        return b"".join(dumps(self._call(request)) for request in requests)
+
+    def _run_batch(self, requests: List[dict]) -> bytes:
+        return dumps([self._call(request) for request in requests])
+
+    async def _handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        from services import run_blocking
+        self._connections[writer] = asyncio.current_task()
+        tasks = set()
+
+        def start(job: Callable[[], bytes]) -> None:
+            task = asyncio.ensure_future(self._reply(writer, job))
+            tasks.add(task)
+            task.add_done_callback(tasks.discard)
+
+        partial = b""
+        try:
+            while True:
+                chunk = await reader.read(READ_CHUNK)
+                if not chunk:
+                    break
+                *lines, partial = (partial + chunk).split(b"\n")
+                if len(partial) > MAX_LINE:
+                    break
+                requests = []
+                for line in lines:
+                    try:
+                        message = json.loads(line)
+                    except ValueError:
+                        writer.write(dumps({"id": None, "error": "ValueError: request is not valid JSON"}))
+                        continue
+                    if isinstance(message, list):
+                        start(functools.partial(self._run_batch, message))
+                    elif not isinstance(message, dict):
+                        writer.write(dumps(NOT_AN_OBJECT))
+                    elif message.get("method") == "subscribe":
+                        try:
+                            await run_blocking(self._open_guilds, message.get("args", []))
+                        except Exception as error:
+                            log.exception("Subscribing failed")
+                            writer.write(dumps({"id": message.get("id"), "error": f"{type(error).__name__}: {error}"}))
+                            continue
+                        if writer not in self._subscribers:
+                            self._subscribers.append(writer)
+                        writer.write(dumps({"id": message.get("id"), "result": None}))
+                    else:
+                        requests.append(message)
+                if requests:
+                    # Pipelined requests that arrived together share one worker hand-off and one write.
+                    start(functools.partial(self._run_requests, requests))
+        except ConnectionError:
+            pass
+        finally:
+            if tasks:
+                await asyncio.gather(*tasks, return_exceptions=True)
+            if writer in self._subscribers:
+                self._subscribers.remove(writer)
+            del self._connections[writer]
+            writer.close()
+
+    async def serve(self) -> None:
+        """Serve until SIGINT or SIGTERM, then write every guild's state to disk."""
+        from services import run_blocking
+        self._loop = asyncio.get_running_loop()
+        await run_blocking(self.engine.on_team_quest_expired, self._broadcast_expired)
+
+        if os.path.exists(self.path):
+            os.remove(self.path)  # left behind by a server that did not shut down cleanly
+        server = await asyncio.start_unix_server(self._handle, self.path)
+        os.chmod(self.path, 0o600)
+        stop = asyncio.Event()
+        for signum in (signal.SIGINT, signal.SIGTERM):
+            self._loop.add_signal_handler(signum, stop.set)
+        log.info("State server listening on %s", self.path)
+
+        await stop.wait()
+        server.close()
+        # Hang up on every client; each handler finishes the requests it already started.
+        handlers = list(self._connections.values())
+        for writer in list(self._connections):
+            writer.close()
+        await asyncio.gather(*handlers, return_exceptions=True)
+        await run_blocking(self.engine.flush)
+        os.remove(self.path)
+
+
+class RemoteEngine:
+    """
+    ``QuestEngine`` stand-in that forwards every command to a state server.
+
+    Thread-safe: the bot calls it from its storage worker threads, and all
+    of them share one pipelined connection. Requests queued while another
+    thread is writing are sent together in one write. ``submit`` returns a
+    future instead of waiting, and ``batch`` runs several calls in order in
+    one round trip. If the server goes away, pending calls fail with
+    ConnectionError and the next call reconnects (and re-subscribes to
+    expiry notices).
+    """
+
+    def __init__(self, path: str = STATE_SOCKET, timeout: Optional[float] = 30.0):
+        self.path = path
+        self.timeout = timeout
+        self._ids = itertools.count(1)
+        self._lock = threading.Lock()
+        self._writable = threading.Condition(self._lock)
+        self._outbox: List[bytes] = []
+        self._pending: Dict[int, Tuple[socket.socket, Future]] = {}
+        self._socket: Optional[socket.socket] = None
+        self._listeners: List[ExpiryListener] = []
+        self._guild_ids: List[Optional[int]] = []
+        self._writing = False
+
+    def _connect(self) -> socket.socket:
+        """Connect if needed; call with ``self._lock`` held."""
+        if self._socket is None:
+            sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            sock.connect(self.path)
+            self._socket = sock
+            threading.Thread(target=self._read, args=(sock,), name="state-client", daemon=True).start()
+            if self._listeners:
+                self._outbox.append(dumps({"id": None, "method": "subscribe", "args": self._guild_ids}))
+        return self._socket
+
+    def _send(self, line: bytes, ids: Sequence[int]) -> List[Future]:
+        futures = [Future() for _ in ids]
+        with self._lock:
+            sock = self._connect()
+            self._pending.update((request_id, (sock, future)) for request_id, future in zip(ids, futures))
+            self._outbox.append(line)
+            if self._writing:
+                return futures  # the thread that is writing sends it with its next write
+            self._writing = True
+            while self._outbox:
+                data, self._outbox = b"".join(self._outbox), []
+                self._lock.release()
+                try:
+                    sock.sendall(data)
+                except OSError:
+                    pass  # the reader thread sees the connection drop and fails the pending calls
+                finally:
+                    self._lock.acquire()
+            self._writing = False
+        return futures
+
+    def _read(self, sock: socket.socket) -> None:
+        with sock.makefile("rb") as stream:
+            try:
+                for line in stream:
+                    message = json.loads(line)
+                    if isinstance(message, dict) and "event" in message:
+                        self._notify(message)
+                        continue
+                    for reply in message if isinstance(message, list) else [message]:
+                        self._resolve(reply)
+            except (OSError, ValueError):
+                pass
+        with self._lock:
+            if self._socket is sock:
+                self._socket = None
+            lost = [request_id for request_id, (owner, _) in self._pending.items() if owner is sock]
+            pending = [self._pending.pop(request_id)[1] for request_id in lost]
+        sock.close()
+        for future in pending:
+            future.set_exception(ConnectionError(f"lost the connection to the state server at {self.path}"))
+
+    def _resolve(self, reply: dict) -> None:
+        with self._lock:
+            entry = self._pending.pop(reply.get("id"), None)
+        if entry is None:
+            return
+        future = entry[1]
+        if "error" in reply:
+            future.set_exception(RuntimeError(f"state server: {reply['error']}"))
+        else:
+            future.set_result(decode(reply.get("result")))
+
+    def _notify(self, message: dict) -> None:
+        team_quest = TeamQuest.from_dict(message["team_quest"])
+        for listener in self._listeners:
+            try:
+                listener(message["guild_id"], team_quest)
+            except Exception:
+                log.exception("Expiry listener failed for team quest %s", team_quest.quest_id)
+
+    def submit(self, method: str, *args: Any) -> Future:
+        """Send one call without waiting for it; the future holds its result."""
+        request_id = next(self._ids)
+        return self._send(dumps({"id": request_id, "method": method, "args": encode(args)}), [request_id])[0]
+
+    def call(self, method: str, *args: Any) -> Any:
+        """Run one engine method on the server and return its result."""
+        return self.submit(method, *args).result(self.timeout)
+
+    def batch(self, calls: Iterable[Tuple[str, Sequence[Any]]]) -> List[Any]:
+        """
+        Run ``(method, args)`` calls in order in one round trip and return
+        their results; a failed call's result is its exception.
+        """
+        requests = [{"id": next(self._ids), "method": method, "args": encode(args)} for method, args in calls]
+        futures = self._send(dumps(requests), [request["id"] for request in requests])
+        results = []
+        for future in futures:
+            try:
+                results.append(future.result(self.timeout))
+            except RuntimeError as error:
+                results.append(error)
+        return results
+
+    def on_team_quest_expired(self, listener: ExpiryListener, guild_ids: Iterable[Optional[int]] = ()) -> None:
+        """
+        Call ``listener(guild_id, team_quest)`` for every team quest the server
+        expires, from this client's reader thread; ``guild_ids`` are opened on
+        the server so that their leftover quests are scheduled.
+        """
+        self._listeners.append(listener)
+        self._guild_ids = sorted(set(self._guild_ids) | set(guild_ids), key=lambda g: (g is None, g))
+        request_id = next(self._ids)
+        self._send(dumps({"id": request_id, "method": "subscribe", "args": self._guild_ids}),
+                   [request_id])[0].result(self.timeout)
+
+    def close(self) -> None:
+        with self._lock:
+            sock, self._socket = self._socket, None
+        if sock is not None:
+            try:
+                sock.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass  # already disconnected
+
+
+def _remote_method(name: str) -> Callable[..., Any]:
+    def method(self: RemoteEngine, *args: Any) -> Any:
+        return self.call(name, *args)
+    method.__name__ = name
+    method.__doc__ = f"``QuestEngine.{name}``, run on the state server."
+    return method
+
+
+for _name in REMOTE_METHODS:
+    setattr(RemoteEngine, _name, _remote_method(_name))
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="Serve the quest and score state to bot processes.")
+    parser.add_argument("--socket", default=STATE_SOCKET, help=f"Unix socket path (default: {STATE_SOCKET})")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(name)s: %(message)s")
+    asyncio.run(StateServer(args.socket).serve())
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,17 +1,58 @@
-from typing import List
-from quest_generator import load_user_list
-from schema import User
+import functools
+from typing import List, Optional
+from leaderboard import current_day, get_rank_index, get_window_scores, season_number
+from quest_catalog import quest_catalog, team_quest_catalog
+from read_cache import cached_read
+from schema import UserStats
+from storage import get_backend
+from utils import Page, banner, get_user, page_count, render_page
 
 
-def get_user_stats(username: str) -> str:
+LEADERBOARD_PAGE_SIZE = 10
+PROFILE_NEIGHBOURS = 2
+
+
+def format_rank_line(rank: int, username: str, score: int) -> str:
+    """Format one leaderboard row, with medals for the podium."""
+    medal = "🥇" if rank == 1 else "🥈" if rank == 2 else "🥉" if rank == 3 else f"#{rank}"
+    return f"{medal} {username}: {score} points\n"
+
+
+def format_counters(stats: UserStats) -> str:
+    """The completion, difficulty, abandon and streak lines shared by !profile and !serverstats."""
+    solo, team = sum(stats.solo_completed), sum(stats.team_completed)
+    by_difficulty = " · ".join(
+        f"{'⭐' * difficulty} {solo_count + team_count}"
+        for difficulty, (solo_count, team_count) in enumerate(zip(stats.solo_completed, stats.team_completed), 1)
+    )
+    streak = stats.current_streak(current_day())
+    started = solo + stats.abandoned
+    abandon_rate = f" ({stats.abandoned * 100 // started}% of solo quests)" if started else ""
+    return f"""**Quests Completed:** {solo + team} (solo {solo} · team {team})
+**By Difficulty:** {by_difficulty}
+**Abandoned:** {stats.abandoned}{abandon_rate}
+**Team Quests Failed:** {stats.team_failed}
+**Streak:** {streak} day{"" if streak == 1 else "s"} (best {stats.best_streak})
+"""
+
+
+def catalog_title(quest_id: str) -> str:
+    """Title of a solo or team quest, falling back to its ID if it left the catalogs."""
+    quest = quest_catalog.get(quest_id) or team_quest_catalog.get(quest_id)
+    return quest.title if quest else quest_id
+
+
+@cached_read
+def get_user_stats(username: str, guild_id: Optional[int] = None) -> str:
     """Display score statistics for a specific user."""
-    data = load_user_list()
-    user_data = next((u for u in data["users"] if u["username"] == username), None)
+    user = get_user(username, guild_id)
     
-    if not user_data:
+    if not user:
         return f"No stats found for {username}."
     
-    user = User.from_dict(user_data)
+    rank_index = get_rank_index(guild_id)
+    rank = rank_index.rank(username)
+    nearby = "".join(format_rank_line(*entry) for entry in rank_index.around(username, PROFILE_NEIGHBOURS))
     
     stats_text = f"""
 ════════════════════════════════════════
@@ -20,33 +61,78 @@ def get_user_stats(username: str) -> str:
 
 **helldiver:** {user.username}
 **Total Score:** {user.score}
-
+**Rank:** #{rank} of {len(rank_index)}
+{format_counters(get_backend(guild_id).user_stats(username) or UserStats())}
+**Nearby:**
+{nearby}
 Keep fighting, helldiver!
 """
     return stats_text
 
 
-def get_leaderboard() -> str:
-    """Display a leaderboard of users ranked by score."""
-    data = load_user_list()
-    users = [User.from_dict(u) for u in data["users"]]
+@cached_read
+def get_server_stats(guild_id: Optional[int] = None) -> str:
+    """Display a guild's quest counters and its most completed, abandoned and failed quests."""
+    server, quests = get_backend(guild_id).server_stats()
     
-    if not users:
-        return "No users found on the leaderboard yet."
+    if not quests:
+        return "No quests have been finished on this server yet."
     
-    sorted_users = sorted(users, key=lambda u: u.score, reverse=True)
+    def most(field: str) -> str:
+        quest_id, stats = max(quests.items(), key=lambda entry: getattr(entry[1], field))
+        count = getattr(stats, field)
+        return f"{catalog_title(quest_id)} ({count}x)" if count else "none yet"
     
-    leaderboard_text = """
+    return f"""
 ════════════════════════════════════════
-            GLOBAL LEADERBOARD
+              SERVER STATS
 ════════════════════════════════════════
 
-"""
-    
-    for rank, user in enumerate(sorted_users, 1):
-        medal = "🥇" if rank == 1 else "🥈" if rank == 2 else "🥉" if rank == 3 else f"#{rank}"
-        leaderboard_text += f"{medal} {user.username}: {user.score} points\n"
+{format_counters(server)}
+**Most Completed:** {most("completed")}
+**Most Abandoned:** {most("abandoned")}
+**Most Failed Team Quest:** {most("failed")}
+════════════════════════════════════════"""
+
+
+def window_title(window: Optional[str]) -> str:
+    """Heading for the lifetime leaderboard (``window`` None) or a windowed one."""
+    if window == "week":
+        return "WEEKLY LEADERBOARD"
+    if window == "month":
+        return "MONTHLY LEADERBOARD"
+    if window == "season":
+        return f"SEASON {season_number(current_day())} LEADERBOARD"
+    return "SERVER LEADERBOARD"
+
+
+@cached_read
+def get_leaderboard(guild_id: Optional[int] = None, window: Optional[str] = None, page: int = 1) -> Page:
+    """
+    Display one page of a guild's leaderboard, ranked by lifetime score,
+    or by points earned in ``window`` ("week", "month" or "season").
+    Only the rows on that page are fetched and formatted.
+    """
+    if window is None:
+        rank_index = get_rank_index(guild_id)
+        total = len(rank_index)
+        scope = "helldivers"
+        fetch = rank_index.top
+    else:
+        window_scores = get_window_scores(guild_id)
+        total = window_scores.active(window)
+        scope = f"helldivers who scored this {window}"
+        fetch = functools.partial(window_scores.top, window)
     
-    leaderboard_text += "\n════════════════════════════════════════"
+    if not total:
+        if window is not None:
+            return Page(f"Nobody has scored this {window} yet.", 1, 1)
+        return Page("No users found on the leaderboard yet.", 1, 1)
     
-    return leaderboard_text
+    count = page_count(total, LEADERBOARD_PAGE_SIZE)
+    page = min(max(page, 1), count)
+    start = (page - 1) * LEADERBOARD_PAGE_SIZE
+    entries = fetch(LEADERBOARD_PAGE_SIZE, start)
+    rows = (format_rank_line(rank, username, score) for rank, username, score in entries)
+    summary = f"Showing #{start + 1}-{start + len(entries)} of {total} {scope}."
+    return render_page(rows, page, count, banner(window_title(window)), summary, LEADERBOARD_PAGE_SIZE)
@@ -0,0 +1,558 @@
+import atexit
+import functools
+import itertools
+import json
+import logging
+import os
+import threading
+import time
+from typing import Any, Callable, Dict, Iterable, List, Optional, Tuple
+from schema import QuestRef, QuestStats, QuestStatus, StatEvent, TeamQuest, User, UserStats
+from journal import write_atomic
+from store import (
+    ACTIVE_TEAM_QUEST_PATH, QUEST_BAGS_PATH, SCORE_DAYS_PATH, STATS_PATH, TEAM_QUEST_HISTORY_PATH, USER_LIST_PATH,
+    BagStore, HistoryLog, ScoreDayStore, StatsStore, TeamQuestStore, UserStore,
+)
+
+
+_versions = itertools.count(1)
+
+log = logging.getLogger(__name__)
+
+
+def _bumps_version(method):
+    """Wrap a write method so the backend's version changes once it returns."""
+    @functools.wraps(method)
+    def wrapper(self, *args, **kwargs):
+        try:
+            return method(self, *args, **kwargs)
+        finally:
+            self.bump_version()
+    return wrapper
+
+
+class StorageBackend:
+    """
+    Interface between the quest, team-quest and stats modules and persistent state.
+
+    Users are exchanged as ``schema.User`` objects and active team quests as
+    ``schema.TeamQuest`` objects.
+
+    ``version`` changes after every call to one of ``WRITE_METHODS``, in any
+    subclass, so readers can tell whether state moved since they last looked.
+    """
+
+    WRITE_METHODS = (
+        "save_user", "add_scores", "assign_quests", "add_team_quest", "add_team_quests", "remove_team_quest",
+        "complete_team_quest", "set_team_quest_expiry", "draw_from_bag", "add_day_scores", "evict_day_scores",
+        "record_stat_event", "mark_stats_backfilled",
+    )
+    version = 0
+
+    def __init_subclass__(cls, **kwargs):
+        super().__init_subclass__(**kwargs)
+        for name in cls.WRITE_METHODS:
+            if name in cls.__dict__:
+                setattr(cls, name, _bumps_version(cls.__dict__[name]))
+
+    def bump_version(self) -> None:
+        """Mark state as changed; also called by code that updates indexes derived from it."""
+        self.version = next(_versions)
+
+    def get_user(self, username: str) -> Optional[User]:
+        """Get User object by username, returns None if not found."""
+        raise NotImplementedError
+
+    def save_user(self, user: User) -> None:
+        """Insert or update a single user."""
+        raise NotImplementedError
+
+    def add_scores(self, deltas: Dict[str, int], clear_quests: Iterable[str] = ()) -> Dict[str, int]:
+        """
+        Add score deltas for several users in one all-or-nothing write.
+
+        Missing users are created. Users listed in ``clear_quests`` have their
+        active quest cleared in the same write. Returns each user's new score.
+        """
+        raise NotImplementedError
+
+    def assign_quests(self, assignments: Dict[str, QuestRef]) -> None:
+        """Set several users' active quests in one all-or-nothing write, creating missing users."""
+        raise NotImplementedError
+
+    def all_users(self) -> List[User]:
+        """Return every user in insertion order."""
+        raise NotImplementedError
+
+    def top_users(self, limit: Optional[int] = None) -> List[User]:
+        """Return users ordered by score, highest first; ties keep insertion order."""
+        raise NotImplementedError
+
+    def user_scores(self) -> List[Tuple[str, int]]:
+        """Return (username, score) for every user in insertion order."""
+        raise NotImplementedError
+
+    def get_team_quest(self, quest_id: str) -> Optional[TeamQuest]:
+        """Get an active team quest by ID, returns None if not found."""
+        raise NotImplementedError
+
+    def add_team_quest(self, team_quest: TeamQuest) -> None:
+        """Store a new active team quest."""
+        raise NotImplementedError
+
+    def add_team_quests(self, team_quests: List[TeamQuest]) -> None:
+        """Store several new active team quests in one all-or-nothing write."""
+        raise NotImplementedError
+
+    def remove_team_quest(self, quest_id: str, status: QuestStatus = QuestStatus.COMPLETED) -> Optional[TeamQuest]:
+        """
+        End an active team quest with ``status`` and move it to the history.
+
+        Returns the quest, carrying the new status, if it existed.
+        """
+        raise NotImplementedError
+
+    def complete_team_quest(self, quest_id: str, points: int, day: int) -> Optional[Tuple[TeamQuest, Dict[str, int]]]:
+        """
+        End an active team quest as completed and pay its squad, all as one write.
+
+        The quest moves to the history, every player gains ``points`` in
+        their score and in ``day``'s scores, and a ``TEAM_COMPLETED`` stat
+        event is counted; a crash leaves either all of it or none. Returns
+        the finished quest and the players' new totals, or None if the quest
+        is not active.
+        """
+        raise NotImplementedError
+
+    def set_team_quest_expiry(self, quest_id: str, expires_at: Optional[float]) -> None:
+        """Set an active team quest's deadline (a Unix timestamp, or None for none)."""
+        raise NotImplementedError
+
+    def team_quest_history(self, limit: Optional[int] = None) -> List[Dict[str, Any]]:
+        """Return finished team quests as ``TeamQuest.to_history`` entries, oldest first; the last ``limit`` if given."""
+        raise NotImplementedError
+
+    def all_team_quests(self) -> List[TeamQuest]:
+        """Return every active team quest, oldest first."""
+        raise NotImplementedError
+
+    def team_quests_for_player(self, player: str) -> List[TeamQuest]:
+        """Return the active team quests a player is part of, oldest first."""
+        raise NotImplementedError
+
+    def draw_from_bag(self, owner: str, difficulty: int, version: int, size: int) -> int:
+        """
+        Draw the next quest index from an owner's shuffle bag for one catalog bucket.
+
+        ``version`` identifies the bucket's contents and ``size`` is its
+        length; a bag filled from another version is rebuilt. No index repeats
+        until all ``size`` have been drawn.
+        """
+        raise NotImplementedError
+
+    def add_day_scores(self, day: int, deltas: Dict[str, int]) -> None:
+        """Add points earned on ``day`` (days since the Unix epoch, UTC) to that day's per-user totals."""
+        raise NotImplementedError
+
+    def day_scores(self, first_day: int) -> Dict[int, Dict[str, int]]:
+        """Return per-user points for every recorded day from ``first_day`` on."""
+        raise NotImplementedError
+
+    def evict_day_scores(self, before: int) -> None:
+        """Forget the per-user points of every day before ``before``."""
+        raise NotImplementedError
+
+    def record_stat_event(self, event: StatEvent, usernames: List[str], quest: QuestRef, day: int) -> None:
+        """Count a quest ending on ``day`` for each player, for the quest and for the server, in one write."""
+        raise NotImplementedError
+
+    def user_stats(self, username: str) -> Optional[UserStats]:
+        """Return a player's counters, or None if nothing was counted for them yet."""
+        raise NotImplementedError
+
+    def server_stats(self) -> Tuple[UserStats, Dict[str, QuestStats]]:
+        """Return the server-wide counters and the counters of every quest, keyed by quest ID."""
+        raise NotImplementedError
+
+    def stats_backfilled(self) -> bool:
+        """Check whether the counters have been seeded from the data kept before they existed."""
+        raise NotImplementedError
+
+    def mark_stats_backfilled(self) -> None:
+        """Record that the counters have been seeded."""
+        raise NotImplementedError
+
+    def flush(self) -> None:
+        """Persist anything still held in memory."""
+
+
+class JsonBackend(StorageBackend):
+    """
+    The original ``activity/*.json`` layout, served from the journaled in-memory stores.
+
+    Each store keeps its own journal. ``complete_team_quest`` touches four
+    of them, so its ``tq_complete`` record carries the whole payout and the
+    sequence number each other store's record will get. If a crash cuts
+    the payout short, replaying that record on the next start writes
+    whichever parts are missing (see ``_finish_payouts``).
+    """
+
+    def __init__(self, user_path: str = USER_LIST_PATH, team_quest_path: str = ACTIVE_TEAM_QUEST_PATH):
+        self.users = UserStore(user_path)
+        self.team_quests = TeamQuestStore(team_quest_path)
+        directory = os.path.dirname(user_path)
+        self.bags = BagStore(os.path.join(directory, os.path.basename(QUEST_BAGS_PATH)))
+        self.history = HistoryLog(os.path.join(directory, os.path.basename(TEAM_QUEST_HISTORY_PATH)))
+        self.score_days = ScoreDayStore(os.path.join(directory, os.path.basename(SCORE_DAYS_PATH)))
+        self.stats = StatsStore(os.path.join(directory, os.path.basename(STATS_PATH)))
+        self._watch_payouts()
+
+    def _watch_payouts(self) -> None:
+        self.team_quests.on_recovered = self._finish_payouts
+        if self.team_quests.journal.exists():
+            # Finish interrupted payouts before anything reads the scores they change.
+            self.team_quests.all_quests()
+
+    def get_user(self, username: str) -> Optional[User]:
+        return self.users.get(username)
+
+    def save_user(self, user: User) -> None:
+        self.users.save(user)
+
+    def add_scores(self, deltas: Dict[str, int], clear_quests: Iterable[str] = ()) -> Dict[str, int]:
+        return self.users.add_scores(deltas, clear_quests)
+
+    def assign_quests(self, assignments: Dict[str, QuestRef]) -> None:
+        self.users.assign_quests(assignments)
+
+    def all_users(self) -> List[User]:
+        return self.users.all_users()
+
+    def top_users(self, limit: Optional[int] = None) -> List[User]:
+        return self.users.top_users(limit)
+
+    def user_scores(self) -> List[Tuple[str, int]]:
+        return self.users.scores()
+
+    def get_team_quest(self, quest_id: str) -> Optional[TeamQuest]:
+        return self.team_quests.get(quest_id)
+
+    def add_team_quest(self, team_quest: TeamQuest) -> None:
+        self.team_quests.add(team_quest)
+
+    def add_team_quests(self, team_quests: List[TeamQuest]) -> None:
+        self.team_quests.add_many(team_quests)
+
+    def remove_team_quest(self, quest_id: str, status: QuestStatus = QuestStatus.COMPLETED) -> Optional[TeamQuest]:
+        team_quest = self.team_quests.complete(quest_id)
+        if team_quest is None:
+            return None
+        finished = TeamQuest(team_quest.quest, team_quest.players, team_quest.quest_id, status,
+                             team_quest.created_at, team_quest.expires_at, team_quest.channel_id)
+        self.history.append(finished.to_history(time.time()))
+        return finished
+
+    def complete_team_quest(self, quest_id: str, points: int, day: int) -> Optional[Tuple[TeamQuest, Dict[str, int]]]:
+        with self.team_quests.lock, self.users.lock, self.score_days.lock, self.stats.lock:
+            team_quest = self.team_quests.get(quest_id)
+            if team_quest is None:
+                return None
+            finished = TeamQuest(team_quest.quest, team_quest.players, team_quest.quest_id, QuestStatus.COMPLETED,
+                                 team_quest.created_at, team_quest.expires_at, team_quest.channel_id)
+            payout = {
+                "history": finished.to_history(time.time()),
+                "scores": {player: points for player in team_quest.players},
+                "day": day,
+                "users_seq": self.users.next_seq(),
+                "score_days_seq": self.score_days.next_seq(),
+                "stats_seq": self.stats.next_seq(),
+            }
+            self.team_quests.complete(quest_id, payout)
+            return finished, self._pay(payout)
+
+    def _pay(self, payout: Dict[str, Any], recovering: bool = False) -> Dict[str, int]:
+        """Write the parts of a ``complete_team_quest`` payout not yet written, and return the new totals."""
+        entry = payout["history"]
+        if not recovering or all(logged["quest_id"] != entry["quest_id"] for logged in self.history.read()):
+            self.history.append(entry)
+        totals = None
+        if not self.users.applied(payout["users_seq"]):
+            totals = self.users.add_scores(payout["scores"])
+        if not self.score_days.applied(payout["score_days_seq"]):
+            self.score_days.add(payout["day"], payout["scores"])
+        if not self.stats.applied(payout["stats_seq"]):
+            self.stats.record(StatEvent.TEAM_COMPLETED, entry["players"],
+                              QuestRef(entry["quest"], entry["difficulty"]), payout["day"])
+        if totals is None:
+            totals = {username: self.users.get(username).score for username in payout["scores"]}
+        return totals
+
+    def _finish_payouts(self, payouts: List[Dict[str, Any]]) -> None:
+        with self.users.lock, self.score_days.lock, self.stats.lock:
+            for payout in payouts:
+                self._pay(payout, recovering=True)
+
+    def set_team_quest_expiry(self, quest_id: str, expires_at: Optional[float]) -> None:
+        self.team_quests.set_expiry(quest_id, expires_at)
+
+    def team_quest_history(self, limit: Optional[int] = None) -> List[Dict[str, Any]]:
+        return self.history.read(limit)
+
+    def all_team_quests(self) -> List[TeamQuest]:
+        return self.team_quests.all_quests()
+
+    def team_quests_for_player(self, player: str) -> List[TeamQuest]:
+        return self.team_quests.for_player(player)
+
+    def draw_from_bag(self, owner: str, difficulty: int, version: int, size: int) -> int:
+        return self.bags.draw(owner, difficulty, version, size)
+
+    def add_day_scores(self, day: int, deltas: Dict[str, int]) -> None:
+        self.score_days.add(day, deltas)
+
+    def day_scores(self, first_day: int) -> Dict[int, Dict[str, int]]:
+        return self.score_days.since(first_day)
+
+    def evict_day_scores(self, before: int) -> None:
+        self.score_days.evict(before)
+
+    def record_stat_event(self, event: StatEvent, usernames: List[str], quest: QuestRef, day: int) -> None:
+        self.stats.record(event, usernames, quest, day)
+
+    def user_stats(self, username: str) -> Optional[UserStats]:
+        return self.stats.user(username)
+
+    def server_stats(self) -> Tuple[UserStats, Dict[str, QuestStats]]:
+        return self.stats.server()
+
+    def stats_backfilled(self) -> bool:
+        return self.stats.backfilled()
+
+    def mark_stats_backfilled(self) -> None:
+        self.stats.mark_backfilled()
+
+    def flush(self) -> None:
+        self.users.flush()
+        self.team_quests.flush()
+        self.bags.flush()
+        self.score_days.flush()
+        self.stats.flush()
+
+
+ACTIVITY_DIR = "activity"
+GUILDS_DIR = os.path.join(ACTIVITY_DIR, "guilds")
+
+# Records which guild adopted the pre-partitioning state in activity/, see adopt_legacy_guild.
+LEGACY_GUILD_FILE = os.path.join(GUILDS_DIR, "legacy_guild.json")
+
+_backends: Dict[Optional[int], StorageBackend] = {}
+_backends_lock = threading.Lock()
+_open_listeners: List[Callable[[Optional[int], StorageBackend], None]] = []
+_opening: Dict[Optional[int], "_Opening"] = {}
+_legacy_guild: Optional[str] = None
+
+
+def legacy_guild_id() -> Optional[str]:
+    """The guild that owns ``activity/`` itself: LEGACY_GUILD_ID, else the one recorded by adopt_legacy_guild."""
+    global _legacy_guild
+    configured = os.getenv("LEGACY_GUILD_ID")
+    if configured:
+        return configured
+    if _legacy_guild is None:
+        try:
+            with open(LEGACY_GUILD_FILE, "r") as f:
+                _legacy_guild = str(json.load(f)["guild_id"])
+        except FileNotFoundError:
+            return None
+    return _legacy_guild
+
+
+def partition_key(guild_id: Optional[int]) -> Optional[int]:
+    """
+    Map a guild ID to the partition holding its state.
+
+    DMs (``guild_id`` None) and the legacy guild (see ``legacy_guild_id``)
+    share the ``None`` partition stored in ``activity/`` itself, which lets
+    an existing server keep the data it collected before partitioning.
+    """
+    if guild_id is None or str(guild_id) == legacy_guild_id():
+        return None
+    return guild_id
+
+
+def _holds_data(backend: StorageBackend) -> bool:
+    return bool(backend.top_users(1) or backend.all_team_quests())
+
+
+def _partition_holds_data(guild_id: int) -> bool:
+    """Whether ``activity/guilds/<guild_id>/`` already has players or team quests, without opening it for good."""
+    backend = _backends.get(guild_id)
+    if backend is None:
+        directory = os.path.join(GUILDS_DIR, str(guild_id))
+        if not os.path.isdir(directory):
+            return False
+        backend = create_backend(directory=directory)
+    return _holds_data(backend)
+
+
+def adopt_legacy_guild(guild_ids: Iterable[int]) -> Optional[str]:
+    """
+    Decide at startup which guild keeps the state collected before per-guild partitions existed.
+
+    Nothing changes when LEGACY_GUILD_ID is set or LEGACY_GUILD_FILE records
+    an earlier choice. Otherwise, if ``activity/`` holds players or team
+    quests, ``guild_ids`` is exactly one guild and that guild's own
+    partition is still empty, the guild adopts ``activity/`` and the choice
+    is saved in LEGACY_GUILD_FILE. If ``activity/`` holds data but no guild
+    can be picked, a warning says to set LEGACY_GUILD_ID. Call before any
+    command can touch storage. Returns the legacy guild ID, if any.
+    """
+    global _legacy_guild
+    adopted = legacy_guild_id()
+    if adopted:
+        return adopted
+
+    guild_ids = list(guild_ids)
+    if not _holds_data(get_backend(None)):
+        return None
+    if len(guild_ids) == 1 and not _partition_holds_data(guild_ids[0]):
+        os.makedirs(GUILDS_DIR, exist_ok=True)
+        write_atomic(LEGACY_GUILD_FILE, {"guild_id": guild_ids[0]})
+        _legacy_guild = str(guild_ids[0])
+        log.info("Guild %s adopted the existing state in %s/", guild_ids[0], ACTIVITY_DIR)
+        return _legacy_guild
+    log.warning("%s/ holds players (from DMs or from before per-guild state) that no guild owns, so they do not "
+                "show in any server's leaderboard or profiles. Set LEGACY_GUILD_ID to the guild they belong to.",
+                ACTIVITY_DIR)
+    return None
+
+
+def guild_directory(guild_id: Optional[int] = None) -> str:
+    """
+    Return the directory holding a guild's state, creating it on first use.
+
+    Each guild gets its own ``activity/guilds/<guild_id>/`` with separate user,
+    team-quest and database files, so guilds never share a write path and
+    usernames only need to be unique within a guild.
+    """
+    guild_id = partition_key(guild_id)
+    if guild_id is None:
+        return os.path.abspath(ACTIVITY_DIR)
+
+    directory = os.path.abspath(os.path.join(GUILDS_DIR, str(guild_id)))
+    os.makedirs(directory, exist_ok=True)
+    for filename, key in (("user_list.json", "users"), ("active_team_quest.json", "team_quests")):
+        path = os.path.join(directory, filename)
+        if not os.path.exists(path):
+            write_atomic(path, {key: []})
+    return directory
+
+
+def create_backend(kind: Optional[str] = None, directory: str = ACTIVITY_DIR) -> StorageBackend:
+    """
+    Build the backend named by ``kind`` or the STORAGE_BACKEND environment variable.
+
+    Supported values are ``json`` (default), ``binary`` and ``sqlite``. The
+    binary snapshots and the SQLite database live next to the JSON files in
+    ``directory`` (SQLITE_PATH overrides the database path for ``activity/``)
+    and import them the first time they are opened. Relative paths are
+    resolved now, so the backend keeps writing to the same files if the
+    working directory changes later.
+    """
+    kind = (kind or os.getenv("STORAGE_BACKEND", "json")).lower()
+    directory = os.path.abspath(directory)
+    user_path = os.path.join(directory, os.path.basename(USER_LIST_PATH))
+    team_quest_path = os.path.join(directory, os.path.basename(ACTIVE_TEAM_QUEST_PATH))
+
+    if kind == "json":
+        return JsonBackend(user_path, team_quest_path)
+    if kind == "binary":
+        from binary_store import BinaryBackend
+        return BinaryBackend(directory)
+    if kind == "sqlite":
+        from sqlite_backend import SqliteBackend, DEFAULT_DB_PATH
+        db_path = os.path.join(directory, os.path.basename(DEFAULT_DB_PATH))
+        if directory == os.path.abspath(ACTIVITY_DIR):
+            db_path = os.path.abspath(os.getenv("SQLITE_PATH", db_path))
+        backend = SqliteBackend(db_path)
+        backend.migrate_from_json(JsonBackend(user_path, team_quest_path))
+        return backend
+    raise ValueError(f"Unknown storage backend: {kind}")
+
+
+def on_backend_open(listener: Callable[[Optional[int], StorageBackend], None]) -> None:
+    """
+    Call ``listener(partition, backend)`` for every backend already open and each one opened later.
+
+    ``partition`` is the ``partition_key`` of the guild the backend serves.
+    """
+    with _backends_lock:
+        _open_listeners.append(listener)
+        opened = list(_backends.items())
+    for guild_id, backend in opened:
+        listener(guild_id, backend)
+
+
+class _Opening:
+    """A partition whose backend is being created, so other threads wait for it instead of opening it twice."""
+
+    __slots__ = ("done", "thread", "backend")
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.thread = threading.get_ident()
+        self.backend: Optional[StorageBackend] = None
+
+
+def get_backend(guild_id: Optional[int] = None) -> StorageBackend:
+    """
+    Return the storage backend for a guild (None for DMs), creating it on first use.
+
+    A new backend is only returned once every ``on_backend_open`` listener
+    has run on it (stats backfill, expiry scheduling); other threads asking
+    for the same partition meanwhile wait. The listeners run outside
+    ``_backends_lock``, so opening one partition never blocks the others.
+    """
+    guild_id = partition_key(guild_id)
+    backend = _backends.get(guild_id)
+    if backend is not None:
+        return backend
+    with _backends_lock:
+        backend = _backends.get(guild_id)
+        if backend is not None:
+            return backend
+        waiting = _opening.get(guild_id)
+        if waiting is None:
+            opening = _opening[guild_id] = _Opening()
+        elif waiting.thread == threading.get_ident():
+            # A listener of this very partition asking for it.
+            return waiting.backend
+    if waiting is not None:
+        waiting.done.wait()
+        return get_backend(guild_id)
+
+    try:
+        opening.backend = backend = create_backend(directory=guild_directory(guild_id))
+        ran = 0
+        while True:
+            with _backends_lock:
+                listeners = _open_listeners[ran:]
+                if not listeners:
+                    atexit.register(backend.flush)
+                    _backends[guild_id] = backend
+                    return backend
+            for listener in listeners:
+                listener(guild_id, backend)
+            ran += len(listeners)
+    finally:
+        with _backends_lock:
+            del _opening[guild_id]
+        opening.done.set()
+
+
+def flush_all() -> None:
+    """Flush every backend opened so far."""
+    with _backends_lock:
+        backends = list(_backends.values())
+    for backend in backends:
+        backend.flush()
@@ -0,0 +1,721 @@
+import functools
+import heapq
+import json
+import os
+import random
+import threading
+from array import array
+from collections import deque
+from typing import Any, Callable, Dict, Iterable, List, Optional, Tuple
+from journal import Journal, write_atomic
+from metrics import record_io
+from schema import Quest, QuestRef, QuestStats, StatEvent, TeamQuest, User, UserStats
+
+
+USER_LIST_PATH = "activity/user_list.json"
+ACTIVE_TEAM_QUEST_PATH = "activity/active_team_quest.json"
+QUEST_BAGS_PATH = "activity/quest_bags.json"
+TEAM_QUEST_HISTORY_PATH = "activity/team_quest_history.jsonl"
+SCORE_DAYS_PATH = "activity/score_days.json"
+STATS_PATH = "activity/stats.json"
+FLUSH_INTERVAL = 5.0
+
+
+class JournaledStore:
+    """
+    In-memory state backed by a JSON snapshot plus an append-only journal.
+
+    Every mutation is appended to ``<path>.journal`` as a small record before
+    it is applied in memory. The snapshot file is only rewritten by ``flush``,
+    which runs on a background timer ``flush_interval`` seconds after the first
+    change, or on shutdown; it compacts the journal into the snapshot with an
+    atomic rename. On startup the journal is replayed on top of the snapshot.
+    Records carry a sequence number and the snapshot stores the last one it
+    contains, so a crash at any point never applies a record twice.
+    """
+
+    def __init__(self, path: str, flush_interval: float = FLUSH_INTERVAL):
+        self.path = path
+        self.flush_interval = flush_interval
+        self.journal = Journal(path + ".journal")
+        self._seq = 0
+        self._loaded = False
+        self._dirty = False
+        self._lock = threading.RLock()
+        self._flush_lock = threading.Lock()
+        self._timer: Optional[threading.Timer] = None
+
+    def _restore(self, data: Dict[str, Any]) -> None:
+        """Load state from a snapshot."""
+        raise NotImplementedError
+
+    def _snapshot(self) -> Any:
+        """Return a copy of the current state in snapshot form."""
+        raise NotImplementedError
+
+    def _apply(self, record: Dict[str, Any]) -> None:
+        """Apply one journal record to the in-memory state."""
+        raise NotImplementedError
+
+    def _load_snapshot(self) -> int:
+        """Read the snapshot file into memory and return the last sequence number it contains."""
+        with open(self.path, "r") as f:
+            data = json.load(f)
+        record_io("read", "snapshot", os.path.getsize(self.path))
+        self._restore(data)
+        return data.get("seq", 0)
+
+    def _write_snapshot(self, snapshot: Any) -> None:
+        """Write what ``_snapshot`` returned to disk. Called without the lock held."""
+        write_atomic(self.path, snapshot)
+
+    def _ensure_loaded(self) -> None:
+        """Read the snapshot and replay the journal if not done yet. Caller holds the lock."""
+        if self._loaded:
+            return
+
+        self._seq = self._load_snapshot()
+        for record in self.journal.replay():
+            if record["seq"] > self._seq:
+                self._apply(record)
+                self._seq = record["seq"]
+        self._loaded = True
+        self._recovered()
+
+        if self.journal.exists():
+            # Fold recovered records into the snapshot so the journal starts clean.
+            snapshot = self._snapshot()
+            self.journal.rotate()
+            self._write_snapshot(snapshot)
+            self.journal.discard_rotated()
+
+    def _recovered(self) -> None:
+        """Called once the journal has been replayed, before it is folded into the snapshot. Caller holds the lock."""
+
+    @property
+    def lock(self) -> threading.RLock:
+        """The store's lock, for callers that must keep several stores still while they write to each."""
+        return self._lock
+
+    def next_seq(self) -> int:
+        """Sequence number the next record will get; hold ``lock`` until it is written for that to stay true."""
+        with self._lock:
+            self._ensure_loaded()
+            return self._seq + 1
+
+    def applied(self, seq: int) -> bool:
+        """Whether the record numbered ``seq`` has been written."""
+        with self._lock:
+            self._ensure_loaded()
+            return self._seq >= seq
+
+    def _record(self, record: Dict[str, Any]) -> None:
+        """Journal a mutation and apply it. Caller holds the lock."""
+        self._seq += 1
+        record["seq"] = self._seq
+        self.journal.append(record)
+        self._apply(record)
+
+        self._dirty = True
+        if self._timer is None and self.flush_interval > 0:
+            self._timer = threading.Timer(self.flush_interval, self.flush)
+            self._timer.daemon = True
+            self._timer.start()
+
+    def flush(self) -> None:
+        """Compact the journal into the snapshot file if anything changed."""
+        with self._flush_lock:
+            with self._lock:
+                if self._timer is not None:
+                    self._timer.cancel()
+                    self._timer = None
+                if not self._dirty:
+                    return
+                snapshot = self._snapshot()
+                self.journal.rotate()
+                self._dirty = False
+
+            self._write_snapshot(snapshot)
+            self.journal.discard_rotated()
+
+
+class UserStore(JournaledStore):
+    """
+    User list, kept column-wise: a row number per username, scores in an
+    ``array`` and active quests as indexes into a table of ``QuestRef``s, so
+    a user costs a dict slot and a few machine words rather than a dict of
+    its own. ``User`` objects are only built for the callers that ask for them.
+
+    Rows are only ever appended. Subclasses that keep names elsewhere
+    override ``_find``, ``_append``, ``_name`` and ``_all_names``.
+
+    Journal records: ``score`` (delta), ``assign`` / ``clear`` (active quest),
+    ``batch`` (several score deltas and quest clears applied together) and
+    ``assign_batch`` (active quests for several users).
+    """
+
+    def __init__(self, path: str = USER_LIST_PATH, flush_interval: float = FLUSH_INTERVAL):
+        super().__init__(path, flush_interval)
+        self._rows: Dict[str, int] = {}
+        self._names: List[str] = []
+        self._scores = array("q")
+        self._quests = array("i")
+        self._refs: List[QuestRef] = []
+        self._ref_ids: Dict[QuestRef, int] = {}
+
+    def _ref_id(self, data: Optional[dict]) -> int:
+        """Index of a stored quest reference in the ref table, -1 for no quest."""
+        if not data:
+            return -1
+        ref = QuestRef.from_dict(data)
+        ref_id = self._ref_ids.get(ref)
+        if ref_id is None:
+            ref_id = self._ref_ids[ref] = len(self._refs)
+            self._refs.append(ref)
+        return ref_id
+
+    def _quest(self, row: int) -> Optional[QuestRef]:
+        ref_id = self._quests[row]
+        return self._refs[ref_id] if ref_id >= 0 else None
+
+    def _restore(self, data: Dict[str, Any]) -> None:
+        self._rows = {}
+        self._names = []
+        self._scores = array("q")
+        self._quests = array("i")
+        for user_data in data["users"]:
+            row = self._row(user_data["username"])
+            self._scores[row] = user_data.get("score", 0)
+            self._quests[row] = self._ref_id(user_data.get("active_quest"))
+
+    def _snapshot(self) -> Any:
+        users = [
+            {"username": name, "active_quest": self._refs[quest].to_dict() if quest >= 0 else None, "score": score}
+            for name, quest, score in zip(self._all_names(), self._quests, self._scores)
+        ]
+        return {"users": users, "seq": self._seq}
+
+    def _apply(self, record: Dict[str, Any]) -> None:
+        op = record["op"]
+        if op == "batch":
+            for username, delta in record["scores"].items():
+                self._scores[self._row(username)] += delta
+            for username in record["clear"]:
+                self._quests[self._row(username)] = -1
+            return
+        if op == "assign_batch":
+            for username, quest in record["quests"].items():
+                self._quests[self._row(username)] = self._ref_id(quest)
+            return
+
+        row = self._row(record["user"])
+        if op == "score":
+            self._scores[row] += record["delta"]
+        elif op == "assign":
+            self._quests[row] = self._ref_id(record["quest"])
+        elif op == "clear":
+            self._quests[row] = -1
+
+    def _find(self, username: str) -> Optional[int]:
+        """Row number of a user, or None if they are not stored."""
+        return self._rows.get(username)
+
+    def _append(self, username: str) -> int:
+        """Add an empty row for a new user and return its number."""
+        row = self._rows[username] = len(self._scores)
+        self._names.append(username)
+        self._scores.append(0)
+        self._quests.append(-1)
+        return row
+
+    def _row(self, username: str) -> int:
+        """Row number of a user, appending an empty row if they are new."""
+        row = self._find(username)
+        return row if row is not None else self._append(username)
+
+    def _name(self, row: int) -> str:
+        return self._names[row]
+
+    def _all_names(self) -> List[str]:
+        """Every username, in row order."""
+        return self._names
+
+    def _user(self, row: int) -> User:
+        return User(self._name(row), self._quest(row), self._scores[row])
+
+    def get(self, username: str) -> Optional[User]:
+        """Get User object by username, returns None if not found."""
+        with self._lock:
+            self._ensure_loaded()
+            row = self._find(username)
+            return self._user(row) if row is not None else None
+
+    def get_or_create(self, username: str) -> User:
+        """Get existing user or create a new (unsaved) one."""
+        return self.get(username) or User(username)
+
+    def save(self, user: User) -> None:
+        """Journal whatever changed between the stored user and ``user``."""
+        with self._lock:
+            self._ensure_loaded()
+            row = self._find(user.username)
+            old_score = self._scores[row] if row is not None else 0
+            old_quest = self._quest(row) if row is not None else None
+
+            if row is None or user.score != old_score:
+                self._record({"op": "score", "user": user.username, "delta": user.score - old_score})
+
+            if user.active_quest != old_quest:
+                if user.active_quest:
+                    self._record({"op": "assign", "user": user.username, "quest": user.active_quest.to_dict()})
+                else:
+                    self._record({"op": "clear", "user": user.username})
+
+    def add_scores(self, deltas: Dict[str, int], clear_quests: Iterable[str] = ()) -> Dict[str, int]:
+        """
+        Apply several score deltas as a single journal record.
+
+        Users in ``clear_quests`` also lose their active quest. Returns the
+        new score of every user in ``deltas``.
+        """
+        with self._lock:
+            self._ensure_loaded()
+            self._record({"op": "batch", "scores": dict(deltas), "clear": list(clear_quests)})
+            return {username: self._scores[self._find(username)] for username in deltas}
+
+    def assign_quests(self, assignments: Dict[str, QuestRef]) -> None:
+        """Set several users' active quests as a single journal record."""
+        with self._lock:
+            self._ensure_loaded()
+            quests = {username: ref.to_dict() for username, ref in assignments.items()}
+            self._record({"op": "assign_batch", "quests": quests})
+
+    def all_users(self) -> List[User]:
+        """Return every stored user, in file order."""
+        with self._lock:
+            self._ensure_loaded()
+            return [self._user(row) for row in range(len(self._scores))]
+
+    def scores(self) -> List[Tuple[str, int]]:
+        """Return (username, score) for every user, in file order, without building User objects."""
+        with self._lock:
+            self._ensure_loaded()
+            return list(zip(self._all_names(), self._scores))
+
+    def top_users(self, limit: Optional[int] = None) -> List[User]:
+        """Return the highest-scoring users, ties in file order, by ranking the score column."""
+        with self._lock:
+            self._ensure_loaded()
+            if limit is None:
+                rows = sorted(range(len(self._scores)), key=self._scores.__getitem__, reverse=True)
+            else:
+                rows = heapq.nlargest(limit, range(len(self._scores)), key=self._scores.__getitem__)
+            return [self._user(row) for row in rows]
+
+    def total_score(self) -> int:
+        """Sum of every user's score."""
+        with self._lock:
+            self._ensure_loaded()
+            return sum(self._scores)
+
+
+class TeamQuestStore(JournaledStore):
+    """
+    Registry of active team quests, indexed by quest ID and by player name.
+
+    Quests are held as ``TeamQuest`` objects; callers must treat them as
+    read-only and go through ``add`` / ``complete`` to change the registry.
+    Team quests drawn from the same catalog entry share one ``Quest``.
+
+    Journal records: ``tq_create``, ``tq_create_batch``, ``tq_complete`` and
+    ``tq_expiry`` (a new deadline). A ``tq_complete`` may carry the payout
+    of a completed quest (see ``JsonBackend.complete_team_quest``); payouts
+    replayed from the journal are handed to ``on_recovered`` on load, so
+    that any a crash cut short can be finished.
+    """
+
+    def __init__(self, path: str = ACTIVE_TEAM_QUEST_PATH, flush_interval: float = FLUSH_INTERVAL):
+        super().__init__(path, flush_interval)
+        self.on_recovered: Optional[Callable[[List[Dict[str, Any]]], None]] = None
+        self._replayed_payouts: List[Dict[str, Any]] = []
+        self._quests: Dict[str, TeamQuest] = {}
+        self._by_player: Dict[str, Dict[str, TeamQuest]] = {}
+        self._quest_pool: Dict[tuple, Quest] = {}
+
+    def _load(self, data: Dict[str, Any]) -> TeamQuest:
+        team_quest = TeamQuest.from_dict(data)
+        quest = team_quest.quest
+        key = (quest.quest_id, quest.difficulty, quest.title, quest.description)
+        team_quest.quest = self._quest_pool.setdefault(key, quest)
+        return team_quest
+
+    def _index(self, team_quest: TeamQuest) -> None:
+        self._quests[team_quest.quest_id] = team_quest
+        for player in team_quest.players:
+            self._by_player.setdefault(player, {})[team_quest.quest_id] = team_quest
+
+    def _unindex(self, quest_id: str) -> None:
+        team_quest = self._quests.pop(quest_id, None)
+        if team_quest is None:
+            return
+        for player in team_quest.players:
+            player_quests = self._by_player.get(player)
+            if player_quests is not None:
+                player_quests.pop(quest_id, None)
+                if not player_quests:
+                    del self._by_player[player]
+
+    def _restore(self, data: Dict[str, Any]) -> None:
+        self._quests = {}
+        self._by_player = {}
+        for team_quest_data in data["team_quests"]:
+            self._index(self._load(team_quest_data))
+
+    def _snapshot(self) -> Dict[str, Any]:
+        return {"team_quests": [q.to_dict() for q in self._quests.values()], "seq": self._seq}
+
+    def _apply(self, record: Dict[str, Any]) -> None:
+        op = record["op"]
+        if op == "tq_create":
+            self._index(self._load(record["team_quest"]))
+        elif op == "tq_create_batch":
+            for team_quest_data in record["team_quests"]:
+                self._index(self._load(team_quest_data))
+        elif op == "tq_complete":
+            self._unindex(record["quest_id"])
+            if "payout" in record and not self._loaded:
+                self._replayed_payouts.append(record["payout"])
+        elif op == "tq_expiry":
+            team_quest = self._quests.get(record["quest_id"])
+            if team_quest is not None:
+                team_quest.expires_at = record["expires_at"]
+
+    def get(self, quest_id: str) -> Optional[TeamQuest]:
+        """Get an active team quest by ID, returns None if not found."""
+        with self._lock:
+            self._ensure_loaded()
+            return self._quests.get(quest_id)
+
+    def add(self, team_quest: TeamQuest) -> None:
+        """Add a new active team quest."""
+        with self._lock:
+            self._ensure_loaded()
+            self._record({"op": "tq_create", "team_quest": team_quest.to_dict()})
+
+    def add_many(self, team_quests: List[TeamQuest]) -> None:
+        """Add several new active team quests as a single journal record."""
+        with self._lock:
+            self._ensure_loaded()
+            self._record({"op": "tq_create_batch", "team_quests": [q.to_dict() for q in team_quests]})
+
+    def _recovered(self) -> None:
+        payouts, self._replayed_payouts = self._replayed_payouts, []
+        if payouts and self.on_recovered is not None:
+            self.on_recovered(payouts)
+
+    def complete(self, quest_id: str, payout: Optional[Dict[str, Any]] = None) -> Optional[TeamQuest]:
+        """Remove an active team quest, returning it if it existed; ``payout`` goes into the same record."""
+        with self._lock:
+            self._ensure_loaded()
+            team_quest = self._quests.get(quest_id)
+            if team_quest is not None:
+                record = {"op": "tq_complete", "quest_id": quest_id}
+                if payout is not None:
+                    record["payout"] = payout
+                self._record(record)
+            return team_quest
+
+    def set_expiry(self, quest_id: str, expires_at: Optional[float]) -> None:
+        """Set an active team quest's deadline (a Unix timestamp, or None for none)."""
+        with self._lock:
+            self._ensure_loaded()
+            if quest_id in self._quests:
+                self._record({"op": "tq_expiry", "quest_id": quest_id, "expires_at": expires_at})
+
+    def all_quests(self) -> List[TeamQuest]:
+        """Return every active team quest, oldest first."""
+        with self._lock:
+            self._ensure_loaded()
+            return list(self._quests.values())
+
+    def for_player(self, player: str) -> List[TeamQuest]:
+        """Return the active team quests a player is part of, oldest first."""
+        with self._lock:
+            self._ensure_loaded()
+            return list(self._by_player.get(player, {}).values())
+
+
+class HistoryLog:
+    """
+    Append-only log of finished team quests, one ``TeamQuest.to_history`` line each.
+
+    Nothing is kept in memory: entries are written as quests end and only read
+    back on request, so history grows on disk without slowing startup.
+    """
+
+    def __init__(self, path: str = TEAM_QUEST_HISTORY_PATH):
+        self.path = path
+        self._lock = threading.Lock()
+
+    def append(self, entry: Dict[str, Any]) -> None:
+        """Add one finished quest to the end of the log."""
+        line = json.dumps(entry, separators=(",", ":")) + "\n"
+        with self._lock:
+            with open(self.path, "a") as f:
+                f.write(line)
+        record_io("write", "history", len(line.encode()))
+
+    def read(self, limit: Optional[int] = None) -> List[Dict[str, Any]]:
+        """Return logged entries, oldest first; only the last ``limit`` if given."""
+        if not os.path.exists(self.path):
+            return []
+        record_io("read", "history", os.path.getsize(self.path))
+        entries: deque = deque(maxlen=limit)
+        with open(self.path, "r") as f:
+            for line in f:
+                try:
+                    entries.append(json.loads(line))
+                except json.JSONDecodeError:
+                    # A torn write from a crash can only be the final line.
+                    break
+        return list(entries)
+
+
+@functools.lru_cache(maxsize=1024)
+def bag_order(seed: int, size: int) -> Tuple[int, ...]:
+    """The permutation of ``range(size)`` a bag with ``seed`` deals, in draw order."""
+    order = list(range(size))
+    random.Random(seed).shuffle(order)
+    return tuple(order)
+
+
+def bag_seed(size: int, avoid_first: int = -1) -> int:
+    """A seed for a fresh bag of ``size`` whose first draw is not ``avoid_first``."""
+    while True:
+        seed = random.getrandbits(32)
+        if size < 2 or bag_order(seed, size)[0] != avoid_first:
+            return seed
+
+
+class ShuffleBag:
+    """Where an owner is in one catalog bucket: the bag's seed and how many quests have been drawn."""
+
+    __slots__ = ("version", "size", "seed", "drawn", "last")
+
+    def __init__(self, version: int, size: int, seed: int, drawn: int = 0, last: int = -1):
+        self.version = version
+        self.size = size
+        self.seed = seed
+        self.drawn = drawn
+        self.last = last
+
+
+class BagStore(JournaledStore):
+    """
+    Shuffle bags keyed by (owner, difficulty), so quests do not repeat.
+
+    An owner is any string, such as a username. A bag deals a catalog
+    bucket's indexes in a random order derived from its seed (``bag_order``),
+    so it only stores the seed and a cursor. A refill picks a new seed whose
+    first quest is not the one drawn last. A bag stores the version of the
+    bucket it was filled from and is refilled when that version no longer
+    matches, so catalog edits rebuild bags automatically.
+
+    Journal records: ``bag_fill`` (a new seed) and ``bag_draw`` (one step of
+    the cursor), so both cost O(1) on disk whatever the bucket size.
+    """
+
+    def __init__(self, path: str = QUEST_BAGS_PATH, flush_interval: float = FLUSH_INTERVAL):
+        super().__init__(path, flush_interval)
+        self._bags: Dict[Tuple[str, int], ShuffleBag] = {}
+
+    def _load_snapshot(self) -> int:
+        if not os.path.exists(self.path):
+            # Created by the first flush; older data directories have no bags yet.
+            self._restore({"bags": []})
+            return 0
+        return super()._load_snapshot()
+
+    def _write_snapshot(self, snapshot: Any) -> None:
+        write_atomic(self.path, snapshot, indent=None)
+
+    def _restore(self, data: Dict[str, Any]) -> None:
+        # Bags saved as explicit permutations by older versions have no seed and start over.
+        self._bags = {
+            (bag["owner"], bag["difficulty"]):
+                ShuffleBag(bag["version"], bag["size"], bag["seed"], bag["drawn"], bag["last"])
+            for bag in data["bags"] if "seed" in bag
+        }
+
+    def _snapshot(self) -> Any:
+        bags = [
+            {"owner": owner, "difficulty": difficulty, "version": bag.version, "size": bag.size,
+             "seed": bag.seed, "drawn": bag.drawn, "last": bag.last}
+            for (owner, difficulty), bag in self._bags.items()
+        ]
+        return {"bags": bags, "seq": self._seq}
+
+    def _apply(self, record: Dict[str, Any]) -> None:
+        key = (record["owner"], record["difficulty"])
+        bag = self._bags.get(key)
+        if record["op"] == "bag_fill":
+            if "seed" not in record:
+                # An older version's permutation record; that bag starts over.
+                self._bags.pop(key, None)
+                return
+            last = bag.last if bag is not None else -1
+            self._bags[key] = ShuffleBag(record["version"], record["size"], record["seed"], 0, last)
+        elif record["op"] == "bag_draw" and bag is not None:
+            bag.last = bag_order(bag.seed, bag.size)[bag.drawn]
+            bag.drawn += 1
+
+    def draw(self, owner: str, difficulty: int, version: int, size: int) -> int:
+        """Return the next index out of ``owner``'s bag for a bucket of ``size`` quests at ``version``."""
+        key = (owner, difficulty)
+        with self._lock:
+            self._ensure_loaded()
+            bag = self._bags.get(key)
+            if bag is None or bag.version != version or bag.size != size or bag.drawn >= size:
+                seed = bag_seed(size, bag.last if bag is not None and bag.version == version else -1)
+                self._record({"op": "bag_fill", "owner": owner, "difficulty": difficulty,
+                              "version": version, "size": size, "seed": seed})
+            self._record({"op": "bag_draw", "owner": owner, "difficulty": difficulty})
+            return self._bags[key].last
+
+
+class ScoreDayStore(JournaledStore):
+    """
+    Points each user earned per UTC day (days since the Unix epoch).
+
+    Only days that saw points are kept, and within a day only the users who
+    earned any, so the store grows with activity rather than with the user
+    base. Old days are dropped with ``evict``.
+
+    Journal records: ``day_add`` (one award's deltas) and ``day_evict``.
+    """
+
+    def __init__(self, path: str = SCORE_DAYS_PATH, flush_interval: float = FLUSH_INTERVAL):
+        super().__init__(path, flush_interval)
+        self._days: Dict[int, Dict[str, int]] = {}
+
+    def _load_snapshot(self) -> int:
+        if not os.path.exists(self.path):
+            # Created by the first flush; older data directories have no daily scores yet.
+            self._restore({"days": {}})
+            return 0
+        return super()._load_snapshot()
+
+    def _restore(self, data: Dict[str, Any]) -> None:
+        self._days = {int(day): dict(scores) for day, scores in data["days"].items()}
+
+    def _snapshot(self) -> Any:
+        return {"days": {str(day): dict(scores) for day, scores in self._days.items()}, "seq": self._seq}
+
+    def _apply(self, record: Dict[str, Any]) -> None:
+        if record["op"] == "day_add":
+            scores = self._days.setdefault(record["day"], {})
+            for username, delta in record["deltas"].items():
+                scores[username] = scores.get(username, 0) + delta
+        elif record["op"] == "day_evict":
+            for day in [day for day in self._days if day < record["before"]]:
+                del self._days[day]
+
+    def add(self, day: int, deltas: Dict[str, int]) -> None:
+        """Add points earned on ``day``."""
+        with self._lock:
+            self._ensure_loaded()
+            self._record({"op": "day_add", "day": day, "deltas": deltas})
+
+    def since(self, first_day: int) -> Dict[int, Dict[str, int]]:
+        """Return a copy of the per-user points of every day from ``first_day`` on."""
+        with self._lock:
+            self._ensure_loaded()
+            return {day: dict(scores) for day, scores in self._days.items() if day >= first_day}
+
+    def evict(self, before: int) -> None:
+        """Drop every day before ``before``."""
+        with self._lock:
+            self._ensure_loaded()
+            if any(day < before for day in self._days):
+                self._record({"op": "day_evict", "before": before})
+
+
+class StatsStore(JournaledStore):
+    """
+    Quest counters per player, per catalog quest and for the whole server.
+
+    Each ended quest is one ``stat`` record, applied to the players' and the
+    server's ``UserStats`` and to the quest's ``QuestStats``, so reading any
+    counter is a dictionary lookup. ``backfilled`` remembers that counters
+    were seeded from older data (``stats_backfilled`` record).
+    """
+
+    def __init__(self, path: str = STATS_PATH, flush_interval: float = FLUSH_INTERVAL):
+        super().__init__(path, flush_interval)
+        self._users: Dict[str, UserStats] = {}
+        self._quests: Dict[str, QuestStats] = {}
+        self._server = UserStats()
+        self._backfilled = False
+
+    def _load_snapshot(self) -> int:
+        if not os.path.exists(self.path):
+            # Created by the first flush; older data directories have no counters yet.
+            self._restore({"users": {}, "quests": {}, "server": UserStats().to_list(), "backfilled": False})
+            return 0
+        return super()._load_snapshot()
+
+    def _restore(self, data: Dict[str, Any]) -> None:
+        self._users = {username: UserStats.from_list(stats) for username, stats in data["users"].items()}
+        self._quests = {quest_id: QuestStats.from_list(stats) for quest_id, stats in data["quests"].items()}
+        self._server = UserStats.from_list(data["server"])
+        self._backfilled = data["backfilled"]
+
+    def _snapshot(self) -> Any:
+        return {
+            "users": {username: stats.to_list() for username, stats in self._users.items()},
+            "quests": {quest_id: stats.to_list() for quest_id, stats in self._quests.items()},
+            "server": self._server.to_list(),
+            "backfilled": self._backfilled,
+            "seq": self._seq,
+        }
+
+    def _apply(self, record: Dict[str, Any]) -> None:
+        if record["op"] == "stat":
+            event, difficulty, day = StatEvent(record["event"]), record["difficulty"], record["day"]
+            for username in record["users"]:
+                self._users.setdefault(username, UserStats()).record(event, difficulty, day)
+            self._quests.setdefault(record["quest"], QuestStats()).record(event)
+            self._server.record(event, difficulty, day)
+        elif record["op"] == "stats_backfilled":
+            self._backfilled = True
+
+    def record(self, event: StatEvent, usernames: List[str], quest: QuestRef, day: int) -> None:
+        """Count ``event`` for every player in ``usernames``, for ``quest`` and for the server."""
+        with self._lock:
+            self._ensure_loaded()
+            self._record({"op": "stat", "event": event.value, "users": list(usernames),
+                          "quest": quest.quest_id, "difficulty": quest.difficulty, "day": day})
+
+    def user(self, username: str) -> Optional[UserStats]:
+        """Return a copy of a player's counters, or None if nothing was counted for them."""
+        with self._lock:
+            self._ensure_loaded()
+            stats = self._users.get(username)
+            return UserStats.from_list(stats.to_list()) if stats is not None else None
+
+    def server(self) -> Tuple[UserStats, Dict[str, QuestStats]]:
+        """Return copies of the server's counters and of every quest's."""
+        with self._lock:
+            self._ensure_loaded()
+            return (UserStats.from_list(self._server.to_list()),
+                    {quest_id: QuestStats.from_list(stats.to_list()) for quest_id, stats in self._quests.items()})
+
+    def backfilled(self) -> bool:
+        with self._lock:
+            self._ensure_loaded()
+            return self._backfilled
+
+    def mark_backfilled(self) -> None:
+        with self._lock:
+            self._ensure_loaded()
+            self._record({"op": "stats_backfilled"})
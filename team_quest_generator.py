@@ -1,57 +1,61 @@
-import json
 import random
+import time
 import uuid
 from typing import Optional, Tuple, List
+from expiry import expiry_scheduler, team_quest_deadline
+from leaderboard import current_day, get_window_scores
+from locks import locked, team_quest_locks, user_locks
+from metrics import timed
+from quest_catalog import team_quest_catalog
+from read_cache import cached_read
 from schema import Quest, TeamQuest
-from utils import award_points_to_players
+from storage import get_backend
+from utils import Page, banner, page_count, render_page, reward_lines, update_ranks
 
 
-def load_team_quests() -> dict:
-    """Load team quests from JSON file."""
-    with open("questLists/team_quest_list.json", "r") as f:
-        return json.load(f)
+TEAM_QUEST_PAGE_SIZE = 5
+# Longest team line in a !tactive block, so huge squads cannot crowd out the rest of the page.
+TEAM_LINE_LIMIT = 150
 
 
-def save_team_quest(team_quest: TeamQuest) -> None:
-    """Save a team quest to the active team quests file."""
-    with open("activity/active_team_quest.json", "r") as f:
-        data = json.load(f)
-    
-    data["team_quests"].append(team_quest.to_dict())
-    
-    with open("activity/active_team_quest.json", "w") as f:
-        json.dump(data, f, indent=2)
+@timed
+def save_team_quest(team_quest: TeamQuest, guild_id: Optional[int] = None) -> None:
+    """Save a team quest to the active team quests in the storage backend and schedule its expiry."""
+    get_backend(guild_id).add_team_quest(team_quest)
+    expiry_scheduler.schedule(team_quest, guild_id)
 
 
-def load_active_team_quests() -> dict:
-    """Load active team quests from JSON file."""
-    with open("activity/active_team_quest.json", "r") as f:
-        return json.load(f)
+def new_team_quest(quest: Quest, players: List[str], channel_id: Optional[int] = None) -> TeamQuest:
+    """A fresh active team quest with a random ID and a deadline counted from now."""
+    created_at = time.time()
+    return TeamQuest(quest, players, str(uuid.uuid4())[:8], created_at=created_at,
+                     expires_at=team_quest_deadline(created_at), channel_id=channel_id)
 
 
-def save_active_team_quests(data: dict) -> None:
-    """Save active team quests to JSON file."""
-    with open("activity/active_team_quest.json", "w") as f:
-        json.dump(data, f, indent=2)
+# Shuffle-bag owner for team quests. Each guild's squads share one bag, so the
+# number of bags stays fixed however many different squads form.
+TEAM_BAG_OWNER = "guild"
 
 
-def generate_team_quest(players: List[str], difficulty: int) -> Tuple[Optional[TeamQuest], str]:
-    """Generate a team quest for the given players at the specified difficulty."""
+@timed
+def generate_team_quest(players: List[str], difficulty: int, guild_id: Optional[int] = None,
+                        channel_id: Optional[int] = None) -> Tuple[Optional[TeamQuest], str]:
+    """
+    Generate a team quest for the given players at the specified difficulty.
+
+    ``channel_id`` is where the quest was posted; expiry notices go there.
+    """
     if difficulty < 1 or difficulty > 3:
         return None, "Difficulty must be between 1 and 3."
     
-    data = load_team_quests()
-    matching_quests = [q for q in data["team_quests"] if q["difficulty"] == difficulty]
+    quest = team_quest_catalog.draw(TEAM_BAG_OWNER, difficulty, get_backend(guild_id))
     
-    if not matching_quests:
+    if quest is None:
         return None, f"No team quests available for difficulty {difficulty}."
     
-    quest_data = random.choice(matching_quests)
-    quest = Quest(quest_data["difficulty"], quest_data["title"], quest_data["description"])
-    
-    quest_id = str(uuid.uuid4())[:8]
-    team_quest = TeamQuest(quest, players, quest_id)
-    save_team_quest(team_quest)
+    team_quest = new_team_quest(quest, players, channel_id)
+    quest_id = team_quest.quest_id
+    save_team_quest(team_quest, guild_id)
     
     players_str = ", ".join(players)
     response_text = f"""
@@ -62,7 +66,7 @@ def generate_team_quest(players: List[str], difficulty: int) -> Tuple[Optional[T
 **Mission:** {quest.title}
 **Team:** {players_str}
 **Difficulty:** {'⭐' * quest.difficulty}
-**Quest ID:** {quest_id}
+**Quest ID:** {quest_id}{expiry_line(team_quest)}
 
 **Briefing:**
 {quest.description}
@@ -74,58 +78,129 @@ Good luck, Helldivers!
     return team_quest, response_text
 
 
-def generate_team_quest_message(username: str) -> str:
-    """Generate a custom team quest message for a user. TODO: Implement full logic."""
-    return f"🎯 **TEAM QUEST ALERT**\n\nSoldier {username}, you have been selected for a team mission!\n\nStand by for further orders, soldier!"
+def split_into_squads(players: List[str], squad_size: int = 4) -> List[List[str]]:
+    """Shuffle players into as few squads of at most ``squad_size`` as possible, sizes differing by at most one."""
+    players = list(dict.fromkeys(players))
+    random.shuffle(players)
+    squad_count = max(1, -(-len(players) // squad_size))
+    return [players[i::squad_count] for i in range(squad_count)]
 
 
-def complete_team_quest(quest_id: str) -> str:
-    """Complete a team quest by ID and award points to all players."""
-    team_quests_data = load_active_team_quests()
-    
-    quest_entry = next((q for q in team_quests_data["team_quests"] if q["quest_id"] == quest_id), None)
-    
-    if not quest_entry:
-        return f"❌ Team quest with ID {quest_id} not found."
+@timed
+def generate_team_quests(squads: List[List[str]], difficulty: int, guild_id: Optional[int] = None,
+                         channel_id: Optional[int] = None) -> List[TeamQuest]:
+    """Create a team quest for each squad and store them all in a single write."""
+    team_quests = []
+    for players in squads:
+        quest = team_quest_catalog.draw(TEAM_BAG_OWNER, difficulty, get_backend(guild_id))
+        if quest is None:
+            return []
+        team_quests.append(new_team_quest(quest, players, channel_id))
     
-    difficulty = quest_entry["quest"]["difficulty"]
-    points_per_player = difficulty * 100
-    players = quest_entry["players"]
-    
-    reward_text = f"✅ Team quest completed! Quest ID: {quest_id}\n\n"
-    reward_text += award_points_to_players(players, points_per_player)
+    if team_quests:
+        get_backend(guild_id).add_team_quests(team_quests)
+        for team_quest in team_quests:
+            expiry_scheduler.schedule(team_quest, guild_id)
+    return team_quests
+
+
+def expiry_line(team_quest: TeamQuest) -> str:
+    """A ``**Expires:**`` line in Discord's relative timestamp markup, or nothing if the quest never expires."""
+    if team_quest.expires_at is None:
+        return ""
+    return f"\n**Expires:** <t:{int(team_quest.expires_at)}:R>"
+
+
+def generate_team_quest_message(username: str, team_quest: Optional[TeamQuest] = None) -> str:
+    """Generate the DM telling a squad member they were selected for a team quest."""
+    message = f"🎯 **TEAM QUEST ALERT**\n\nSoldier {username}, you have been selected for a team mission!\n\n"
     
-    team_quests_data["team_quests"] = [q for q in team_quests_data["team_quests"] if q["quest_id"] != quest_id]
-    save_active_team_quests(team_quests_data)
+    if team_quest:
+        message += f"""**Mission:** {team_quest.quest.title}
+**Team:** {", ".join(team_quest.players)}
+**Difficulty:** {'⭐' * team_quest.quest.difficulty}
+**Quest ID:** {team_quest.quest_id}{expiry_line(team_quest)}
+
+Report back with `!tdone {team_quest.quest_id}` once the job is done, soldier!"""
+    else:
+        message += "Stand by for further orders, soldier!"
     
-    return reward_text
+    return message
+
 
+def generate_team_quest_expired_message(team_quest: TeamQuest) -> str:
+    """Generate the notice that a team quest ran out of time."""
+    return f"""⌛ **TEAM QUEST FAILED**
 
-def get_active_team_quests() -> str:
-    """Display all active team quests."""
-    team_quests_data = load_active_team_quests()
-    quests = team_quests_data["team_quests"]
+**Mission:** {team_quest.quest.title}
+**Team:** {", ".join(team_quest.players)}
+**Quest ID:** {team_quest.quest_id}
+
+The window for this mission has closed. Regroup and request a new one with `!tquest`, helldivers."""
+
+
+@timed
+@locked(team_quest_locks)
+def complete_team_quest(quest_id: str, guild_id: Optional[int] = None) -> str:
+    """
+    Complete a team quest by ID and award points to all players.
+
+    Ending the quest, the points, the daily scores and the stats counters
+    go to the backend as one write, so a crash cannot pay a squad for a
+    quest that is still active, or end it without paying.
+    """
+    backend = get_backend(guild_id)
+    team_quest = backend.get_team_quest(quest_id)
     
-    if not quests:
-        return "No active team quests at the moment."
+    if not team_quest:
+        return f"❌ Team quest with ID {quest_id} not found."
     
-    display_text = """
-════════════════════════════════════════
-         ACTIVE TEAM QUESTS
-════════════════════════════════════════
+    points_per_player = team_quest.quest.difficulty * 100
+    # Built from the backend's daily scores on first use, so fetched before they change.
+    window_scores = get_window_scores(guild_id)
+    day = current_day()
+    with user_locks.hold(*team_quest.players):
+        completed = backend.complete_team_quest(quest_id, points_per_player, day)
+        if completed is None:
+            return f"❌ Team quest with ID {quest_id} not found."
+        _, totals = completed
+        window_scores.add(day, {player_name: points_per_player for player_name in totals})
+        update_ranks(totals, guild_id)
+    
+    return f"✅ Team quest completed! Quest ID: {quest_id}\n\n" + reward_lines(totals, points_per_player)
+
+
+def format_team_quest(team_quest: TeamQuest) -> str:
+    """One team quest's block in the !tactive listing."""
+    team = ", ".join(team_quest.players)
+    if len(team) > TEAM_LINE_LIMIT:
+        team = team[:TEAM_LINE_LIMIT - 1] + "…"
+    return f"""**Quest ID:** {team_quest.quest_id}
+**Mission:** {team_quest.quest.title}
+**Team:** {team}
+**Difficulty:** {'⭐' * team_quest.quest.difficulty}
+**Status:** {team_quest.status.value}{expiry_line(team_quest)}
 
 """
-    
-    for quest in quests:
-        players_str = ", ".join(quest["players"])
-        display_text += f"""**Quest ID:** {quest["quest_id"]}
-**Mission:** {quest["quest"]["title"]}
-**Team:** {players_str}
-**Difficulty:** {'⭐' * quest["quest"]["difficulty"]}
-**Status:** {quest["status"]}
 
-"""
-    
-    display_text += "════════════════════════════════════════"
-    return display_text
 
+@timed
+@cached_read
+def get_active_team_quests(player: Optional[str] = None, guild_id: Optional[int] = None, page: int = 1) -> Page:
+    """Display one page of the active team quests, or of those ``player`` is part of."""
+    if player:
+        quests = get_backend(guild_id).team_quests_for_player(player)
+    else:
+        quests = get_backend(guild_id).all_team_quests()
+    
+    if not quests:
+        if player:
+            return Page(f"No active team quests for {player} at the moment.", 1, 1)
+        return Page("No active team quests at the moment.", 1, 1)
+    
+    count = page_count(len(quests), TEAM_QUEST_PAGE_SIZE)
+    page = min(max(page, 1), count)
+    start = (page - 1) * TEAM_QUEST_PAGE_SIZE
+    rows = (format_team_quest(team_quest) for team_quest in quests[start:start + TEAM_QUEST_PAGE_SIZE])
+    summary = f"{len(quests)} active team quests" + (f" for {player}" if player else "") + "."
+    return render_page(rows, page, count, banner("ACTIVE TEAM QUESTS"), summary, TEAM_QUEST_PAGE_SIZE)
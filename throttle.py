@@ -0,0 +1,154 @@
+import os
+import time
+from collections import OrderedDict
+from typing import Hashable, NamedTuple, Optional
+from metrics import registry
+
+
+# Commands per second a user gets back, and how many they can fire in a row.
+USER_COMMAND_RATE = float(os.getenv("USER_COMMAND_RATE", "0.5"))
+USER_COMMAND_BURST = float(os.getenv("USER_COMMAND_BURST", "5"))
+# The same for a whole guild, shared by all its members.
+GUILD_COMMAND_RATE = float(os.getenv("GUILD_COMMAND_RATE", "30"))
+GUILD_COMMAND_BURST = float(os.getenv("GUILD_COMMAND_BURST", "120"))
+# Storage jobs queued or running (services.pending_jobs) above which new commands are turned away.
+MAX_PENDING_COMMANDS = int(os.getenv("MAX_PENDING_COMMANDS", "64"))
+
+# Tokens a command costs; commands not listed cost 1.
+COMMAND_COSTS = {"event": 5, "SOS": 0}
+
+registry.describe("helldiver_commands_refused_total",
+                  "Commands turned away before running, by reason: user_rate, guild_rate or overloaded.")
+
+
+class TokenBucket:
+    __slots__ = ("tokens", "updated", "warned")
+
+    def __init__(self, tokens: float, updated: float):
+        self.tokens = tokens
+        self.updated = updated
+        self.warned = False
+
+
+class RateLimiter:
+    """
+    Token buckets keyed by user or guild: each holds up to ``burst`` tokens
+    and refills at ``rate`` tokens per second.
+
+    Buckets are kept in least recently used order, and a bucket untouched
+    long enough to have refilled completely is dropped, since a fresh one
+    behaves the same. Each ``bucket`` or ``acquire`` is O(1) amortised, and memory stays
+    proportional to the users active in the last ``burst / rate`` seconds.
+    """
+
+    def __init__(self, rate: float, burst: float):
+        self.rate = rate
+        self.burst = burst
+        self.refill_seconds = burst / rate if rate > 0 else float("inf")
+        self._buckets: "OrderedDict[Hashable, TokenBucket]" = OrderedDict()
+
+    def _evict(self, now: float) -> None:
+        while self._buckets:
+            oldest = next(iter(self._buckets.values()))
+            if now - oldest.updated < self.refill_seconds:
+                break
+            self._buckets.popitem(last=False)
+
+    def bucket(self, key: Hashable, now: Optional[float] = None) -> TokenBucket:
+        """``key``'s bucket, refilled up to ``now`` and marked as most recently used."""
+        now = time.monotonic() if now is None else now
+        self._evict(now)
+        bucket = self._buckets.pop(key, None)
+        if bucket is None:
+            bucket = TokenBucket(self.burst, now)
+        else:
+            bucket.tokens = min(self.burst, bucket.tokens + (now - bucket.updated) * self.rate)
+            bucket.updated = now
+        self._buckets[key] = bucket
+        return bucket
+
+    @staticmethod
+    def take(bucket: TokenBucket, cost: float = 1) -> None:
+        """Spend ``cost`` tokens the caller checked ``bucket`` holds."""
+        bucket.tokens -= cost
+        bucket.warned = False
+
+    def acquire(self, key: Hashable, cost: float = 1, now: Optional[float] = None) -> Optional[TokenBucket]:
+        """
+        Take ``cost`` tokens from ``key``'s bucket. Returns None if they were
+        there, or the bucket if the caller must wait (nothing is taken then).
+        """
+        bucket = self.bucket(key, now)
+        if bucket.tokens < cost:
+            return bucket
+        self.take(bucket, cost)
+        return None
+
+    def wait_time(self, bucket: TokenBucket, cost: float = 1) -> float:
+        """Seconds until ``bucket`` holds ``cost`` tokens again."""
+        return (cost - bucket.tokens) / self.rate if self.rate > 0 else float("inf")
+
+    def __len__(self) -> int:
+        return len(self._buckets)
+
+
+class Refusal(NamedTuple):
+    """Why a command was turned away; ``reply`` is None when the user was already told."""
+    reason: str
+    reply: Optional[str]
+
+
+class Throttle:
+    """
+    Admission control in front of the command handlers.
+
+    A command is refused when the storage queue is saturated (everyone gets
+    the same short reply, and no tokens are taken), or when its user or
+    guild has run out of tokens; a refused command takes no tokens from
+    either. A rate-limited user is told once how long to wait and then
+    ignored until their next command goes through, so a spammer cannot make
+    the bot spam back. Call from the event loop only.
+    """
+
+    def __init__(self, user_limiter: Optional[RateLimiter] = None, guild_limiter: Optional[RateLimiter] = None,
+                 max_pending: int = MAX_PENDING_COMMANDS):
+        self.users = RateLimiter(USER_COMMAND_RATE, USER_COMMAND_BURST) if user_limiter is None else user_limiter
+        self.guilds = RateLimiter(GUILD_COMMAND_RATE, GUILD_COMMAND_BURST) if guild_limiter is None else guild_limiter
+        self.max_pending = max_pending
+
+    def admit(self, user_id: Hashable, guild_id: Optional[int], command: str, pending: int,
+              now: Optional[float] = None) -> Optional[Refusal]:
+        """Return None to run ``command``, or the refusal; ``pending`` is ``services.pending_jobs()``."""
+        if pending >= self.max_pending:
+            registry.inc("helldiver_commands_refused_total", reason="overloaded")
+            return Refusal("overloaded", "⏳ The bot is swamped right now, helldiver. Try again in a moment!")
+
+        cost = COMMAND_COSTS.get(command, 1)
+        if not cost:
+            return None
+        # Both buckets must hold the tokens before either is charged, so a
+        # command the guild turns away does not cost its user anything.
+        now = time.monotonic() if now is None else now
+        user_bucket = self.users.bucket(user_id, now)
+        if user_bucket.tokens < cost:
+            return self._refuse("user_rate", user_bucket, self.users.wait_time(user_bucket, cost),
+                                "you're sending commands too fast")
+        guild_bucket = self.guilds.bucket(guild_id, now) if guild_id is not None else None
+        if guild_bucket is not None and guild_bucket.tokens < cost:
+            return self._refuse("guild_rate", guild_bucket, self.guilds.wait_time(guild_bucket, cost),
+                                "this server is sending commands too fast")
+        self.users.take(user_bucket, cost)
+        if guild_bucket is not None:
+            self.guilds.take(guild_bucket, cost)
+        return None
+
+    @staticmethod
+    def _refuse(reason: str, bucket: TokenBucket, wait: float, problem: str) -> Refusal:
+        registry.inc("helldiver_commands_refused_total", reason=reason)
+        if bucket.warned:
+            return Refusal(reason, None)
+        bucket.warned = True
+        return Refusal(reason, f"🛑 Easy there, helldiver: {problem}. Try again in {max(1, round(wait))}s.")
+
+
+throttle = Throttle()
@@ -1,54 +1,54 @@
-import json
-from typing import List, Tuple, Dict, Any, Optional
-import discord
-from schema import User
+import functools
+from itertools import islice
+from typing import TYPE_CHECKING, List, Tuple, Dict, Any, Iterable, NamedTuple, Optional
+from schema import QuestRef, QuestStatus, StatEvent, User
+from leaderboard import SECONDS_PER_DAY, current_day, get_rank_index, record_points
+from locks import user_locks
+from metrics import timed
+from storage import StorageBackend, get_backend, on_backend_open
 
+if TYPE_CHECKING:
+    import discord
 
-def load_user_list() -> Dict[str, Any]:
-    """Load user list from JSON file."""
-    with open("activity/user_list.json", "r") as f:
-        return json.load(f)
 
+DISCORD_MESSAGE_LIMIT = 2000
+RULE = "═" * 40
 
-def save_user_list(users: List[User]) -> None:
-    """Save user list to JSON file."""
-    with open("activity/user_list.json", "w") as f:
-        json.dump({"users": [u.to_dict() for u in users]}, f, indent=2)
 
+@timed
+def load_user_list(guild_id: Optional[int] = None) -> Dict[str, Any]:
+    """Load a guild's user list from the storage backend."""
+    return {"users": [u.to_dict() for u in get_backend(guild_id).all_users()]}
 
-def get_user(username: str) -> Optional[User]:
+
+@timed
+def get_user(username: str, guild_id: Optional[int] = None) -> Optional[User]:
     """Get User object by username, returns None if not found."""
-    data = load_user_list()
-    for user_data in data["users"]:
-        if user_data["username"] == username:
-            return User.from_dict(user_data)
-    return None
+    return get_backend(guild_id).get_user(username)
 
 
-def get_or_create_user(username: str) -> User:
+@timed
+def get_or_create_user(username: str, guild_id: Optional[int] = None) -> User:
     """Get existing user or create a new one."""
-    user = get_user(username)
+    user = get_user(username, guild_id)
     if user:
         return user
     return User(username)
 
 
-def save_user(user: User) -> None:
-    """Save or update a single user in the JSON file."""
-    data = load_user_list()
-    user_entry = next((u for u in data["users"] if u["username"] == user.username), None)
-    
-    if user_entry:
-        user_entry.update(user.to_dict())
-    else:
-        data["users"].append(user.to_dict())
-    
-    save_user_list([User.from_dict(u) for u in data["users"]])
+@timed
+def save_user(user: User, guild_id: Optional[int] = None) -> None:
+    """Save or update a single user in the storage backend."""
+    backend = get_backend(guild_id)
+    backend.save_user(user)
+    get_rank_index(guild_id).update(user.username, user.score)
+    # Cached reads compare versions; the rank index only changed just now.
+    backend.bump_version()
 
 
-async def send_dm_to_users(users: List[discord.User], message: str) -> tuple[int, int]:
+async def send_dm_to_users(users: List["discord.User"], message: str) -> tuple[int, int]:
     """
-    Send a DM to multiple users.
+    Send a DM to multiple users concurrently; see ``fanout.send_to_all``.
     
     Args:
         users: List of discord.User objects to send DMs to
@@ -57,36 +57,156 @@ async def send_dm_to_users(users: List[discord.User], message: str) -> tuple[int
     Returns:
         Tuple of (successful_count, failed_count)
     """
-    successful = 0
-    failed = 0
-    
-    for user in users:
-        try:
-            await user.send(message)
-            successful += 1
-        except discord.Forbidden:
-            failed += 1
-    
-    return successful, failed
+    from fanout import send_to_all
+    report = await send_to_all(users, message)
+    return len(report.delivered), len(report.failed)
 
 
-def award_points_to_players(players: List[str], points_per_player: int) -> str:
+@timed
+def award_points_to_players(players: List[str], points_per_player: int, clear_active_quest: bool = False,
+                            guild_id: Optional[int] = None) -> str:
     """
-    Award points to multiple players and update their scores.
+    Award points to multiple players and update their scores in a single write.
+    
+    Holds every player's lock so the write cannot interleave with another
+    command's read-modify-write of the same user.
     
     Args:
         players: List of player usernames
         points_per_player: Points to award each player
+        clear_active_quest: Also clear each player's active quest in the same write
+        guild_id: Guild whose scores are updated (None for DMs)
     
     Returns:
         Formatted reward message
     """
-    reward_text = ""
+    deltas = {player_name: points_per_player for player_name in players}
+    with user_locks.hold(*deltas):
+        totals = get_backend(guild_id).add_scores(deltas, players if clear_active_quest else ())
+        record_points(deltas, guild_id)
+        update_ranks(totals, guild_id)
+    
+    return reward_lines(totals, points_per_player)
+
+
+def update_ranks(totals: Dict[str, int], guild_id: Optional[int] = None) -> None:
+    """Bring the rank index in line with scores the backend just stored; caller holds the players' locks."""
+    rank_index = get_rank_index(guild_id)
+    for player_name, total in totals.items():
+        rank_index.update(player_name, total)
+    # Cached reads compare versions; the rank index only changed just now.
+    get_backend(guild_id).bump_version()
+
+
+def reward_lines(totals: Dict[str, int], points_per_player: int) -> str:
+    """One line per rewarded player with their new total."""
+    return "".join(f"🎉 {player_name}: +{points_per_player} points (Total: {total})\n"
+                   for player_name, total in totals.items())
+
+
+def record_quest_outcome(event: StatEvent, usernames: List[str], quest: QuestRef, guild_id: Optional[int] = None) -> None:
+    """
+    Count a quest ending towards the players', the quest's and the server's counters.
+    
+    Args:
+        event: How the quest ended
+        usernames: Players the quest belonged to
+        quest: The catalog quest
+        guild_id: Guild whose counters are updated (None for DMs)
+    """
+    get_backend(guild_id).record_stat_event(event, usernames, quest, current_day())
+
+
+def backfill_stats(partition: Optional[int], backend: StorageBackend) -> None:
+    """
+    Seed a partition's counters from older data the first time it is opened.
+    
+    Team quests are replayed from the team-quest history. Solo quests were
+    never logged, so solo counters only count from now on.
+    """
+    if backend.stats_backfilled():
+        return
+    for entry in backend.team_quest_history():
+        event = StatEvent.TEAM_COMPLETED if entry["status"] == QuestStatus.COMPLETED.value else StatEvent.TEAM_FAILED
+        backend.record_stat_event(event, entry["players"], QuestRef(entry["quest"], entry["difficulty"]),
+                                  int(entry["ended_at"] // SECONDS_PER_DAY))
+    backend.mark_stats_backfilled()
+
+
+on_backend_open(backfill_stats)
+
+
+def paginate(lines: List[str], header: str = "", footer: str = "", limit: int = DISCORD_MESSAGE_LIMIT) -> List[str]:
+    """
+    Pack lines into as few messages as fit within ``limit`` characters.
+    
+    Args:
+        lines: Lines to pack, each ending with a newline
+        header: Text every page starts with
+        footer: Text every page ends with
+        limit: Maximum length of one page
     
-    for player_name in players:
-        user = get_or_create_user(player_name)
-        user.score += points_per_player
-        save_user(user)
-        reward_text += f"🎉 {player_name}: +{points_per_player} points (Total: {user.score})\n"
+    Returns:
+        The pages; with more than one, each gets a "Page i/n" line before the footer
+    """
+    budget = limit - len(header) - len(footer) - len("\nPage 999/999\n")
+    pages: List[List[str]] = [[]]
+    size = 0
+    for line in lines:
+        if pages[-1] and size + len(line) > budget:
+            pages.append([])
+            size = 0
+        pages[-1].append(line)
+        size += len(line)
     
-    return reward_text
+    if len(pages) == 1:
+        return [header + "".join(pages[0]) + footer]
+    return [header + "".join(page) + f"\nPage {number}/{len(pages)}\n" + footer
+            for number, page in enumerate(pages, 1)]
+
+
+class Page(NamedTuple):
+    """One page of a long listing."""
+    text: str
+    number: int
+    count: int
+
+
+@functools.lru_cache(maxsize=None)
+def banner(title: str) -> str:
+    """The boxed title block that starts a listing, built once per title."""
+    return f"\n{RULE}\n{title:^40}\n{RULE}\n\n"
+
+
+def page_count(total: int, page_size: int) -> int:
+    """Number of pages ``total`` rows take; an empty listing still has one page."""
+    return max(1, -(-total // page_size))
+
+
+def render_page(rows: Iterable[str], number: int, count: int, header: str, summary: str,
+                page_size: int, limit: int = DISCORD_MESSAGE_LIMIT) -> Page:
+    """
+    Render page ``number`` of ``count`` from the rows that belong on it.
+    
+    ``rows`` is consumed lazily and at most ``page_size`` rows are taken, so
+    callers pass a generator over just that page. Each row is cut to an even
+    share of the space left by the header and footer, so a page never
+    exceeds ``limit`` however long its rows are.
+    
+    Args:
+        rows: The page's rows, each ending with a newline
+        number: 1-based page number
+        count: Total number of pages
+        header: Text the page starts with, e.g. ``banner(title)``
+        summary: Line shown above the footer rule
+        page_size: Maximum number of rows on a page
+        limit: Maximum length of the rendered page
+    
+    Returns:
+        The page
+    """
+    footer = f"\n{summary}" + (f" · Page {number}/{count}" if count > 1 else "") + f"\n{RULE}"
+    row_budget = (limit - len(header) - len(footer)) // page_size
+    body = "".join(row if len(row) <= row_budget else row[:row_budget - 2] + "…\n"
+                   for row in islice(rows, page_size))
+    return Page(header + body + footer, number, count)